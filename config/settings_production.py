@@ -0,0 +1,52 @@
+"""
+Production profile: DJANGO_SETTINGS_MODULE=config.settings_production
+
+Same as config.settings with DEBUG off, templates compiled once per process
+by the cached loader, template fragment caching enabled and static files
+collected with hashed names and served by the app (run collectstatic on
+every deploy).
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import MIDDLEWARE, TEMPLATES, env
+
+DEBUG = env.bool('DEBUG', default=False)
+
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['localhost', '127.0.0.1'])
+
+SECRET_KEY = env('SECRET_KEY', default=SECRET_KEY)  # noqa: F405
+
+# Parse each template once per process instead of on every request.
+# An explicit loader list requires APP_DIRS to be off.
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+# Fragments are keyed on the invoice's updated_at, so entries never go stale;
+# the timeout only bounds memory held by invoices nobody looks at anymore
+CACHES = {
+    **CACHES,  # noqa: F405
+    'template_fragments': env.cache('FRAGMENT_CACHE_URL', default='locmemcache://invoice-fragments'),
+}
+
+# Hashed file names, optimized images and pre-compressed .br/.gz copies
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'invoices.assets.CompressedManifestStaticFilesStorage'},
+}
+
+# Static files are answered before sessions, auth and CSRF get involved
+_security = MIDDLEWARE.index('django.middleware.security.SecurityMiddleware')
+MIDDLEWARE = [*MIDDLEWARE[:_security + 1], 'invoices.assets.StaticFilesMiddleware', *MIDDLEWARE[_security + 1:]]
@@ -20,12 +20,15 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from invoices.instrumentation import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('pages.urls')),
     path('users/', include('users.urls')),
     path('invoices/', include('invoices.urls')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
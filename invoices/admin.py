@@ -1,8 +1,16 @@
 from django.contrib import admin
-from .models import Invoice
+from .models import FolioSequence, Invoice, InvoiceLine
+from .search import filter_matches
+
+class InvoiceLineInline(admin.TabularInline):
+    model = InvoiceLine
+    extra = 0
+    readonly_fields = ['line_subtotal', 'line_discount', 'line_tax', 'line_total']
+
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
+    inlines = [InvoiceLineInline]
     list_display = ['folio', 'title', 'date', 'total', 'currency']
     list_filter = ['currency', 'payment_method', 'date']
     search_fields = ['folio', 'title', 'clt_name', 'sell_name']
@@ -28,3 +36,20 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at')
         }),
     )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the search index (invoices.search) rather than icontains on search_fields
+        if not search_term:
+            return queryset, False
+        return filter_matches(queryset, search_term), False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Totals were calculated before the inline lines were saved
+        form.instance._line_items = None
+        form.instance.save()
+
+
+@admin.register(FolioSequence)
+class FolioSequenceAdmin(admin.ModelAdmin):
+    list_display = ['series', 'prefix', 'padding', 'next_value']
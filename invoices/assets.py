@@ -0,0 +1,194 @@
+"""
+Production static files.
+
+CompressedManifestStaticFilesStorage is Django's manifest storage, so
+{% static %} URLs carry a hash of the file contents. collectstatic also
+does two more things:
+- PNG and JPEG images are re-encoded losslessly before they are hashed;
+- every text asset gets pre-compressed .br (brotli) and .gz (zopfli)
+  copies.
+
+StaticFilesMiddleware serves STATIC_ROOT with no web server in front. It
+sends brotli, then gzip, whichever the client accepts. Hashed names are sent
+with a one-year immutable Cache-Control, so browsers stop revalidating
+them. Other names get STATIC_MAX_AGE.
+"""
+import io
+import json
+import mimetypes
+import os
+import posixpath
+from pathlib import Path
+
+import brotli
+import zopfli.gzip
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+from PIL import Image
+
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.xml', '.html', '.ico')
+OPTIMIZABLE = ('.png', '.jpg', '.jpeg')
+
+# Compressed copies that do not save at least this much are not written
+MIN_SAVING = 0.05
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Content-Encoding -> suffix of the pre-compressed copy, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compress_gzip(data):
+    return zopfli.gzip.compress(data)
+
+
+def compress_brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+def optimize_image(path):
+    """Re-encode a PNG/JPEG losslessly; keep the result only if it is smaller"""
+    with open(path, 'rb') as f:
+        original = f.read()
+    with Image.open(io.BytesIO(original)) as image:
+        buffer = io.BytesIO()
+        if image.format == 'PNG':
+            image.save(buffer, 'PNG', optimize=True)
+        elif image.format == 'JPEG':
+            image.save(buffer, 'JPEG', optimize=True, progressive=True, quality='keep')
+        else:
+            return 0
+    optimized = buffer.getvalue()
+    if len(optimized) >= len(original):
+        return 0
+    with open(path, 'wb') as f:
+        f.write(optimized)
+    return len(original) - len(optimized)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            # Hashing reads the source files; point it at the optimized copies
+            # so both the hash and the hashed file are the optimized image
+            paths = dict(paths)
+            for name in paths:
+                if name.lower().endswith(OPTIMIZABLE):
+                    optimize_image(self.path(name))
+                    paths[name] = (self, name)
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        if not dry_run:
+            names = set(paths) | set(self.hashed_files.values())
+            for name in sorted(names):
+                if name.lower().endswith(COMPRESSIBLE) and self.exists(name):
+                    self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        for compressor, suffix in ((compress_brotli, '.br'), (compress_gzip, '.gz')):
+            compressed = compressor(data)
+            if len(compressed) <= len(data) * (1 - MIN_SAVING):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        stat = os.stat(path)
+        self.last_modified = http_date(stat.st_mtime)
+        # Weak: the encoded copies are not byte-for-byte the same
+        self.etag = f'W/"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = IMMUTABLE if immutable else f'public, max-age={settings.STATIC_MAX_AGE}'
+        self.encoded = [
+            (encoding, path + suffix) for encoding, suffix in ENCODINGS if os.path.exists(path + suffix)
+        ]
+
+
+def _accepted(header):
+    """The encodings an Accept-Encoding header allows"""
+    accepted = set()
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Put it right after SecurityMiddleware. Files are indexed when the process
+    starts, so run collectstatic before starting (or restarting) it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise MiddlewareNotUsed
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.files = self.index(Path(root))
+
+    def index(self, root):
+        hashed = set()
+        manifest = root / ManifestStaticFilesStorage.manifest_name
+        if manifest.exists():
+            hashed = set(json.loads(manifest.read_text()).get('paths', {}).values())
+
+        files = {}
+        for path in root.rglob('*'):
+            if not path.is_file() or path.suffix in ('.br', '.gz') or path == manifest:
+                continue
+            name = path.relative_to(root).as_posix()
+            files[name] = StaticFile(str(path), name in hashed)
+        return files
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            name = posixpath.normpath(request.path_info[len(self.prefix):])
+            static = self.files.get(name)
+            if static is not None:
+                return self.serve(request, static)
+        return self.get_response(request)
+
+    def serve(self, request, static):
+        headers = {
+            'ETag': static.etag,
+            'Last-Modified': static.last_modified,
+            'Cache-Control': static.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if static.etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        path, encoding = static.path, None
+        accepted = _accepted(request.headers.get('Accept-Encoding', ''))
+        for candidate, candidate_path in static.encoded:
+            if candidate in accepted:
+                path, encoding = candidate_path, candidate
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=static.content_type, headers=headers)
+        del response['Content-Disposition']  # FileResponse's, from the file name
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,39 @@
+"""
+Benchmark helpers for the invoices app.
+
+Benchmarks run against a throwaway test database (see benchmark_database),
+never the configured one, and seed it with invoices.benchmarks.data.
+"""
+import time
+from contextlib import contextmanager
+
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """
+    Create the test database(s) for the duration of a benchmark, in the test
+    environment (locmem e-mail, 'testserver' allowed for the test client)
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+
+
+def timed(func, repeat=5):
+    """Run func `repeat` times; return (best seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,111 @@
+"""Synthetic invoices for benchmarks"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+
+from invoices.models import Invoice, InvoiceLine
+from invoices.pricing import engine
+
+CLIENTS = ['Juan Pérez', 'María López', 'Grupo Baja', 'Ferretería Norte', 'Hotel Costa', 'Ana Ruiz']
+SELLERS = ['Rafael Cabrera', 'Luis Soto', 'Carmen Díaz']
+PRODUCTS = [
+    'Cámara IP 4MP', 'Router Cisco RV340', 'Cable UTP Cat6 (m)', 'Switch 24 puertos PoE',
+    'Instalación y configuración', 'Access point Ubiquiti U6', 'DVR 16 canales', 'Rack 12U',
+]
+
+
+def build_lines(rng, count, tax_rate):
+    """Return (lines, totals) for `count` random lines, priced like calculate_totals"""
+    lines = []
+    subtotal = discount = tax = Decimal('0')
+    for position in range(count):
+        price = Decimal(rng.randint(100, 500000)) / 100
+        quantity = rng.randint(1, 20)
+        discount_percent = Decimal(rng.choice([0, 0, 0, 5, 10, 15]))
+        amounts = engine.price_line(price, quantity, discount_percent, Decimal('0'), True, tax_rate)
+        subtotal += amounts['subtotal']
+        discount += amounts['discount']
+        tax += amounts['tax']
+        lines.append(InvoiceLine(
+            position=position,
+            name=rng.choice(PRODUCTS),
+            price=price,
+            quantity=quantity,
+            discount_percent=discount_percent,
+            line_subtotal=amounts['subtotal'],
+            line_discount=amounts['discount'],
+            line_tax=amounts['tax'],
+            line_total=amounts['total'],
+        ))
+    return lines, (subtotal, discount, tax)
+
+
+def seed_invoices(count, lines=(0, 0), batch_size=1000, seed=1, start=0):
+    """
+    Bulk insert `count` invoices with a random number of lines in the
+    `lines` (min, max) range. Bypasses Invoice.save(), so signals (search
+    index) do not run; call invoices.search.rebuild_index() if needed.
+    """
+    rng = random.Random(seed)
+    tax_rate = Decimal('16.00')
+    first_day = date(2020, 1, 1)
+
+    for offset in range(0, count, batch_size):
+        invoices = []
+        invoice_lines = []
+        for number in range(offset, min(offset + batch_size, count)):
+            line_list, (subtotal, discount, tax) = build_lines(rng, rng.randint(*lines), tax_rate)
+            invoice = Invoice(
+                folio=f'BEN-{start + number + 1:07d}',
+                title=f'Proyecto {rng.choice(PRODUCTS)} {number}',
+                date=first_day + timedelta(days=rng.randint(0, 2000)),
+                clt_name=rng.choice(CLIENTS),
+                clt_email='cliente@example.com',
+                clt_phone='6640000000',
+                sell_name=rng.choice(SELLERS),
+                sell_email='ventas@example.com',
+                sell_phone='6641111111',
+                currency=rng.choice(['MXN', 'MXN', 'USD']),
+                payment_method=rng.choice(['cash', 'card', 'transfer']),
+                tax_rate=tax_rate,
+                subtotal=subtotal,
+                total_discount=discount,
+                total_tax=tax,
+                total=subtotal - discount + tax,
+            )
+            invoices.append(invoice)
+            invoice_lines.append(line_list)
+
+        with transaction.atomic():
+            Invoice.objects.bulk_create(invoices)
+            for invoice, line_list in zip(invoices, invoice_lines):
+                for line in line_list:
+                    line.invoice = invoice
+            InvoiceLine.objects.bulk_create([line for line_list in invoice_lines for line in line_list])
+
+
+def make_invoice(line_count, seed=1):
+    """An unsaved invoice with `line_count` in-memory lines"""
+    rng = random.Random(seed)
+    invoice = Invoice(
+        title='Benchmark', date=date(2025, 1, 1), tax_rate=Decimal('16.00'),
+        clt_name=rng.choice(CLIENTS), clt_email='cliente@example.com', clt_phone='6640000000',
+        sell_name=rng.choice(SELLERS), sell_email='ventas@example.com', sell_phone='6641111111',
+    )
+    for _ in range(line_count):
+        invoice.add_product({
+            'name': rng.choice(PRODUCTS),
+            'price': Decimal(rng.randint(100, 500000)) / 100,
+            'quantity': rng.randint(1, 20),
+            'discount_percent': rng.choice([0, 0, 5, 10]),
+        })
+    return invoice
+
+
+def create_invoice(line_count, seed=1):
+    """Like make_invoice, saved through Invoice.save() and read back with its lines"""
+    invoice = make_invoice(line_count, seed=seed)
+    invoice.save()
+    return Invoice.objects.prefetch_related('lines').get(pk=invoice.pk)
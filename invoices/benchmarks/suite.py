@@ -0,0 +1,188 @@
+"""
+Benchmark suite for the invoices app (see the run_benchmarks command).
+
+Every case times one operation at one size and counts its queries. The
+count is checked against the case's budget, so an N+1 regression fails
+the run even when the timings are too noisy to show it. Results are plain
+dicts that are saved as JSON and compared with the results of an earlier
+run.
+"""
+import itertools
+import platform
+import statistics
+import time
+from typing import Callable, NamedTuple
+
+import django
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from invoices.pricing import as_decimal, calculate_totals_many, engine, line_record
+
+from .data import create_invoice, make_invoice, seed_invoices
+
+LINE_SIZES = (1, 10, 100, 1000)
+BATCH_SIZES = (100, 1000)  # invoices of 10 lines for calculate_totals_many
+LIST_SIZES = (10_000, 100_000)
+EDIT_SIZES = (10, 1000)
+
+# The PDF of the largest invoices takes seconds; fewer repeats keep the suite usable
+PDF_REPEAT = {1: 5, 10: 5, 100: 3, 1000: 1}
+
+
+class Case(NamedTuple):
+    name: str
+    size: int
+    func: Callable
+    max_queries: int
+    repeat: int = 5
+
+
+def measure(case):
+    """Run a case once counting queries, then `repeat` times for the timings"""
+    queries = []
+
+    # Not CaptureQueriesContext: every request the test client makes clears
+    # queries_log (request_started -> reset_queries)
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        case.func()
+
+    timings = []
+    for _ in range(case.repeat):
+        start = time.perf_counter()
+        case.func()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'case': case.name,
+        'size': case.size,
+        'best_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'queries': len(queries),
+        'max_queries': case.max_queries,
+    }
+
+
+def _ok(response):
+    """Fail the run instead of timing an error page"""
+    if response.status_code != 200:
+        raise AssertionError(f"{response.request['PATH_INFO']} answered {response.status_code}")
+    return response
+
+
+def _reference_totals(invoice):
+    """calculate_totals through the spec interpreter, as before the generated fast path"""
+    tax_rate = as_decimal(invoice.tax_rate)
+    priced = [
+        engine.price_line(*line_record(line), tax_rate) for line in invoice.get_lines()
+    ]
+    return engine.price_totals(priced, as_decimal(invoice.exchange_rate), invoice.currency)
+
+
+def pricing_cases(sizes=LINE_SIZES, batch_sizes=BATCH_SIZES):
+    for size in sizes:
+        invoice = make_invoice(size)
+        yield Case('calculate_totals', size, invoice.calculate_totals, max_queries=0, repeat=20)
+        yield Case('calculate_totals (interpreted)', size, lambda i=invoice: _reference_totals(i), max_queries=0, repeat=20)
+    for size in batch_sizes:
+        invoices = [make_invoice(10, seed=seed) for seed in range(size)]
+        yield Case('calculate_totals_many', size, lambda i=invoices: calculate_totals_many(i), max_queries=0)
+
+
+def rendering_cases(sizes=LINE_SIZES, pdf=True):
+    from invoices.rendering import InvoiceRenderer
+
+    for size in sizes:
+        renderer = InvoiceRenderer(create_invoice(size))
+        yield Case('get_pages_data', size, lambda r=renderer: r.get_context(preview=False), max_queries=0, repeat=20)
+        if pdf:
+            yield Case(
+                'render_pdf', size, lambda r=renderer: r.write_pdf('http://testserver/'),
+                max_queries=0, repeat=PDF_REPEAT.get(size, 1),
+            )
+
+
+def list_cases(sizes=LIST_SIZES):
+    """inv_list at each table size; the table is grown between sizes"""
+    client = Client()
+    url = reverse('inv_list')
+    seeded = 0
+    for size in sizes:
+        seed_invoices(size - seeded, lines=(1, 3), start=seeded)
+        seeded = size
+        last_page = size // 50
+
+        # Offset pagination: COUNT(*) and the page. Cursor pagination: only the page
+        yield Case('inv_list first page', size, lambda: _ok(client.get(url, {'per_page': 50})), max_queries=2)
+        yield Case(
+            'inv_list last page', size, lambda p=last_page: _ok(client.get(url, {'per_page': 50, 'page': p})),
+            max_queries=2,
+        )
+        yield Case(
+            'inv_list cursor', size, lambda: _ok(client.get(url, {'per_page': 50, 'pagination': 'cursor'})),
+            max_queries=1,
+        )
+        yield Case(
+            'inv_list sorted by client', size,
+            lambda: _ok(client.get(url, {'per_page': 50, 'sort': 'client', 'direction': 'asc'})),
+            max_queries=2,
+        )
+
+
+def edit_cases(sizes=EDIT_SIZES):
+    """The inv_edit AJAX actions and the line edit API; their query counts must not grow with the invoice"""
+    client = Client()
+    ajax = {'content_type': 'application/json', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+    product = {'action': 'add_product', 'name': 'Cable UTP', 'price': '12.50', 'quantity': 3}
+
+    for size in sizes:
+        invoice = create_invoice(size)
+        edit_url = reverse('inv_edit', args=[invoice.pk])
+        lines_url = reverse('inv_edit_lines', args=[invoice.pk])
+        line_id = invoice.get_lines()[0].pk
+
+        def add_and_remove(url=edit_url, last=size):
+            # Keeps the invoice at its size across repeats
+            _ok(client.post(url, product, **ajax))
+            _ok(client.post(url, {'action': 'remove_product', 'index': last}, **ajax))
+
+        def update_line(url=lines_url, pk=line_id, quantities=itertools.cycle([2, 3])):
+            # A different quantity each time, so every call changes the totals
+            operation = {'op': 'update', 'id': pk, 'quantity': next(quantities)}
+            _ok(client.patch(url, {'ops': [operation]}, content_type='application/json'))
+
+        # Every line edit: the invoice (1), BEGIN (1), the conditional invoice
+        # UPDATE (1) and the rollups, one SELECT and one UPDATE for all rows (2).
+        # Changing the product names reindexes the invoice after commit: DELETE,
+        # the lines, INSERT (3).
+        #   add:    5 + MAX(position) (1) + INSERT (1) + reindex (3) = 10
+        #   remove: 5 + line id at the index (1) + the line (1) + DELETE (1) + reindex (3) = 11
+        #   update: 5 + the line (1) + its UPDATE (1) = 7
+        yield Case('inv_edit add+remove product', size, add_and_remove, max_queries=10 + 11)
+        yield Case('inv_edit_lines update', size, update_line, max_queries=7)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': f"{connection.display_name} {'.'.join(map(str, connection.get_database_version()))}",
+        'machine': platform.machine(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(previous, results, threshold=1.25):
+    """(result, previous best_ms) for the cases at least `threshold` times slower than before"""
+    before = {(r['case'], r['size']): r['best_ms'] for r in previous}
+    slower = []
+    for result in results:
+        old = before.get((result['case'], result['size']))
+        if old and result['best_ms'] > old * threshold:
+            slower.append((result, old))
+    return slower
@@ -0,0 +1,47 @@
+"""
+Precomputed, display-ready values for invoice templates.
+
+Line amounts come straight from the Decimal columns that calculate_totals()
+stores, so templates print strings instead of recomputing each cell with
+float filters.
+"""
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.utils.formats import number_format
+
+from .models import CENT
+
+
+def format_amount(value, grouping=True):
+    """Format a Decimal with two decimals, like floatformat:2|intcomma"""
+    return number_format(Decimal(value).quantize(CENT), 2, use_l10n=True, force_grouping=grouping)
+
+
+class LineView(NamedTuple):
+    """One invoice line as the templates show it"""
+    name: str
+    quantity: int
+    price: str
+    discount: str
+    total: str
+
+    @classmethod
+    def from_line(cls, line):
+        if line.discount_percent:
+            discount = f"{format_amount(line.discount_percent, grouping=False)}%"
+        elif line.discount_amount:
+            discount = format_amount(line.discount_amount)
+        else:
+            discount = '-'
+        return cls(
+            name=line.name,
+            quantity=line.quantity,
+            price=format_amount(line.price),
+            discount=discount,
+            total=format_amount(line.line_total),
+        )
+
+
+def line_views(lines):
+    return [LineView.from_line(line) for line in lines]
@@ -0,0 +1,204 @@
+"""
+Spreadsheet exports of the invoices matching the inv_list filters.
+
+Rows are read with values_list().iterator(chunk_size) and written out as
+they arrive, so an export holds one chunk in memory at a time however many
+rows match. 'invoices' mode writes one row per invoice; 'lines' writes one
+row per product line with the invoice's columns repeated.
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import date
+from decimal import Decimal
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+
+from .models import InvoiceLine
+from .streaming import stream_zip
+
+INVOICE_COLUMNS = [
+    'folio', 'date', 'title', 'clt_name', 'clt_email', 'sell_name', 'payment_method',
+    'currency', 'exchange_rate', 'tax_rate', 'subtotal', 'total_discount', 'total_tax', 'total',
+]
+
+# Invoice columns repeated on every line row, then the line's own
+LINE_INVOICE_COLUMNS = ['folio', 'date', 'clt_name', 'sell_name', 'currency', 'exchange_rate']
+LINE_COLUMNS = [
+    'position', 'name', 'price', 'quantity', 'discount_percent', 'discount_amount', 'taxable',
+    'line_subtotal', 'line_discount', 'line_tax', 'line_total',
+]
+
+MODES = ('invoices', 'lines')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_MAX_ROWS = 1048576  # Excel's limit per sheet; longer exports continue on another sheet
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def export_rows(invoices, mode='invoices', chunk_size=2000):
+    """Yield the header and then one list of values per invoice or per line"""
+    if mode == 'invoices':
+        yield INVOICE_COLUMNS
+        for row in invoices.values_list(*INVOICE_COLUMNS).iterator(chunk_size=chunk_size):
+            yield list(row)
+        return
+
+    yield [f'invoice_{column}' for column in LINE_INVOICE_COLUMNS] + LINE_COLUMNS
+    rows = invoices.values_list('pk', *LINE_INVOICE_COLUMNS).iterator(chunk_size=chunk_size)
+    # One line query per chunk of invoices, emitted in the invoices' order
+    for batch in _batched(rows, chunk_size):
+        lines = {}
+        line_rows = (
+            InvoiceLine.objects.using(invoices.db)
+            .filter(invoice_id__in=[row[0] for row in batch])
+            .order_by('invoice_id', 'position', 'id')
+            .values_list('invoice_id', *LINE_COLUMNS)
+        )
+        for invoice_id, *line in line_rows:
+            lines.setdefault(invoice_id, []).append(line)
+        for pk, *invoice in batch:
+            for line in lines.get(pk, ()):
+                yield invoice + line
+
+
+def stream_csv(rows, rows_per_chunk=500):
+    """Yield CSV text a few hundred rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Byte order mark so Excel opens the file as UTF-8
+    buffer.write('\ufeff')
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# --- XLSX ---
+# A minimal SpreadsheetML package written by hand: inline strings (no shared
+# strings table to keep in memory) and one style for dates.
+
+_EXCEL_EPOCH = date(1899, 12, 30)
+_illegal_xml = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+_SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets></workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rIdStyles" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>{sheets}</Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font/></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+    '<cellXfs count="2"><xf/><xf numFmtId="14" applyNumberFormat="1"/></cellXfs>'
+    '</styleSheet>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, Decimal):
+        return f'<c><v>{value:f}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+    text = escape(_illegal_xml.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _sheet(header, rows, rows_per_chunk):
+    parts = [_SHEET_START, '<row>', *map(_cell, header), '</row>']
+    for count, row in enumerate(rows, 1):
+        parts.append('<row>')
+        parts.extend(map(_cell, row))
+        parts.append('</row>')
+        if count % rows_per_chunk == 0:
+            yield ''.join(parts).encode()
+            parts.clear()
+    parts.append(_SHEET_END)
+    yield ''.join(parts).encode()
+
+
+def stream_xlsx(rows, sheet_rows=XLSX_MAX_ROWS, rows_per_chunk=500):
+    """Yield an XLSX workbook chunk by chunk; the header is repeated on every sheet"""
+    rows = iter(rows)
+
+    def members():
+        header = next(rows)
+        sheets = 0
+        pending = next(rows, None)
+        while pending is not None or not sheets:
+            sheets += 1
+            body = islice(chain([pending] if pending is not None else [], rows), sheet_rows - 1)
+            yield f'xl/worksheets/sheet{sheets}.xml', _sheet(header, body, rows_per_chunk)
+            pending = next(rows, None)
+
+        # The package parts that list the sheets go last, once their number is known
+        numbers = range(1, sheets + 1)
+        yield '[Content_Types].xml', _CONTENT_TYPES.format(
+            sheets=''.join(_SHEET_CONTENT_TYPE.format(n=n) for n in numbers)
+        ).encode()
+        yield '_rels/.rels', _ROOT_RELS.encode()
+        yield 'xl/workbook.xml', _WORKBOOK.format(sheets=''.join(
+            f'<sheet name="Sheet{n}" sheetId="{n}" r:id="rId{n}"/>' for n in numbers
+        )).encode()
+        yield 'xl/_rels/workbook.xml.rels', _WORKBOOK_RELS.format(sheets=''.join(
+            f'<Relationship Id="rId{n}" '
+            f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{n}.xml"/>'
+            for n in numbers
+        )).encode()
+        yield 'xl/styles.xml', _STYLES.encode()
+
+    return stream_zip(members(), compression=zipfile.ZIP_DEFLATED)
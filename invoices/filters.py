@@ -0,0 +1,78 @@
+from .models import Invoice
+from .search import filter_matches, search
+
+# Map de campos permitidos
+SORT_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "date": "date",
+    "amount": "total",
+    "client": "clt_name",
+    "seller": "sell_name",
+}
+
+
+def filter_invoices(params):
+    """
+    Apply the inv_list filters and sorting from a QueryDict.
+    Returns (queryset, search_params, sort, direction); shared by the list
+    and the export views so both always agree on what matches.
+    """
+    # --- Filtros ---
+    search_params = {
+        "q": params.get("q", "").strip(),
+        "id": params.get("id", "").strip(),
+        "title": params.get("title", "").strip(),
+        "date": params.get("date", "").strip(),
+        "client": params.get("client", "").strip(),
+        "seller": params.get("seller", "").strip(),
+    }
+
+    # --- Ordenamiento ---
+    sort = params.get("sort", "date")  # default: date
+    direction = params.get("direction", "desc")
+
+    sort_field = SORT_FIELDS.get(sort, "date")
+    prefix = "-" if direction == "desc" else ""
+
+    # id breaks ties so the order (and every page) is deterministic
+    ordering = [prefix + sort_field] if sort_field == "id" else [prefix + sort_field, prefix + "id"]
+    invoices = Invoice.objects.all().order_by(*ordering)
+
+    # --- Filtros aplicados ---
+    # Folios go through the search index (invoices.search). The column filters
+    # keep icontains so any substring matches ("abrera" finds "Cabrera"); on
+    # PostgreSQL the trigram indexes of these columns serve those lookups
+    if search_params["id"]:
+        # isdecimal, not isdigit: int() rejects digits such as "²"
+        if search_params["id"].isdecimal():
+            invoices = invoices.filter(id=int(search_params["id"]))
+        else:
+            invoices = filter_matches(invoices, search_params["id"], "folio")
+    if search_params["title"]:
+        invoices = invoices.filter(title__icontains=search_params["title"])
+    if search_params["date"]:
+        invoices = invoices.filter(date=search_params["date"])
+    if search_params["client"]:
+        invoices = invoices.filter(clt_name__icontains=search_params["client"])
+    if search_params["seller"]:
+        invoices = invoices.filter(sell_name__icontains=search_params["seller"])
+
+    # Free text search, best matches first unless a sort was chosen
+    if search_params["q"]:
+        if "sort" in params:
+            invoices = filter_matches(invoices, search_params["q"])
+        else:
+            invoices = search(invoices, search_params["q"])
+            sort = "relevance"
+
+    return invoices, search_params, sort, direction
+
+
+def filter_month(invoices, month):
+    """Narrow invoices to a "YYYY-MM" month; ValueError when it is not one"""
+    year, _, number = month.partition("-")
+    year, number = int(year), int(number)
+    if not 1 <= number <= 12:
+        raise ValueError(f"Invalid month: {month}")
+    return invoices.filter(date__year=year, date__month=number)
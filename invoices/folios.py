@@ -0,0 +1,88 @@
+"""
+Folio allocation.
+
+Each series has a FolioSequence row that is only ever advanced with an
+atomic UPDATE ... SET next_value = next_value + n, so concurrent creates
+never read the same number. Every process reserves a block of
+INVOICE_FOLIO_BLOCK_SIZE numbers at a time and hands them out from memory,
+so the sequence row is touched once per block instead of once per invoice.
+Unused numbers of a block are skipped when the process exits.
+
+Inside a transaction a block is not kept: its reservation is undone if the
+transaction rolls back, and a cached block would then hand out numbers the
+sequence gives out again. Folios allocated there reserve one number each,
+which rolls back with the invoice.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import FolioSequence
+
+DEFAULT_SERIES = 'COT'
+
+
+def reserve_folios(series=DEFAULT_SERIES, count=1):
+    """
+    Atomically reserve `count` consecutive numbers of a series.
+    Returns (sequence, start, end) with numbers in range(start, end).
+    """
+    with transaction.atomic():
+        # UPDATE first so the row is write-locked before it is read back
+        updated = FolioSequence.objects.filter(series=series).update(
+            next_value=F('next_value') + count
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    FolioSequence.objects.create(series=series, prefix=series, next_value=1 + count)
+            except IntegrityError:
+                # Another worker created the series first
+                FolioSequence.objects.filter(series=series).update(next_value=F('next_value') + count)
+        sequence = FolioSequence.objects.get(series=series)
+    end = sequence.next_value
+    return sequence, end - count, end
+
+
+def reserve_folio_strings(series=DEFAULT_SERIES, count=1):
+    """Reserve `count` folios in one round trip, formatted (for bulk creation)"""
+    sequence, start, end = reserve_folios(series, count)
+    return [sequence.format(number) for number in range(start, end)]
+
+
+class FolioAllocator:
+    """Hands out folios from per-process blocks reserved in FolioSequence"""
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, series=DEFAULT_SERIES):
+        if transaction.get_connection().in_atomic_block:
+            sequence, start, _ = reserve_folios(series, 1)
+            return sequence.format(start)
+
+        with self._lock:
+            block = self._blocks.get(series)
+            if block is None or block['next'] >= block['end']:
+                size = max(1, getattr(settings, 'INVOICE_FOLIO_BLOCK_SIZE', 1))
+                sequence, start, end = reserve_folios(series, size)
+                block = {'sequence': sequence, 'next': start, 'end': end}
+                self._blocks[series] = block
+            number = block['next']
+            block['next'] += 1
+            return block['sequence'].format(number)
+
+    def reset(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+_allocator = FolioAllocator()
+
+
+def allocate_folio(series=DEFAULT_SERIES):
+    """Return the next free folio of a series, e.g. 'COT-0042'"""
+    return _allocator.allocate(series)
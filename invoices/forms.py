@@ -1,5 +1,8 @@
 from django import forms
+from django.db import transaction
 from .models import Invoice
+from .jobs import prerender_invoice
+from .pricing import as_decimal, validate_line
 import json
 from datetime import datetime
 
@@ -9,6 +12,11 @@ class InvoiceForm(forms.ModelForm):
         required=False,
         initial='[]'
     )
+    # Invoice.version the page was loaded with; see Invoice.save
+    version = forms.IntegerField(
+        widget=forms.HiddenInput(),
+        required=False,
+    )
 
     class Meta:
         model = Invoice
@@ -42,7 +50,7 @@ class InvoiceForm(forms.ModelForm):
         
         # Add form-control class to all fields
         for field_name, field in self.fields.items():
-            if field_name != 'products_json':
+            if field_name not in ('products_json', 'version'):
                 if 'class' not in field.widget.attrs:
                     field.widget.attrs['class'] = 'form-control'
         
@@ -55,6 +63,7 @@ class InvoiceForm(forms.ModelForm):
         
         if instance:
             self.fields['products_json'].initial = json.dumps(instance.products)
+            self.fields['version'].initial = instance.version
         
         # Set currency and payment method defaults
         self.fields['currency'].initial = 'MXN'
@@ -76,19 +85,42 @@ class InvoiceForm(forms.ModelForm):
             products = json.loads(data)
             if not isinstance(products, list):
                 raise forms.ValidationError("Products data must be a list")
-            return products
         except json.JSONDecodeError:
             raise forms.ValidationError("Invalid products data format")
 
+        # Values that would give negative totals fail the database constraints
+        for number, product in enumerate(products, 1):
+            if not isinstance(product, dict):
+                raise forms.ValidationError(f"Product {number}: invalid data")
+            try:
+                validate_line(
+                    as_decimal(product.get('price', 0)),
+                    int(as_decimal(product.get('quantity', 1), 1)),
+                    as_decimal(product.get('discount_percent', 0)),
+                    as_decimal(product.get('discount_amount', 0)),
+                )
+            except ValueError as e:
+                raise forms.ValidationError(f"Product {number}: {e}")
+        return products
+
+    def clean_tax_rate(self):
+        tax_rate = self.cleaned_data.get('tax_rate')
+        if tax_rate is not None and tax_rate < 0:
+            raise forms.ValidationError("Tax rate must not be negative")
+        return tax_rate
+
     def save(self, commit=True):
         instance = super().save(commit=False)
         products = self.cleaned_data.get('products_json', [])
         
         # Clear existing products and add new ones
-        instance.products = []
+        instance.clear_products()
         for product in products:
             instance.add_product(product)
         
         if commit:
-            instance.save()
+            # Raises VersionConflict if someone saved the invoice meanwhile
+            instance.save(expected_version=self.cleaned_data.get('version'))
+            # Render the PDF in the background once the new data is visible
+            transaction.on_commit(lambda: prerender_invoice(instance))
         return instance
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Bulk invoice import.
+
+Records are read from CSV or JSONL and validated one by one with
+InvoiceForm, the same rules as the create/edit views. Valid invoices are
+priced with calculate_totals() and written in chunks. For each chunk, one
+round trip reserves the folios, and one transaction bulk_creates the
+invoices and their lines. The search index and sales rollups, which
+Invoice.save()'s signals normally maintain, are updated once per chunk.
+Invalid records are reported with their row number and skipped; the rest
+of the file is still imported.
+
+JSONL: one invoice per line, with its lines in "products" (the
+products_json shape). CSV: one row per product line, product columns
+prefixed with "product_"; consecutive rows with the same "ref" are one
+invoice. A "products" column with a JSON list also works.
+"""
+import csv
+import json
+from typing import NamedTuple
+
+from django.db import DatabaseError, transaction
+
+from .folios import DEFAULT_SERIES, reserve_folio_strings
+from .forms import InvoiceForm
+from .models import Invoice, InvoiceLine
+from .reporting import record_many, snapshot
+from .search import get_backend
+
+PRODUCT_PREFIX = 'product_'
+
+# What the create form pre-fills, for columns a file leaves out
+FORM_DEFAULTS = {
+    field.name: field.get_default()
+    for field in Invoice._meta.fields
+    if field.name in InvoiceForm._meta.fields and field.has_default()
+}
+
+
+class RowError(NamedTuple):
+    row: int
+    ref: str
+    message: str
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    @property
+    def rows(self):
+        return self.created + len(self.errors)
+
+
+def read_jsonl(lines):
+    """Yield (row number, record, error) for each non-blank line"""
+    for row, text in enumerate(lines, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as e:
+            yield row, {}, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield row, {}, "Each line must be a JSON object"
+            continue
+        yield row, record, None
+
+
+def read_csv(lines):
+    """Yield (row number of the first row, record, error), grouping rows by ref"""
+    current = None
+    for row, values in enumerate(csv.DictReader(lines), 2):  # row 1 is the header
+        values = {key.strip(): (value or '').strip() for key, value in values.items() if key}
+        product = {
+            key[len(PRODUCT_PREFIX):]: value
+            for key, value in values.items()
+            if key.startswith(PRODUCT_PREFIX) and value
+        }
+        ref = values.get('ref', '')
+
+        if current and ref and current[1].get('ref') == ref:
+            if product and isinstance(current[1]['products'], list):
+                current[1]['products'].append(product)
+            continue
+
+        if current:
+            yield current
+        record = {key: value for key, value in values.items() if not key.startswith(PRODUCT_PREFIX)}
+        if not record.get('products'):
+            record['products'] = [product] if product else []
+        current = (row, record, None)
+    if current:
+        yield current
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def build_invoice(record):
+    """
+    Validate one record with InvoiceForm and price it.
+    Returns (invoice, None) with the lines in memory, or (None, message).
+    """
+    data = {**FORM_DEFAULTS, **{key: value for key, value in record.items() if value not in ('', None)}}
+    products = data.pop('products', [])
+    data['products_json'] = products if isinstance(products, str) else json.dumps(products, default=str)
+
+    form = InvoiceForm(data)
+    if not form.is_valid():
+        return None, '; '.join(f"{field}: {' '.join(messages)}" for field, messages in form.errors.items())
+    try:
+        invoice = form.save(commit=False)
+    except (AttributeError, TypeError, ValueError):
+        # A product that is not an object
+        return None, "products_json: Invalid products data format"
+    invoice.calculate_totals()
+    return invoice, None
+
+
+def _write(invoices):
+    """Insert invoices and their lines, then index them and add them to the rollups"""
+    with transaction.atomic():
+        Invoice.objects.bulk_create(invoices)
+        lines = []
+        for invoice in invoices:
+            for position, line in enumerate(invoice.get_lines()):
+                line.invoice = invoice
+                line.position = position
+                lines.append(line)
+        InvoiceLine.objects.bulk_create(lines)
+
+        backend = get_backend()
+        for invoice in invoices:
+            backend.index(invoice)
+        record_many([snapshot(invoice) for invoice in invoices])
+
+
+def _reset(invoice):
+    invoice.pk = None
+    invoice._state.adding = True
+    for line in invoice.get_lines():
+        line.pk = None
+        line._state.adding = True
+
+
+def _flush(chunk, result, series):
+    folios = reserve_folio_strings(series, len(chunk))
+    for (_, _, invoice), folio in zip(chunk, folios):
+        invoice.folio = folio
+        invoice.version = 1
+    try:
+        _write([invoice for _, _, invoice in chunk])
+        result.created += len(chunk)
+        return
+    except DatabaseError:
+        pass
+
+    # Find the rows the database rejected; the others still go in
+    for row, ref, invoice in chunk:
+        _reset(invoice)
+        try:
+            _write([invoice])
+            result.created += 1
+        except DatabaseError as e:
+            result.errors.append(RowError(row, ref, str(e)))
+
+
+def import_invoices(records, chunk_size=500, series=DEFAULT_SERIES, dry_run=False):
+    """
+    Import (row, record, error) tuples from a READERS function.
+    With dry_run only validate. Returns an ImportResult.
+    """
+    result = ImportResult()
+    chunk = []
+    for row, record, error in records:
+        ref = str(record.get('ref', ''))
+        invoice = None
+        if error is None:
+            invoice, error = build_invoice(record)
+        if error:
+            result.errors.append(RowError(row, ref, error))
+            continue
+
+        if dry_run:
+            result.created += 1
+            continue
+        chunk.append((row, ref, invoice))
+        if len(chunk) >= chunk_size:
+            _flush(chunk, result, series)
+            chunk = []
+
+    if chunk:
+        _flush(chunk, result, series)
+    return result
@@ -0,0 +1,230 @@
+"""
+Per-request performance instrumentation.
+
+InstrumentationMiddleware times each request and everything it does:
+- SQL: count and time, through connection.execute_wrapper;
+- template rendering: through the TimedDjangoTemplates backend;
+- PDF rendering and SMTP: any block wrapped in span().
+
+Each request's breakdown goes to its Server-Timing header (visible in the
+browser's dev tools) and to one JSON line on the 'invoices.instrumentation'
+logger. Every measurement also feeds an in-process histogram, which
+metrics_view() exposes in the Prometheus text format. Histograms are per
+process; with several workers, each worker answers for itself.
+
+Spans also record outside requests (render workers, the e-mail outbox);
+those go to the histograms only.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, as Prometheus client libraries use by default
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms by (metric name, labels)"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            snapshot = [(key, list(h.buckets), list(h.counts), h.count, h.sum) for key, h in items]
+
+        lines = []
+        seen = set()
+        for (name, labels), buckets, counts, count, total in snapshot:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels)
+            prefix = f"{label_text}," if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            suffix = f"{{{label_text}}}" if label_text else ''
+            lines.append(f"{name}_sum{suffix} {total}")
+            lines.append(f"{name}_count{suffix} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """What one request spent its time on"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = {}  # name -> [count, seconds]
+
+    def add_span(self, name, seconds):
+        entry = self.spans.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [
+            f'{name};dur={seconds * 1000:.1f};desc="{count}x"' for name, (count, seconds) in self.spans.items()
+        ]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def span(name):
+    """Time a block; recorded in the current request (if any) and the span histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_span(name, elapsed)
+        registry.observe('invoices_span_seconds', elapsed, span=name)
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with span('template'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with every top-level render timed as the
+    'template' span (includes and extends are part of their parent's render)
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class InstrumentationMiddleware:
+    """Put it first in MIDDLEWARE so the timings cover the other middleware too"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+
+        def count_query(execute, sql, params, many, context):
+            query_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                metrics.queries += 1
+                metrics.db_time += time.perf_counter() - query_start
+
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        # For streaming responses this is the time to the first byte
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe('invoices_request_seconds', total, view=view)
+        registry.observe('invoices_db_seconds', metrics.db_time, view=view)
+
+        response['Server-Timing'] = metrics.server_timing(total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'db_queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'spans': {name: round(seconds * 1000, 2) for name, (_, seconds) in metrics.spans.items()},
+        }))
+        return response
+
+
+def metrics_view(request):
+    """
+    The histograms in the Prometheus text format. When METRICS_TOKEN is set,
+    requests must send it as "Authorization: Bearer <token>"; without one
+    only staff users (or anyone under DEBUG) may read them.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        user = getattr(request, 'user', None)
+        allowed = settings.DEBUG or (user is not None and user.is_staff)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
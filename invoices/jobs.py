@@ -0,0 +1,151 @@
+"""
+Background PDF rendering.
+
+WeasyPrint layout is CPU bound, so it runs in a process pool instead of the
+request thread. The request process loads the invoice and hands a pickled copy
+to a worker, which only renders; the worker never touches the database. Job
+state lives in PDFRenderJob so any WSGI process can answer status polls, and
+the bytes land in the shared PDF cache.
+"""
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import PDFRenderJob
+from .pdf_cache import get_pdf_cache
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # Needed when the pool uses spawn/forkserver instead of fork
+    django.setup()
+
+
+def _render_in_worker(invoice, base_url, preview):
+    from .rendering import InvoiceRenderer
+
+    return InvoiceRenderer(invoice).write_pdf(base_url, preview=preview)
+
+
+def get_executor():
+    """Return the process-wide render pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'INVOICE_RENDER_WORKERS', None) or os.cpu_count()
+            _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def submit_render(invoice, base_url, preview=False):
+    """Render a PDF in the pool and return the Future with its bytes"""
+    # Workers have no database access, so the lines must travel with the invoice
+    invoice.get_lines()
+    try:
+        return get_executor().submit(_render_in_worker, invoice, base_url, preview)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM); start a fresh pool and try once more
+        _reset_executor()
+        return get_executor().submit(_render_in_worker, invoice, base_url, preview)
+
+
+def render_many(invoices, base_url, window=None):
+    """
+    Yield (invoice, pdf_bytes) in input order. Cached PDFs are reused and
+    misses render in parallel across the pool, with at most `window` PDFs in
+    flight or buffered so memory stays bounded for long iterables.
+    """
+    cache = get_pdf_cache()
+    window = window or 2 * (getattr(settings, 'INVOICE_RENDER_WORKERS', None) or os.cpu_count())
+    pending = deque()
+
+    def resolve(item):
+        invoice, key, result = item
+        if isinstance(result, bytes):
+            return invoice, result
+        pdf_bytes = result.result()
+        cache.set(key, pdf_bytes)
+        return invoice, pdf_bytes
+
+    for invoice in invoices:
+        key = cache.make_key(invoice)
+        result = cache.get(key)
+        if result is None:
+            result = submit_render(invoice, base_url)
+        pending.append((invoice, key, result))
+        if len(pending) >= window:
+            yield resolve(pending.popleft())
+
+    while pending:
+        yield resolve(pending.popleft())
+
+
+def enqueue_render(invoice, base_url=None, preview=False):
+    """
+    Create a PDFRenderJob for the invoice and render it in the background.
+    Returns immediately; if the PDF is already cached the job is done at once.
+    """
+    cache = get_pdf_cache()
+    cache_key = cache.make_key(invoice, preview=preview)
+    job = PDFRenderJob.objects.create(invoice=invoice, preview=preview, cache_key=cache_key)
+
+    if cache.get(cache_key) is not None:
+        PDFRenderJob.objects.filter(pk=job.pk).update(status='done', finished_at=timezone.now())
+        job.status = 'done'
+        return job
+
+    base_url = base_url or settings.INVOICE_PDF_BASE_URL
+    PDFRenderJob.objects.filter(pk=job.pk).update(status='running')
+    job.status = 'running'
+    future = submit_render(invoice, base_url, preview)
+    future.add_done_callback(lambda f: _finish_job(job.pk, cache_key, f))
+    return job
+
+
+def _finish_job(job_pk, cache_key, future):
+    # Runs on the executor's management thread, which has its own DB connection
+    try:
+        if future.cancelled():
+            status, error = 'failed', 'cancelled'
+        elif future.exception() is not None:
+            status, error = 'failed', str(future.exception())
+            logger.error("PDF render job %s failed: %s", job_pk, error)
+        else:
+            get_pdf_cache().set(cache_key, future.result())
+            status, error = 'done', ''
+        PDFRenderJob.objects.filter(pk=job_pk).update(
+            status=status, error=error, finished_at=timezone.now()
+        )
+    finally:
+        close_old_connections()
+
+
+def prerender_invoice(invoice):
+    """Warm the PDF cache after an invoice is saved, if enabled in settings"""
+    if not getattr(settings, 'INVOICE_PDF_PRERENDER', False):
+        return None
+    try:
+        return enqueue_render(invoice)
+    except Exception:
+        logger.exception("Could not pre-render invoice %s", invoice.pk)
+        return None
@@ -0,0 +1,132 @@
+"""
+Pagination of invoice lines by estimated height instead of a fixed count.
+
+The PDF repeats the products table and the financial summary on every
+page, so each page holds as many rows as fit between them. A row is as
+tall as its product name once wrapped in the name column. The wrapping is
+estimated from character widths (Helvetica's, a little wider than the
+Roboto the template asks for, so estimates err towards fewer rows) and
+cached per (name, width).
+
+Each template has a PageProfile with its dimensions in millimetres.
+INVOICE_PAGE_PROFILES overrides fields per template name, e.g.
+{'invoices/inv_template.html': {'name_column_width': 90}}.
+"""
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .pdf_cache import TEMPLATE_NAME
+
+# Advance widths of Helvetica (printable ASCII), in thousandths of an em
+_WIDTHS = dict(zip(
+    ' !"#$%&\'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefghijklmnopqrstuvwxyz{|}~',
+    (
+        278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+        1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+        333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+        556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+    ),
+))
+_DEFAULT_WIDTH = 556
+
+
+class PageProfile(NamedTuple):
+    """Vertical space on one template's pages and its product rows, in mm"""
+    # Inside the page padding
+    page_height: float
+    # Products title, table header, financial summary and page number; every page
+    page_overhead: float
+    # Logo header and client block, first page only
+    first_page_overhead: float
+    # Text of the name column and of the client block
+    name_column_width: float
+    comments_width: float
+    font_size: float
+    line_height: float
+    # Cell padding and border of a row
+    row_padding: float
+
+
+PAGE_PROFILES = {
+    # A4 with 10mm padding; 0.8rem text with Bootstrap's 1.5 line height.
+    # The overheads are calibrated so one-line rows paginate as before: 11
+    # rows on the first page, 19 on the others.
+    TEMPLATE_NAME: PageProfile(
+        page_height=277,
+        page_overhead=116,
+        first_page_overhead=64,
+        name_column_width=66,
+        comments_width=91,
+        font_size=3.39,
+        line_height=5.08,
+        row_padding=3.32,
+    ),
+}
+
+
+def get_profile(template_name=TEMPLATE_NAME):
+    profile = PAGE_PROFILES.get(template_name, PAGE_PROFILES[TEMPLATE_NAME])
+    overrides = getattr(settings, 'INVOICE_PAGE_PROFILES', {}).get(template_name)
+    return profile._replace(**overrides) if overrides else profile
+
+
+def _char_width(char):
+    width = _WIDTHS.get(char)
+    if width is None:
+        # Accented letters are about as wide as their base letter
+        base = unicodedata.normalize('NFD', char)[:1]
+        width = _WIDTHS.get(base, _DEFAULT_WIDTH)
+    return width
+
+
+@lru_cache(maxsize=20_000)
+def text_lines(text, width, font_size):
+    """How many lines `text` wraps to in a column `width` mm wide"""
+    capacity = width / font_size * 1000  # the column in thousandths of an em
+    space = _WIDTHS[' ']
+    lines, used = 1, 0
+    for word in str(text).split():
+        word_width = sum(_char_width(char) for char in word)
+        if used and used + space + word_width <= capacity:
+            used += space + word_width
+            continue
+        if used:
+            lines += 1
+        # A word longer than the column is broken across lines
+        while word_width > capacity:
+            lines += 1
+            word_width -= capacity
+        used = word_width
+    return lines
+
+
+def row_height(name, profile):
+    return text_lines(name, profile.name_column_width, profile.font_size) * profile.line_height + profile.row_padding
+
+
+def paginate(rows, profile, comments=''):
+    """
+    Pack rows (anything with a .name) into pages, first page first.
+    A row taller than a whole page gets a page of its own.
+    """
+    first_page = profile.first_page_overhead
+    if comments:
+        # "Comentarios adicionales:" shares the first line with the text
+        extra = text_lines(f"Comentarios adicionales: {comments}", profile.comments_width, profile.font_size)
+        first_page += extra * profile.line_height
+
+    pages = [[]]
+    available = profile.page_height - profile.page_overhead - first_page
+    for row in rows:
+        height = row_height(row.name, profile)
+        if height > available and pages[-1]:
+            pages.append([])
+            available = profile.page_height - profile.page_overhead
+        pages[-1].append(row)
+        available -= height
+    return pages
@@ -0,0 +1,220 @@
+"""
+Incremental line edits for inv_edit.
+
+apply_line_ops() applies a batch of add/update/remove/move operations to one
+invoice, touching only the lines the batch names. Invoice totals are the sum
+of the rounded line amounts, so they are adjusted by the difference of each
+changed line instead of recalculated over every line, and the invoice row is
+updated with a single conditional UPDATE that doubles as the optimistic
+concurrency check on Invoice.version.
+
+Operations (a JSON list, applied in order):
+
+    {"op": "add", "name": ..., "price": ..., "quantity": ..., "ref": ...}
+    {"op": "update", "id": 12, "quantity": 3}
+    {"op": "remove", "id": 12}
+    {"op": "move", "id": 12, "before": 15}   # "before": null moves it last
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Invoice, InvoiceLine, VersionConflict
+from .pdf_cache import get_pdf_cache
+from .pricing import validate_line
+from .reporting import record_change, snapshot
+from .search import index_invoice
+
+OPERATIONS = ('add', 'update', 'remove', 'move')
+
+# Editable line fields and how request values are converted
+LINE_FIELDS = {
+    'name': lambda value: str(value)[:255],
+    'price': Decimal,
+    'quantity': int,
+    'discount_percent': Decimal,
+    'discount_amount': Decimal,
+    'taxable': bool,
+    'warranty_months': int,
+}
+
+AMOUNT_FIELDS = ['line_subtotal', 'line_discount', 'line_tax']
+
+TOTAL_FIELDS = ['subtotal', 'total_discount', 'total_tax', 'total']
+
+
+class LineEditError(ValueError):
+    """An operation is malformed or names a line that does not exist"""
+
+
+def parse_line_fields(data):
+    """Return the model values for the line fields present in data"""
+    values = {}
+    for field, convert in LINE_FIELDS.items():
+        if field not in data:
+            continue
+        try:
+            values[field] = convert(str(data[field]) if convert is Decimal else data[field])
+        except (InvalidOperation, TypeError, ValueError):
+            raise LineEditError(f"Invalid value for {field}: {data[field]!r}")
+    return values
+
+
+def _check_amounts(line):
+    """Reject values the invoice_totals_non_negative constraint would refuse"""
+    try:
+        validate_line(line.price, line.quantity, line.discount_percent, line.discount_amount)
+    except ValueError as e:
+        raise LineEditError(f"Line {line.pk or line._ref}: {e}")
+
+
+def _amounts(line):
+    return [getattr(line, field) for field in AMOUNT_FIELDS]
+
+
+def apply_line_ops(invoice, operations, version=None):
+    """
+    Apply a batch of line operations to a saved invoice.
+
+    `version` is the Invoice.version the client edited; None skips the check.
+    Returns {'version', 'lines', 'removed', 'totals'} with only the lines that
+    were added or changed. Raises LineEditError or VersionConflict, in which
+    case nothing is written.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise LineEditError("ops must be a non-empty list")
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise LineEditError(f"Unknown operation: {operation!r}")
+    if version is not None and int(version) != invoice.version:
+        raise VersionConflict(invoice)
+
+    referenced = set()
+    for operation in operations:
+        referenced.update(operation[key] for key in ('id', 'before') if operation.get(key) is not None)
+
+    tax_rate = invoice._safe_decimal(invoice.tax_rate)
+    delta = [Decimal('0')] * len(AMOUNT_FIELDS)
+    added, changed, removed = [], {}, []
+    names_changed = False
+
+    with transaction.atomic(using=invoice._state.db):
+        rollup_snapshot = snapshot(invoice)
+        lines = InvoiceLine.objects.filter(invoice=invoice).in_bulk(referenced)
+        next_position = None
+
+        def get_line(pk):
+            line = lines.get(pk)
+            if line is None:
+                raise LineEditError(f"Line {pk} not found")
+            return line
+
+        def last_position():
+            nonlocal next_position
+            if next_position is None:
+                current = invoice.lines.aggregate(last=Max('position'))['last']
+                next_position = -1 if current is None else current
+            next_position += 1
+            return next_position
+
+        for operation in operations:
+            kind = operation['op']
+
+            if kind == 'add':
+                line = InvoiceLine(invoice=invoice, **parse_line_fields(operation))
+                line.position = last_position()
+                line._ref = operation.get('ref')
+                _check_amounts(line)
+                invoice.calculate_line(line, tax_rate)
+                for i, amount in enumerate(_amounts(line)):
+                    delta[i] += amount
+                added.append(line)
+                names_changed = True
+                continue
+
+            line = get_line(operation.get('id'))
+
+            if kind == 'update':
+                before = _amounts(line)
+                for field, value in parse_line_fields(operation).items():
+                    names_changed |= field == 'name' and value != line.name
+                    setattr(line, field, value)
+                _check_amounts(line)
+                invoice.calculate_line(line, tax_rate)
+                for i, (old, new) in enumerate(zip(before, _amounts(line))):
+                    delta[i] += new - old
+                changed[line.pk] = line
+
+            elif kind == 'remove':
+                for i, amount in enumerate(_amounts(line)):
+                    delta[i] -= amount
+                removed.append(line.pk)
+                changed.pop(line.pk, None)
+                del lines[line.pk]
+                names_changed = True
+
+            elif kind == 'move':
+                if operation.get('before') is None:
+                    line.position = last_position()
+                else:
+                    target = get_line(operation['before']).position
+                    # Open a gap at the target; one UPDATE however long the invoice is
+                    InvoiceLine.objects.filter(invoice=invoice, position__gte=target).update(
+                        position=F('position') + 1
+                    )
+                    for other in [*lines.values(), *added]:
+                        if other.position >= target:
+                            other.position += 1
+                    if next_position is not None:
+                        next_position += 1
+                    line.position = target
+                changed[line.pk] = line
+
+        if removed:
+            InvoiceLine.objects.filter(invoice=invoice, pk__in=removed).delete()
+        if added:
+            InvoiceLine.objects.bulk_create(added)
+        if changed:
+            InvoiceLine.objects.bulk_update(list(changed.values()), InvoiceLine.UPDATABLE_FIELDS)
+
+        subtotal, discount, tax = delta
+        now = timezone.now()
+        updated = Invoice.objects.filter(pk=invoice.pk, version=invoice.version).update(
+            subtotal=F('subtotal') + subtotal,
+            total_discount=F('total_discount') + discount,
+            total_tax=F('total_tax') + tax,
+            total=F('total') + subtotal - discount + tax,
+            version=F('version') + 1,
+            updated_at=now,
+        )
+        if not updated:
+            # Someone saved the invoice between our read and this write
+            raise VersionConflict(invoice)
+
+        # Every write bumps the version, so the row held the totals we read;
+        # apply the same increments here instead of reading them back
+        invoice.subtotal += subtotal
+        invoice.total_discount += discount
+        invoice.total_tax += tax
+        invoice.total += subtotal - discount + tax
+        invoice.version += 1
+        invoice.updated_at = now
+        # The UPDATE bypasses the post_save signal, so move the rollups here
+        record_change(rollup_snapshot, snapshot(invoice), invoice._state.db)
+        invoice._line_items = None
+
+        if names_changed:
+            transaction.on_commit(lambda: index_invoice(invoice), using=invoice._state.db)
+        transaction.on_commit(lambda: get_pdf_cache().invalidate(invoice.pk), using=invoice._state.db)
+
+    return {
+        'version': invoice.version,
+        'lines': [
+            {**line.as_product(), 'position': line.position, 'ref': getattr(line, '_ref', None)}
+            for line in [*added, *changed.values()]
+        ],
+        'removed': removed,
+        'totals': {field: float(getattr(invoice, field)) for field in TOTAL_FIELDS},
+    }
@@ -0,0 +1,147 @@
+import json
+import random
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection, connections
+
+from invoices import folios
+from invoices.benchmarks import benchmark_database
+from invoices.benchmarks.data import PRODUCTS, make_invoice, seed_invoices
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test concurrent invoice creates and inv_edit-style line edits, "
+        "comparing Django's default connection settings with the configured "
+        "DATABASES profile (WAL/busy_timeout on SQLite, persistent or pooled "
+        "connections)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--ops', type=int, default=100, help="Operations per thread")
+        parser.add_argument('--create-ratio', type=float, default=0.3)
+        parser.add_argument('--seed-rows', type=int, default=500)
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        configured = connection.settings_dict
+        profiles = {
+            'default': {'OPTIONS': {}, 'CONN_MAX_AGE': 0},
+            'configured': {
+                'OPTIONS': dict(configured.get('OPTIONS', {})),
+                'CONN_MAX_AGE': configured['CONN_MAX_AGE'],
+            },
+        }
+
+        results = []
+        for name, overrides in profiles.items():
+            result = self.run_profile(name, overrides, options)
+            results.append(result)
+            self.stdout.write(
+                f"{name:<10} {result['ops_per_second']:8.1f} ops/s  "
+                f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+                f"errors {result['errors']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run_profile(self, name, overrides, options):
+        original = {key: connection.settings_dict.get(key) for key in overrides}
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        original_test_name = test_settings.get('NAME')
+        connection.settings_dict.update(overrides)
+        connection.close()
+        folios._allocator.reset()
+
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # An in-memory test database shares one cache and never uses WAL
+                test_settings['NAME'] = str(Path(directory) / f'{name}.sqlite3')
+            try:
+                with benchmark_database():
+                    seed_invoices(options['seed_rows'], lines=(1, 5))
+                    ids = list(Invoice.objects.values_list('pk', flat=True))
+                    connection.close()
+                    samples, elapsed = self.hammer(ids, options)
+            finally:
+                connection.settings_dict.update(original)
+                test_settings['NAME'] = original_test_name
+
+        latencies = sorted(seconds for _, seconds, error in samples if error is None)
+        errors = [error for _, _, error in samples if error is not None]
+        return {
+            'profile': name,
+            'vendor': connection.vendor,
+            'threads': options['threads'],
+            'operations': len(samples),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'ops_per_second': round((len(samples) - len(errors)) / elapsed, 2),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else 0,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2) if latencies else 0,
+        }
+
+    def hammer(self, ids, options):
+        """Run the operations from all threads at once; return (samples, wall seconds)"""
+        samples = []
+        samples_lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'] + 1)
+
+        def worker(number):
+            rng = random.Random(number)
+            local = []
+            barrier.wait()
+            try:
+                for _ in range(options['ops']):
+                    kind = 'create' if rng.random() < options['create_ratio'] else 'edit'
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        if kind == 'create':
+                            make_invoice(rng.randint(1, 10), seed=rng.random()).save()
+                        else:
+                            edit_invoice(rng.choice(ids), rng)
+                    except DatabaseError as e:
+                        error = str(e)
+                    finally:
+                        # What request_finished does at the end of every request
+                        close_old_connections()
+                    local.append((kind, time.perf_counter() - start, error))
+            finally:
+                connections.close_all()
+                with samples_lock:
+                    samples.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - start
+
+
+def edit_invoice(pk, rng):
+    """The inv_edit AJAX add_product/remove_product round trip"""
+    invoice = Invoice.objects.get(pk=pk)
+    if len(invoice.get_lines()) > 8:
+        invoice.remove_product(0)
+    else:
+        invoice.add_product({
+            'name': rng.choice(PRODUCTS),
+            'price': Decimal(rng.randint(100, 50000)) / 100,
+            'quantity': rng.randint(1, 5),
+            'discount_percent': Decimal(rng.choice([0, 5, 10])),
+        })
+    invoice.save()
@@ -0,0 +1,96 @@
+import json
+import re
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+
+from invoices.benchmarks import benchmark_database, timed
+from invoices.benchmarks.data import seed_invoices
+from invoices.filters import SORT_FIELDS, filter_invoices
+from invoices.models import Invoice
+from invoices.search import rebuild_index
+
+# A plan step that reads the whole invoices table without an index. On
+# SQLite the table itself is the primary key b-tree, so an unfiltered sort by
+# id legitimately shows up as a plain SCAN (see cases()).
+FULL_SCAN = {
+    'sqlite': re.compile(r"SCAN invoices_invoice\b(?! USING)"),
+    'postgresql': re.compile(r"Seq Scan on invoices_invoice\b"),
+}
+
+LIST_FILTERS = [
+    {},
+    {'date': '2021-06-01'},
+    {'id': '4242'},
+    {'title': 'router'},
+    {'client': 'juan'},
+    {'seller': 'luis'},
+    {'q': 'camara'},
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with invoices and check that every "
+        "inv_list sort/filter combination and the admin list use an index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--output', help="Write the plans and timings as JSON to this file")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['rows']} invoices...")
+            seed_invoices(options['rows'], lines=(1, 3))
+            rebuild_index()
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            results = self.check_plans()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        failures = [r for r in results if not r['indexed']]
+        for result in failures:
+            self.stderr.write(f"Full scan for {result['query']}:\n{result['plan']}")
+        if failures:
+            raise CommandError(f"{len(failures)} of {len(results)} queries scan the whole table")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} queries use an index"))
+
+    def cases(self):
+        for filters in LIST_FILTERS:
+            for sort in SORT_FIELDS:
+                for direction in ('asc', 'desc'):
+                    params = {**filters, 'sort': sort, 'direction': direction}
+                    invoices, *_ = filter_invoices(QueryDict(urlencode(params)))
+                    primary_key_order = not filters and sort == 'id'
+                    yield f"inv_list {urlencode(params)}", invoices.defer('comments'), primary_key_order
+
+        # Ranked search (q without an explicit sort)
+        invoices, *_ = filter_invoices(QueryDict('q=camara'))
+        yield "inv_list q=camara", invoices.defer('comments'), False
+
+        admin = Invoice.objects.order_by('-created_at')
+        yield "admin", admin, False
+        for field, value in [('currency', 'USD'), ('payment_method', 'card')]:
+            yield f"admin {field}={value}", admin.filter(**{field: value}), False
+
+    def check_plans(self):
+        full_scan = FULL_SCAN.get(connection.vendor)
+        if full_scan is None:
+            raise CommandError(f"No plan checks for the {connection.vendor} backend")
+
+        results = []
+        for name, queryset, primary_key_order in self.cases():
+            page = queryset[:15]
+            plan = page.explain()
+            seconds, _ = timed(lambda: list(page.all()), repeat=3)
+            indexed = not full_scan.search(plan) or (primary_key_order and "TEMP B-TREE" not in plan)
+            results.append({'query': name, 'indexed': indexed, 'ms': round(seconds * 1000, 2), 'plan': plan})
+            status = "ok  " if indexed else "SCAN"
+            self.stdout.write(f"{status} {seconds * 1000:8.2f} ms  {name}")
+        return results
@@ -0,0 +1,106 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.http import QueryDict
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+
+from invoices.benchmarks import benchmark_database, timed
+from invoices.benchmarks.data import seed_invoices
+from invoices.filters import filter_invoices
+from invoices.models import Invoice
+
+LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def profile_settings(cached):
+    """TEMPLATES and CACHES for the development-like or production-like profile"""
+    engine = dict(settings.TEMPLATES[0])
+    loaders = [('django.template.loaders.cached.Loader', LOADERS)] if cached else LOADERS
+    engine.update(APP_DIRS=False, OPTIONS={**engine['OPTIONS'], 'loaders': loaders})
+    fragments = 'locmem.LocMemCache' if cached else 'dummy.DummyCache'
+    caches = {
+        **settings.CACHES,
+        'template_fragments': {'BACKEND': f'django.core.cache.backends.{fragments}', 'LOCATION': 'benchmark'},
+    }
+    return {'TEMPLATES': [engine], 'CACHES': caches}
+
+
+PROFILES = {
+    'uncached': profile_settings(cached=False),
+    'production': profile_settings(cached=True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time inv_list.html and inv_template.html rendering without template "
+        "caching and with the production profile (cached loader + fragments)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--per-page', type=int, default=50)
+        parser.add_argument('--lines', type=int, default=40, help="Lines of the rendered invoice")
+        parser.add_argument('--output', help="Write the timings as JSON to this file")
+
+    def handle(self, *args, **options):
+        from invoices.rendering import InvoiceRenderer
+
+        request = RequestFactory().get('/invoices/')
+        request.user = AnonymousUser()
+
+        with benchmark_database():
+            seed_invoices(options['per_page'], lines=(1, 3))
+            seed_invoices(1, lines=(options['lines'], options['lines']), start=options['per_page'])
+            invoice = Invoice.objects.prefetch_related('lines').latest('pk')
+
+            invoices, search_params, sort, direction = filter_invoices(QueryDict(''))
+            page = Paginator(invoices.defer('comments'), options['per_page']).get_page(1)
+            list(page)
+            list_context = {
+                'invoices': page, 'page_obj': page, 'per_page': options['per_page'],
+                'per_page_options': [15, 25, 50, 100], 'search_params': search_params,
+                'sort': sort, 'direction': direction,
+            }
+            renderer = InvoiceRenderer(invoice)
+
+            pages = {
+                'inv_list.html': lambda: render_to_string('invoices/inv_list.html', list_context, request),
+                'inv_template.html (preview)': lambda: render_to_string(
+                    'invoices/inv_template.html', renderer.get_context(preview=True), request
+                ),
+            }
+
+            results = []
+            for profile, overrides in PROFILES.items():
+                with override_settings(**overrides):
+                    for name, render in pages.items():
+                        start = time.perf_counter()
+                        render()
+                        first = time.perf_counter() - start
+                        best, _ = timed(render, repeat=options['repeat'])
+                        results.append({
+                            'profile': profile, 'template': name,
+                            'first_ms': round(first * 1000, 3), 'best_ms': round(best * 1000, 3),
+                        })
+                        self.stdout.write(
+                            f"{profile:<11} {name:<28} first {first * 1000:8.2f} ms  best {best * 1000:8.2f} ms"
+                        )
+
+        baseline = {r['template']: r['best_ms'] for r in results if r['profile'] == 'uncached'}
+        for result in results:
+            if result['profile'] == 'production' and result['best_ms']:
+                speedup = baseline[result['template']] / result['best_ms']
+                self.stdout.write(self.style.SUCCESS(f"{result['template']}: {speedup:.1f}x faster per request"))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.folios import DEFAULT_SERIES
+from invoices.imports import READERS, import_invoices
+
+
+class Command(BaseCommand):
+    help = "Import invoices and their lines from a CSV or JSONL file (see invoices.imports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help="Default: from the file extension")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--series', default=DEFAULT_SERIES, help="Folio series for the new invoices")
+        parser.add_argument('--dry-run', action='store_true', help="Only validate and report errors")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        start = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as source:
+                result = import_invoices(
+                    READERS[file_format](source),
+                    chunk_size=options['chunk_size'],
+                    series=options['series'],
+                    dry_run=options['dry_run'],
+                )
+        except OSError as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - start
+
+        for error in result.errors:
+            ref = f" ({error.ref})" if error.ref else ""
+            self.stderr.write(f"Row {error.row}{ref}: {error.message}")
+
+        action = "Validated" if options['dry_run'] else "Imported"
+        rate = result.created / elapsed * 60 if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {result.created} of {result.rows} invoices in {elapsed:.1f}s "
+            f"({rate:.0f}/min), {len(result.errors)} errors"
+        ))
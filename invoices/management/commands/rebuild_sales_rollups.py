@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from invoices.models import SalesRollup
+from invoices.reporting import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales rollup tables from all invoices (after bulk imports or raw updates)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rebuild_rollups(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {SalesRollup.objects.count()} rollup rows"))
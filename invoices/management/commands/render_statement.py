@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.filters import filter_invoices, filter_month
+from invoices.rendering import StatementRenderer
+
+
+class Command(BaseCommand):
+    help = "Render the matching invoices into one statement PDF (see invoices.rendering.StatementRenderer)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the PDF to write")
+        parser.add_argument('--month', help="YYYY-MM")
+        parser.add_argument('--client', default='', help="Same matching as the inv_list client filter")
+        parser.add_argument('--seller', default='')
+        parser.add_argument('--chunk-size', type=int, default=25, help="Invoices laid out per WeasyPrint pass")
+        parser.add_argument('--base-url', default=settings.INVOICE_PDF_BASE_URL)
+
+    def handle(self, *args, **options):
+        invoices, _, _, _ = filter_invoices({'client': options['client'], 'seller': options['seller']})
+        if options['month']:
+            try:
+                invoices = filter_month(invoices, options['month'])
+            except ValueError:
+                raise CommandError(f"--month must be YYYY-MM, not {options['month']!r}")
+
+        renderer = StatementRenderer(
+            invoices.order_by('date', 'id').prefetch_related('lines'), chunk_size=options['chunk_size'],
+        )
+        if not renderer.invoices:
+            raise CommandError("No invoices match")
+
+        start = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f"Laid out {done}/{total} invoices ({time.perf_counter() - start:.1f}s)")
+
+        pdf_bytes = renderer.write_pdf(options['base_url'], progress=progress)
+        try:
+            with open(options['output'], 'wb') as f:
+                f.write(pdf_bytes)
+        except OSError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(renderer.invoices)} invoices to {options['output']} "
+            f"({len(pdf_bytes) / 1024:.0f} KiB) in {time.perf_counter() - start:.1f}s"
+        ))
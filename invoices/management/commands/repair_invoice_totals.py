@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from invoices.models import Invoice
+from invoices.pricing import calculate_totals_many
+
+
+class Command(BaseCommand):
+    help = "Recalculate stored invoice totals from their lines and fix the ones that differ"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the invoices that would change")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        fields = ['subtotal', 'total_discount', 'total_tax', 'total']
+        checked = repaired = 0
+
+        invoices = Invoice.objects.prefetch_related('lines').order_by('pk')
+        chunk = []
+        for invoice in invoices.iterator(chunk_size=options['chunk_size']):
+            chunk.append((invoice, [getattr(invoice, field) for field in fields]))
+            if len(chunk) == options['chunk_size']:
+                repaired += self.repair(chunk, fields, options['dry_run'])
+                checked += len(chunk)
+                chunk = []
+        repaired += self.repair(chunk, fields, options['dry_run'])
+        checked += len(chunk)
+
+        action = "Would repair" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{action} {repaired} of {checked} invoices"))
+
+    def repair(self, chunk, fields, dry_run):
+        """Recalculate a chunk of (invoice, stored totals) in one batch; save the ones that differ"""
+        calculate_totals_many([invoice for invoice, _ in chunk])
+        repaired = 0
+        for invoice, stored in chunk:
+            if stored == [getattr(invoice, field) for field in fields]:
+                continue
+            repaired += 1
+            self.stdout.write(f"{invoice.folio}: {stored[-1]} -> {invoice.total}")
+            if not dry_run:
+                invoice.save()
+        return repaired
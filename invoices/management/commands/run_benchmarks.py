@@ -0,0 +1,75 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.benchmarks import benchmark_database
+from invoices.benchmarks import suite
+
+GROUPS = ['pricing', 'rendering', 'list', 'edit']
+
+
+def sizes(value):
+    return tuple(int(size) for size in value.split(','))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the invoices benchmark suite on a throwaway test database: timings "
+        "and query counts (checked against budgets), saved as JSON to compare runs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS)
+        parser.add_argument('--line-sizes', type=sizes, default=suite.LINE_SIZES, help="e.g. 1,10,100,1000")
+        parser.add_argument('--list-sizes', type=sizes, default=suite.LIST_SIZES, help="e.g. 10000,100000")
+        parser.add_argument('--edit-sizes', type=sizes, default=suite.EDIT_SIZES)
+        parser.add_argument('--no-pdf', action='store_true', help="Skip render_pdf (WeasyPrint)")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--compare', help="JSON results of an earlier run")
+        parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown reported as a regression")
+
+    def handle(self, *args, **options):
+        groups = {
+            'pricing': lambda: suite.pricing_cases(options['line_sizes']),
+            'rendering': lambda: suite.rendering_cases(options['line_sizes'], pdf=not options['no_pdf']),
+            'list': lambda: suite.list_cases(options['list_sizes']),
+            'edit': lambda: suite.edit_cases(options['edit_sizes']),
+        }
+
+        results = []
+        with benchmark_database():
+            env = suite.environment()
+            for group in options['only']:
+                for case in groups[group]():
+                    result = suite.measure(case)
+                    results.append(result)
+                    over = result['queries'] > result['max_queries']
+                    line = (
+                        f"{result['case']:<30} {result['size']:>7}  best {result['best_ms']:10.3f} ms  "
+                        f"median {result['median_ms']:10.3f} ms  {result['queries']:>3}/{result['max_queries']} queries"
+                    )
+                    self.stdout.write(self.style.ERROR(line) if over else line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'environment': env, 'results': results}, f, indent=2)
+
+        failures = []
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)['results']
+            for result, old in suite.compare(previous, results, options['threshold']):
+                self.stderr.write(
+                    f"Slower: {result['case']} ({result['size']}) {old:.3f} -> {result['best_ms']:.3f} ms"
+                )
+                failures.append(result)
+
+        over_budget = [r for r in results if r['queries'] > r['max_queries']]
+        for result in over_budget:
+            self.stderr.write(
+                f"Query budget exceeded: {result['case']} ({result['size']}) "
+                f"{result['queries']} > {result['max_queries']}"
+            )
+        if over_budget or failures:
+            raise CommandError(f"{len(over_budget)} over query budget, {len(failures)} slower than before")
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} benchmarks within budget"))
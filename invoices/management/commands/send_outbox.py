@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.outbox import dispatch_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver pending e-mails from the outbox in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help="Keep running and poll for new mail")
+        parser.add_argument('--interval', type=float, default=10, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = dispatch_outbox(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
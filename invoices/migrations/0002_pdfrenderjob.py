@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:20
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='currency',
+            field=models.CharField(choices=[('MXN', 'Pesos Mexicanos'), ('USD', 'Dolares')], default='MXN', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='payment_method',
+            field=models.CharField(choices=[('cash', 'Efectivo'), ('card', 'Tarjeta de crédito/débito'), ('transfer', 'Transferencia bancaria')], default='cash', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='PDFRenderJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En proceso'), ('done', 'Terminado'), ('failed', 'Fallido')], default='pending', max_length=16)),
+                ('preview', models.BooleanField(default=False)),
+                ('cache_key', models.CharField(max_length=128)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='render_jobs', to='invoices.invoice')),
+            ],
+        ),
+    ]
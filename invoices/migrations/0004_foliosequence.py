@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:22
+
+from django.db import migrations, models
+
+
+def seed_cot_sequence(apps, schema_editor):
+    """Continue the COT series after the highest existing folio (compared numerically)"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    FolioSequence = apps.get_model('invoices', 'FolioSequence')
+
+    last_number = 0
+    folios = Invoice.objects.filter(folio__startswith='COT-').values_list('folio', flat=True)
+    for folio in folios.iterator():
+        try:
+            last_number = max(last_number, int(folio.split('-')[1]))
+        except (IndexError, ValueError):
+            continue
+
+    FolioSequence.objects.create(series='COT', prefix='COT', padding=4, next_value=last_number + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolioSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=16, unique=True)),
+                ('prefix', models.CharField(max_length=12)),
+                ('padding', models.PositiveSmallIntegerField(default=4)),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(seed_cot_sequence, migrations.RunPython.noop),
+    ]
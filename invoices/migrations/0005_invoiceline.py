@@ -0,0 +1,102 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:23
+
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CENT = Decimal('0.01')
+
+
+def _decimal(value, default=0):
+    if value is None:
+        return Decimal(str(default))
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        return Decimal(str(default))
+
+
+def copy_products_to_lines(apps, schema_editor):
+    """Move every entry of Invoice.products into InvoiceLine rows, keeping their order"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceLine = apps.get_model('invoices', 'InvoiceLine')
+
+    batch = []
+    invoices = Invoice.objects.only('id', 'tax_rate', 'products').iterator(chunk_size=500)
+    for invoice in invoices:
+        tax_rate = _decimal(invoice.tax_rate)
+        for position, product in enumerate(invoice.products or []):
+            if not isinstance(product, dict):
+                continue
+            price = _decimal(product.get('price', 0))
+            quantity = int(_decimal(product.get('quantity', 1), 1))
+            discount_percent = _decimal(product.get('discount_percent', 0))
+            discount_amount = _decimal(product.get('discount_amount', 0))
+            taxable = bool(product.get('taxable', True))
+
+            line_subtotal = price * quantity
+            if discount_percent > 0:
+                line_discount = line_subtotal * (discount_percent / 100)
+            else:
+                line_discount = discount_amount
+            line_total = line_subtotal - line_discount
+            line_tax = line_total * (tax_rate / 100) if taxable else Decimal('0')
+
+            batch.append(InvoiceLine(
+                invoice_id=invoice.id,
+                position=position,
+                name=str(product.get('name', ''))[:255],
+                price=price,
+                quantity=quantity,
+                discount_percent=discount_percent,
+                discount_amount=discount_amount,
+                taxable=taxable,
+                warranty_months=int(_decimal(product.get('warranty_months', 0))),
+                line_subtotal=line_subtotal.quantize(CENT),
+                line_discount=line_discount.quantize(CENT),
+                line_tax=line_tax.quantize(CENT),
+                line_total=line_total.quantize(CENT),
+            ))
+        if len(batch) >= 1000:
+            InvoiceLine.objects.bulk_create(batch)
+            batch = []
+    InvoiceLine.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_foliosequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('name', models.CharField(max_length=255)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('quantity', models.IntegerField(default=1)),
+                ('discount_percent', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('discount_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('taxable', models.BooleanField(default=True)),
+                ('warranty_months', models.IntegerField(default=0)),
+                ('line_subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('line_discount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('line_tax', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('line_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='invoices.invoice')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+                'indexes': [models.Index(fields=['invoice', 'position'], name='invoices_in_invoice_4be8aa_idx'), models.Index(fields=['name'], name='invoices_in_name_7635e6_idx')],
+            },
+        ),
+        migrations.RunPython(copy_products_to_lines, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='invoice',
+            name='products',
+        ),
+    ]
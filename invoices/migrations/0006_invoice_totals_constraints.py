@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:24
+
+import django.db.models.expressions
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+CENT = Decimal('0.01')
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value)).quantize(CENT)
+    except Exception:
+        return None
+
+
+def repair_totals(apps, schema_editor):
+    """Recalculate, from the lines, any invoice whose stored totals would violate the new constraints"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceLine = apps.get_model('invoices', 'InvoiceLine')
+
+    fields = ['subtotal', 'total_discount', 'total_tax', 'total']
+    for invoice in Invoice.objects.only('id', *fields).iterator(chunk_size=500):
+        values = [_decimal(getattr(invoice, field)) for field in fields]
+        if None not in values:
+            subtotal, discount, tax, total = values
+            if subtotal >= 0 and tax >= 0 and total == subtotal - discount + tax:
+                continue
+
+        sums = InvoiceLine.objects.filter(invoice_id=invoice.id).aggregate(
+            subtotal=Sum('line_subtotal'), discount=Sum('line_discount'), tax=Sum('line_tax'),
+        )
+        subtotal = _decimal(sums['subtotal'] or 0)
+        discount = _decimal(sums['discount'] or 0)
+        tax = _decimal(sums['tax'] or 0)
+        Invoice.objects.filter(id=invoice.id).update(
+            subtotal=subtotal, total_discount=discount, total_tax=tax, total=subtotal - discount + tax,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_invoiceline'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_totals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.CheckConstraint(condition=models.Q(('subtotal__gte', 0), ('total_tax__gte', 0)), name='invoice_totals_non_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.CheckConstraint(condition=models.Q(('total__gte', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('subtotal'), '-', models.F('total_discount')), '+', models.F('total_tax')), '-', models.Value(Decimal('0.005')))), ('total__lte', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('subtotal'), '-', models.F('total_discount')), '+', models.F('total_tax')), '+', models.Value(Decimal('0.005'))))), name='invoice_totals_consistent'),
+        ),
+    ]
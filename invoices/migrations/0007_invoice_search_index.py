@@ -0,0 +1,79 @@
+from django.db import migrations
+
+# Frozen copy of invoices.search as of this migration, so later changes to
+# that module do not change what this migration creates
+FTS_TABLE = 'invoices_invoice_fts'
+TRGM_TABLE = 'invoices_invoice_search'
+COLUMNS = ['folio', 'title', 'clt_name', 'sell_name', 'emails', 'products']
+TRGM_COLUMNS = ['title', 'clt_name', 'sell_name']
+
+
+def document_for(invoice):
+    return [
+        invoice.folio or '',
+        invoice.title or '',
+        invoice.clt_name or '',
+        invoice.sell_name or '',
+        f"{invoice.clt_email or ''} {invoice.sell_email or ''}",
+        ' '.join(line.name for line in invoice.lines.all()),
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    """Create the vendor-specific search table (FTS5 / pg_trgm) and index existing invoices"""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(COLUMNS)}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        insert = f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * (len(COLUMNS) + 1))})"
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TRGM_TABLE} ("
+            f"invoice_id bigint PRIMARY KEY REFERENCES invoices_invoice (id) ON DELETE CASCADE, "
+            f"document text NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TRGM_TABLE}_trgm ON {TRGM_TABLE} USING gin (document gin_trgm_ops)"
+        )
+        for column in TRGM_COLUMNS:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS invoices_invoice_{column}_trgm ON invoices_invoice "
+                f"USING gin ({column} gin_trgm_ops)"
+            )
+        insert = f"INSERT INTO {TRGM_TABLE} (invoice_id, document) VALUES (%s, %s) ON CONFLICT (invoice_id) DO NOTHING"
+    else:
+        # Other backends search with icontains and have nothing to index
+        return
+
+    Invoice = apps.get_model('invoices', 'Invoice')
+    invoices = Invoice.objects.using(connection.alias).prefetch_related('lines')
+    with connection.cursor() as cursor:
+        for invoice in invoices.iterator(chunk_size=500):
+            document = document_for(invoice)
+            if connection.vendor == 'postgresql':
+                document = [' '.join(document)]
+            cursor.execute(insert, [invoice.pk, *document])
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TRGM_TABLE}")
+        for column in TRGM_COLUMNS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS invoices_invoice_{column}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_invoice_totals_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_invoice_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:38
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+# Frozen copy of invoices.reporting.rebuild_rollups as of this migration
+SNAPSHOT_FIELDS = [
+    'date', 'currency', 'exchange_rate', 'sell_name', 'clt_name', 'payment_method',
+    'subtotal', 'total_discount', 'total_tax', 'total',
+]
+AMOUNT_FIELDS = ['subtotal', 'total_discount', 'total_tax', 'total']
+BASE_CURRENCY = 'MXN'
+CENT = Decimal('0.01')
+
+
+def populate_rollups(apps, schema_editor):
+    Invoice = apps.get_model('invoices', 'Invoice')
+    SalesRollup = apps.get_model('invoices', 'SalesRollup')
+    alias = schema_editor.connection.alias
+
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    for snapshot in Invoice.objects.using(alias).values(*SNAPSHOT_FIELDS).iterator(chunk_size=2000):
+        amounts = {field: Decimal(snapshot[field]) for field in AMOUNT_FIELDS}
+        total = Decimal(snapshot['total'])
+        if snapshot['currency'] != BASE_CURRENCY:
+            total = (total * Decimal(snapshot['exchange_rate'])).quantize(CENT, rounding=ROUND_HALF_UP)
+        amounts['total_base'] = total
+        amounts['invoice_count'] = 1
+
+        day = snapshot['date']
+        keys = {
+            'all': '',
+            'seller': snapshot['sell_name'][:64],
+            'client': snapshot['clt_name'][:64],
+            'payment_method': snapshot['payment_method'],
+        }
+        for period, period_start in (('day', day), ('month', day.replace(day=1))):
+            for dimension, key in keys.items():
+                rollup = totals[(period, period_start, dimension, key, snapshot['currency'])]
+                for field, value in amounts.items():
+                    rollup[field] += value
+
+    SalesRollup.objects.using(alias).bulk_create([
+        SalesRollup(
+            period=period, period_start=period_start, dimension=dimension, key=key,
+            currency=currency, **amounts,
+        )
+        for (period, period_start, dimension, key, currency), amounts in totals.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_invoice_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Día'), ('month', 'Mes')], max_length=8)),
+                ('period_start', models.DateField()),
+                ('dimension', models.CharField(choices=[('all', 'Todas'), ('seller', 'Vendedor'), ('client', 'Cliente'), ('payment_method', 'Método de pago')], max_length=16)),
+                ('key', models.CharField(blank=True, max_length=64)),
+                ('currency', models.CharField(choices=[('MXN', 'Pesos Mexicanos'), ('USD', 'Dolares')], max_length=16)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_discount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_tax', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_base', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'dimension', 'period_start', 'key', 'currency'), name='sales_rollup_unique')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+def mark_invoice_attachments(apps, schema_editor):
+    OutboundEmail = apps.get_model('invoices', 'OutboundEmail')
+    OutboundEmail.objects.using(schema_editor.connection.alias).filter(
+        invoice__isnull=False
+    ).update(attach_invoice_pdf=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_salesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='attach_invoice_pdf',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='outboundemail',
+            name='claim_token',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboundemail',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_invoice_attachments, migrations.RunPython.noop),
+    ]
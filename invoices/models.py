@@ -1,6 +1,22 @@
-from decimal import Decimal, InvalidOperation
-from django.db import models
+from decimal import Decimal
+import uuid
+from django.db import models, transaction
 from django.db.models import JSONField
+from django.utils import timezone
+
+from . import pricing
+from .pdf_cache import get_pdf_cache
+
+CENT = Decimal('0.01')
+
+
+class VersionConflict(Exception):
+    """The invoice changed since the client loaded it"""
+
+    def __init__(self, invoice):
+        super().__init__(f"Invoice {invoice.pk} changed concurrently")
+        self.invoice = invoice
+
 
 class Invoice(models.Model):
     CURRENCY = [
@@ -37,9 +53,6 @@ class Invoice(models.Model):
     exchange_rate = models.DecimalField(decimal_places=2, max_digits=10, default=18)
     warranty_months = models.IntegerField(default=0)
 
-    # Products information (stored as JSON)
-    products = JSONField(default=list)  # Stores all product details directly
-    
     # Calculated totals
     subtotal = models.DecimalField(decimal_places=2, max_digits=10, default=0)
     total_discount = models.DecimalField(decimal_places=2, max_digits=10, default=0)
@@ -49,9 +62,62 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Bumped on every write; clients send it back to detect concurrent edits
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    # FolioSequence series used for new folios
+    folio_series = 'COT'
+
+    class Meta:
+        indexes = [
+            # inv_list sorts, with id as tie-breaker (also keyset pagination)
+            models.Index(fields=['date', 'id'], name='invoice_date_id_idx'),
+            models.Index(fields=['total', 'id'], name='invoice_total_id_idx'),
+            models.Index(fields=['title', 'id'], name='invoice_title_id_idx'),
+            models.Index(fields=['clt_name', 'id'], name='invoice_client_id_idx'),
+            models.Index(fields=['sell_name', 'id'], name='invoice_seller_id_idx'),
+            # Admin ordering and list filters
+            models.Index(fields=['-created_at'], name='invoice_created_idx'),
+            models.Index(fields=['currency', '-created_at'], name='invoice_currency_created_idx'),
+            models.Index(fields=['payment_method', '-created_at'], name='invoice_payment_created_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(subtotal__gte=0) & models.Q(total_tax__gte=0),
+                name='invoice_totals_non_negative',
+            ),
+            # Half a cent of tolerance for backends that store decimals as floats
+            models.CheckConstraint(
+                condition=models.Q(
+                    total__gte=models.F('subtotal') - models.F('total_discount') + models.F('total_tax') - Decimal('0.005'),
+                    total__lte=models.F('subtotal') - models.F('total_discount') + models.F('total_tax') + Decimal('0.005'),
+                ),
+                name='invoice_totals_consistent',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.folio} - {self.title}"
     
+    # Working copy of the line items (see get_lines); saved by save()
+    _line_items = None
+    _lines_replaced = False
+    _removed_line_ids = ()
+
+    def get_lines(self):
+        """
+        Return the invoice lines as a list, loading them once.
+        Uses prefetch_related('lines') results when available.
+        """
+        if self._line_items is None:
+            self._line_items = list(self.lines.all()) if self.pk else []
+        return self._line_items
+
+    @property
+    def products(self):
+        """Line items as plain dicts, in the shape the old products JSON had"""
+        return [line.as_product() for line in self.get_lines()]
+
     def add_product(self, product_data):
         """
         Add a product to the invoice with all its details.
@@ -62,103 +128,118 @@ class Invoice(models.Model):
             'quantity': int,
             'discount_percent': Decimal (optional, default=0),
         }
+        Returns the new (unsaved) InvoiceLine; it is written by save().
         """
-        if not hasattr(self, 'products') or self.products is None:
-            self.products = []
-            
-        # Set defaults
-        product_data.setdefault('discount_percent', 0)
-        product_data.setdefault('discount_amount', 0)
-        product_data.setdefault('taxable', True)
-        product_data.setdefault('warranty_months', 0)
-        
-        self.products.append(product_data)
-    
+        lines = self.get_lines()
+        line = InvoiceLine(
+            invoice=self,
+            position=len(lines),
+            name=str(product_data.get('name', ''))[:255],
+            price=self._safe_decimal(product_data.get('price', 0)),
+            quantity=int(self._safe_decimal(product_data.get('quantity', 1), 1)),
+            discount_percent=self._safe_decimal(product_data.get('discount_percent', 0)),
+            discount_amount=self._safe_decimal(product_data.get('discount_amount', 0)),
+            taxable=bool(product_data.get('taxable', True)),
+            warranty_months=int(self._safe_decimal(product_data.get('warranty_months', 0))),
+        )
+        lines.append(line)
+        return line
+
+    def remove_product(self, index):
+        """Remove the line at index; the row is deleted by save()"""
+        lines = self.get_lines()
+        line = lines.pop(index)
+        if line.pk is not None:
+            self._removed_line_ids = [*self._removed_line_ids, line.pk]
+        return line
+
     def calculate_totals(self):
-        """Calculate and update all financial totals based on products"""
-        subtotal = Decimal('0')
-        total_discount = Decimal('0')
-        total_tax = Decimal('0')
-        
-        # Handle case where products is None or empty
-        if not self.products:
-            self.products = []
-        
-        for product in self.products:
-            # Safely convert values to Decimal with defaults
-            quantity = self._safe_decimal(product.get('quantity', 1))
-            price = self._safe_decimal(product.get('price', 0))
-            discount_percent = self._safe_decimal(product.get('discount_percent', 0))
-            discount_amount = self._safe_decimal(product.get('discount_amount', 0))
-            
-            # Calculate line totals
-            line_subtotal = price * quantity
-            
-            # Calculate discounts
-            if discount_percent > 0:
-                line_discount = line_subtotal * (discount_percent / 100)
-            else:
-                line_discount = discount_amount
-                
-            line_total = line_subtotal - line_discount
-            
-            # Calculate tax if applicable
+        """Calculate and update all financial totals based on products (see invoices.pricing)"""
+        # The totals are the sum of the rounded line amounts, so a single line
+        # change can be applied as a delta (see invoices.line_edits)
+        pricing.calculate_totals_many([self])
+
+    def calculate_line(self, line, tax_rate=None):
+        """
+        Calculate and store one line's amounts.
+        Returns the priced line (subtotal, discount, total, tax), rounded to cents.
+        """
+        if tax_rate is None:
             tax_rate = self._safe_decimal(self.tax_rate)
-            if product.get('taxable', True):
-                line_tax = line_total * (tax_rate / 100)
-            else:
-                line_tax = Decimal('0')
-            
-            # Update aggregates
-            subtotal += line_subtotal
-            total_discount += line_discount
-            total_tax += line_tax
-            
-            # Update product entry with calculated values
-            product['line_subtotal'] = float(line_subtotal)
-            product['line_discount'] = float(line_discount)
-            product['line_total'] = float(line_total)
-            product['line_tax'] = float(line_tax)
-        
-        # Update model fields with safe defaults
-        self.subtotal = subtotal
-        self.total_discount = total_discount
-        self.total_tax = total_tax
-        self.total = subtotal - total_discount + total_tax
-    
+        (row,) = pricing.engine.price_rows([pricing.line_record(line)], tax_rate)
+        amounts = dict(zip(pricing.engine.line_names, row))
+        line.set_amounts(*[amounts[step] for step in ('subtotal', 'discount', 'tax', 'total')])
+        return amounts
+
     def _safe_decimal(self, value, default=0):
         """Safely convert a value to Decimal, handling None and invalid values"""
-        if value is None:
-            return Decimal(str(default))
-        try:
-            return Decimal(str(value))
-        except (InvalidOperation, TypeError, ValueError):
-            return Decimal(str(default))
+        return pricing.as_decimal(value, default)
     
-    def save(self, *args, **kwargs):
+    def save(self, *args, expected_version=None, **kwargs):
+        """
+        expected_version is the version the caller's edit was based on; the
+        save raises VersionConflict if the invoice has changed since then
+        """
         # Auto-generate folio if not provided
         if not self.folio:
-            last_invoice = Invoice.objects.filter(folio__startswith='COT-').order_by('folio').last()
-            if last_invoice:
-                try:
-                    last_number = int(last_invoice.folio.split('-')[1])
-                    self.folio = f'COT-{last_number + 1:04d}'
-                except (IndexError, ValueError):
-                    self.folio = 'COT-0001'
-            else:
-                self.folio = 'COT-0001'
+            from .folios import allocate_folio
+            self.folio = allocate_folio(self.folio_series)
         
-        # Ensure all decimal fields have valid values before saving
-        self.subtotal = self._safe_decimal(self.subtotal)
-        self.total_discount = self._safe_decimal(self.total_discount)
-        self.total_tax = self._safe_decimal(self.total_tax)
-        self.total = self._safe_decimal(self.total)
+        # Ensure the rates are valid; calculate_totals() sets the totals
         self.tax_rate = self._safe_decimal(self.tax_rate, 16.00)
         self.exchange_rate = self._safe_decimal(self.exchange_rate, 18)
         
         # Calculate totals before saving
         self.calculate_totals()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if expected_version is not None and self.pk is not None:
+                # Compare-and-set, like the line edits: a concurrent save
+                # moves the version first and this UPDATE matches no row
+                claimed = Invoice.objects.filter(pk=self.pk, version=expected_version).update(
+                    version=models.F('version') + 1
+                )
+                if not claimed:
+                    raise VersionConflict(self)
+                self.version = expected_version + 1
+            else:
+                self.version = (self.version or 0) + 1
+            super().save(*args, **kwargs)
+            self._save_lines()
+
+        # Cached PDFs of the previous version are no longer valid
+        get_pdf_cache().invalidate(self.pk)
+
+    def _save_lines(self):
+        """Write only the lines that were added, removed, moved or recalculated"""
+        lines = self.get_lines()
+        if self._lines_replaced:
+            self.lines.all().delete()
+            for line in lines:
+                line.pk = None
+            self._lines_replaced = False
+        elif self._removed_line_ids:
+            InvoiceLine.objects.filter(invoice=self, pk__in=self._removed_line_ids).delete()
+        self._removed_line_ids = ()
+
+        changed = []
+        for position, line in enumerate(lines):
+            if line.position != position:
+                line.position = position
+                line._changed = True
+            if line.pk is not None and line._changed:
+                changed.append(line)
+
+        InvoiceLine.objects.bulk_create([line for line in lines if line.pk is None])
+        if changed:
+            InvoiceLine.objects.bulk_update(changed, InvoiceLine.UPDATABLE_FIELDS)
+        for line in lines:
+            line._changed = False
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        get_pdf_cache().invalidate(pk)
+        return result
     
     def get_product_summary(self):
         """Return a summary of all products with calculated values"""
@@ -166,4 +247,194 @@ class Invoice(models.Model):
     
     def clear_products(self):
         """Remove all products from the invoice"""
-        self.products = []
\ No newline at end of file
+        self._line_items = []
+        self._lines_replaced = True
+
+
+class InvoiceLine(models.Model):
+    """A product or service on an invoice"""
+
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='lines')
+    position = models.PositiveIntegerField(default=0)
+
+    name = models.CharField(max_length=255)
+    price = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    quantity = models.IntegerField(default=1)
+    discount_percent = models.DecimalField(decimal_places=2, max_digits=5, default=0)
+    discount_amount = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    taxable = models.BooleanField(default=True)
+    warranty_months = models.IntegerField(default=0)
+
+    # Calculated by Invoice.calculate_totals
+    line_subtotal = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    line_discount = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    line_tax = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    line_total = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+
+    UPDATABLE_FIELDS = [
+        'position', 'name', 'price', 'quantity', 'discount_percent', 'discount_amount',
+        'taxable', 'warranty_months', 'line_subtotal', 'line_discount', 'line_tax', 'line_total',
+    ]
+
+    # Set when the row needs to be written back by Invoice.save()
+    _changed = False
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['invoice', 'position']),
+            models.Index(fields=['name']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+    def set_amounts(self, line_subtotal, line_discount, line_tax, line_total):
+        amounts = {
+            'line_subtotal': line_subtotal,
+            'line_discount': line_discount,
+            'line_tax': line_tax,
+            'line_total': line_total,
+        }
+        for field, value in amounts.items():
+            value = value.quantize(CENT)
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                self._changed = True
+
+    def as_product(self):
+        return {
+            'id': self.pk,
+            'name': self.name,
+            'price': float(self.price),
+            'quantity': self.quantity,
+            'discount_percent': float(self.discount_percent),
+            'discount_amount': float(self.discount_amount),
+            'taxable': self.taxable,
+            'warranty_months': self.warranty_months,
+            'line_subtotal': float(self.line_subtotal),
+            'line_discount': float(self.line_discount),
+            'line_total': float(self.line_total),
+            'line_tax': float(self.line_tax),
+        }
+
+class PDFRenderJob(models.Model):
+    """A PDF rendered in the background worker pool (see invoices.jobs)"""
+
+    STATUS = [
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='render_jobs')
+    status = models.CharField(max_length=16, choices=STATUS, default='pending')
+    preview = models.BooleanField(default=False)
+    cache_key = models.CharField(max_length=128)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.invoice_id} - {self.status}"
+
+
+class OutboundEmail(models.Model):
+    """An e-mail waiting in the outbox, delivered in batches by invoices.outbox"""
+
+    STATUS = [
+        ('pending', 'Pendiente'),
+        ('sending', 'Enviando'),
+        ('sent', 'Enviado'),
+        ('failed', 'Fallido'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = JSONField(default=list)
+    # When set, the invoice PDF is attached at delivery time
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, blank=True, null=True, related_name='emails')
+    # Kept when the invoice is deleted, so the message fails instead of going out without its PDF
+    attach_invoice_pdf = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=16, choices=STATUS, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # The dispatch_outbox() call that set status 'sending', and when
+    claim_token = models.UUIDField(blank=True, null=True, db_index=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {self.status}"
+
+
+class FolioSequence(models.Model):
+    """Counter for one folio series, advanced atomically by invoices.folios"""
+
+    series = models.CharField(max_length=16, unique=True)
+    prefix = models.CharField(max_length=12)
+    padding = models.PositiveSmallIntegerField(default=4)
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.series} ({self.prefix}-{self.next_value})"
+
+    def format(self, number):
+        return f"{self.prefix}-{number:0{self.padding}d}"
+
+
+class SalesRollup(models.Model):
+    """
+    Pre-aggregated sales for one period and dimension value, per currency.
+    Kept up to date by invoices.reporting as invoices are saved and deleted.
+    """
+
+    PERIODS = [
+        ('day', 'Día'),
+        ('month', 'Mes'),
+    ]
+
+    DIMENSIONS = [
+        ('all', 'Todas'),
+        ('seller', 'Vendedor'),
+        ('client', 'Cliente'),
+        ('payment_method', 'Método de pago'),
+    ]
+
+    period = models.CharField(max_length=8, choices=PERIODS)
+    period_start = models.DateField()
+    dimension = models.CharField(max_length=16, choices=DIMENSIONS)
+    key = models.CharField(max_length=64, blank=True)
+    currency = models.CharField(max_length=16, choices=Invoice.CURRENCY)
+
+    invoice_count = models.IntegerField(default=0)
+    subtotal = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    total_discount = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    total_tax = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    total = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    # total converted to the base currency with each invoice's exchange_rate
+    total_base = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'dimension', 'period_start', 'key', 'currency'],
+                name='sales_rollup_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.period_start} {self.dimension}={self.key} {self.currency}"
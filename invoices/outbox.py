@@ -0,0 +1,186 @@
+"""
+E-mail outbox.
+
+Views call enqueue_email() and return at once. dispatch_outbox() delivers the
+due messages in batches over a single SMTP connection and retries failures
+with exponential backoff. It runs in a background thread after each enqueue
+(EMAIL_OUTBOX_AUTO_DISPATCH) and from the send_outbox management command.
+
+Several dispatchers can run at once (the background thread, send_outbox,
+other WSGI processes). Each claims its batch under a fresh token and only
+sends and updates rows carrying that token. Rows left in 'sending' by a
+dispatcher that died go back to the queue after EMAIL_OUTBOX_SENDING_TIMEOUT.
+"""
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .instrumentation import span
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+_dispatch_lock = threading.Lock()
+
+
+def enqueue_email(subject, body, from_email, to, invoice=None):
+    """Store a message in the outbox and schedule its delivery"""
+    email = OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=list(to),
+        invoice=invoice,
+        attach_invoice_pdf=invoice is not None,
+    )
+    if getattr(settings, 'EMAIL_OUTBOX_AUTO_DISPATCH', False):
+        transaction.on_commit(kick_dispatcher)
+    return email
+
+
+def kick_dispatcher():
+    """Deliver pending mail on a background thread, unless one is already running"""
+    if not _dispatch_lock.acquire(blocking=False):
+        return
+    thread = threading.Thread(target=_dispatch_in_background, daemon=True)
+    try:
+        thread.start()
+    except Exception:
+        _dispatch_lock.release()
+        raise
+
+
+def _dispatch_in_background():
+    try:
+        while dispatch_outbox()[0]:
+            pass
+    except Exception:
+        logger.exception("E-mail outbox dispatch failed")
+    finally:
+        close_old_connections()
+        _dispatch_lock.release()
+
+
+class InvoiceDeleted(Exception):
+    pass
+
+
+def _release_stale_claims():
+    """Put back messages whose dispatcher died while sending them"""
+    timeout = getattr(settings, 'EMAIL_OUTBOX_SENDING_TIMEOUT', 600)
+    stale = OutboundEmail.objects.filter(
+        Q(claimed_at__lt=timezone.now() - timedelta(seconds=timeout)) | Q(claimed_at__isnull=True),
+        status='sending',
+    )
+    # The interrupted delivery counts as an attempt, so a message that kills
+    # its dispatcher does not come back forever
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    error = "Delivery interrupted"
+    stale.filter(attempts__gte=max_attempts - 1).update(
+        status='failed', claim_token=None, attempts=F('attempts') + 1, last_error=error,
+    )
+    stale.update(status='pending', claim_token=None, attempts=F('attempts') + 1, last_error=error)
+
+
+def _claim_batch(batch_size):
+    """Mark up to batch_size due messages as 'sending' under a new token; return the ones this call got"""
+    _release_stale_claims()
+    now = timezone.now()
+    due = OutboundEmail.objects.filter(
+        status='pending', next_attempt_at__lte=now
+    ).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size]
+    ids = list(due)
+    if not ids:
+        return []
+    # Another dispatcher may claim some of these first; the status condition
+    # leaves those rows out of this update, so they never carry our token
+    token = uuid.uuid4()
+    OutboundEmail.objects.filter(pk__in=ids, status='pending').update(
+        status='sending', claim_token=token, claimed_at=now,
+    )
+    return list(OutboundEmail.objects.filter(claim_token=token).select_related('invoice'))
+
+
+def _finish(email, **fields):
+    """Update a claimed message, unless its claim was released as stale meanwhile"""
+    fields['claim_token'] = None
+    OutboundEmail.objects.filter(pk=email.pk, claim_token=email.claim_token).update(**fields)
+
+
+def _build_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        connection=connection,
+    )
+    if email.attach_invoice_pdf:
+        if email.invoice is None:
+            raise InvoiceDeleted("The invoice was deleted before its e-mail was sent")
+        from .rendering import InvoiceRenderer
+
+        pdf_bytes = InvoiceRenderer(email.invoice).cached_pdf(settings.INVOICE_PDF_BASE_URL)
+        message.attach(f"invoice_{email.invoice.folio}.pdf", pdf_bytes, "application/pdf")
+    return message
+
+
+def _schedule_retry(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    if email.attempts >= max_attempts or isinstance(error, InvoiceDeleted):
+        email.status = 'failed'
+    else:
+        delay = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', 30) * 2 ** (email.attempts - 1)
+        email.status = 'pending'
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    _finish(
+        email, attempts=email.attempts, last_error=email.last_error,
+        status=email.status, next_attempt_at=email.next_attempt_at,
+    )
+
+
+def dispatch_outbox(batch_size=None):
+    """
+    Send one batch of due messages over a single connection.
+    Returns (sent, failed) counts for the batch.
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # The server is unreachable; every message in the batch waits for a retry
+        for email in batch:
+            _schedule_retry(email, e)
+        return 0, len(batch)
+
+    try:
+        for email in batch:
+            try:
+                message = _build_message(email, connection)
+                with span('smtp'):
+                    connection.send_messages([message])
+            except Exception as e:
+                logger.warning("Could not send e-mail %s: %s", email.pk, e)
+                _schedule_retry(email, e)
+                failed += 1
+                continue
+            _finish(email, status='sent', attempts=email.attempts + 1, sent_at=timezone.now(), last_error='')
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,125 @@
+"""
+Keyset (cursor) pagination for the invoice list.
+
+Instead of OFFSET, each page remembers the sort value and id of its edge row
+and the next query continues with WHERE (field, id) > (value, last_id), which
+an index on (field, id) answers directly. Page N costs the same as page 1 and
+no COUNT(*) is needed.
+"""
+import base64
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk, direction):
+    data = json.dumps({'v': value, 'id': pk, 'd': direction}, cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data['d'] not in ('next', 'prev'):
+            raise ValueError(data['d'])
+        return data
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(token) from e
+
+
+class CursorPage:
+    """A page of results with the cursors to reach its neighbours"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def paginate_by_cursor(queryset, field, descending=False, cursor=None, per_page=15):
+    """
+    Return the CursorPage that follows (or precedes) `cursor` for a queryset
+    sorted by `field` with the primary key as tie-breaker.
+    """
+    token = decode_cursor(cursor) if cursor else None
+    backwards = token is not None and token['d'] == 'prev'
+
+    # Walking backwards means fetching in the opposite order and flipping the page
+    fetch_descending = descending != backwards
+    keys = [field, 'pk'] if field not in ('id', 'pk') else ['pk']
+    queryset = queryset.order_by(*[f"-{key}" if fetch_descending else key for key in keys])
+
+    if token is not None:
+        lookup = 'lt' if fetch_descending else 'gt'
+        pk = token['id']
+        if len(keys) == 1:
+            queryset = queryset.filter(**{f"pk__{lookup}": pk})
+        else:
+            model_field = queryset.model._meta.get_field(field)
+            try:
+                value = model_field.to_python(token['v'])
+            except Exception as e:
+                raise InvalidCursor(cursor) from e
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": value}) | Q(**{field: value, f"pk__{lookup}": pk})
+            )
+
+    rows = list(queryset[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def edge(row, direction):
+        return encode_cursor(getattr(row, field) if len(keys) > 1 else None, row.pk, direction)
+
+    has_next = True if backwards else has_more
+    has_previous = has_more if backwards else token is not None
+    return CursorPage(
+        rows,
+        next_cursor=edge(rows[-1], 'next') if rows and has_next else None,
+        previous_cursor=edge(rows[0], 'prev') if rows and has_previous else None,
+    )
+
+
+def approximate_count(queryset, limit=1000):
+    """
+    Cheap row count for display. Returns (count, exact).
+
+    On PostgreSQL an unfiltered table uses the planner estimate; otherwise at
+    most `limit` + 1 rows are counted, so a huge match reports "limit+".
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0], False
+
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.template.loader import get_template
+from django.utils.module_loading import import_string
+
+TEMPLATE_NAME = "invoices/inv_template.html"
+
+
+class MemoryPDFBackend:
+    """Keep rendered PDFs in process memory, evicting the least recently used"""
+
+    def __init__(self, max_size=64 * 1024 * 1024, **options):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._size -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FileSystemPDFBackend:
+    """
+    Store rendered PDFs on disk so every worker process shares them.
+    Files live in LOCATION/<invoice_id>/<digest>.pdf and their mtime is
+    bumped on every hit, so eviction removes the least recently used first.
+
+    Eviction scans the whole directory, so it is not run on every write:
+    each process keeps an estimate of the size on disk (the last scan plus
+    its own writes since) and rescans only once that exceeds max_size.
+    Writes of other processes are counted at their next scan, so the
+    directory may briefly hold more than max_size.
+    """
+
+    def __init__(self, location, max_size=256 * 1024 * 1024, **options):
+        self.location = Path(location)
+        self.max_size = max_size
+        self._size = None  # unknown until the first scan
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.location / f"{key}.pdf"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        if len(data) > self.max_size:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_size:
+                self._size = self._evict()
+
+    def _evict(self):
+        """Scan the cache, remove the least recently used files over max_size; return the size left"""
+        entries = []
+        total = 0
+        for path in self.location.glob("*/*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        return total
+
+    def delete_prefix(self, prefix):
+        directory = self.location / prefix.rstrip("/")
+        for path in directory.glob("*.pdf"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        for path in self.location.glob("*/*.pdf"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        with self._lock:
+            self._size = None
+
+
+class PDFCache:
+    """Content-addressed cache of invoice PDFs"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def make_key(self, invoice, preview=False, template_name=TEMPLATE_NAME):
+        """
+        Build a key from everything that ends up in the rendered PDF:
+        invoice fields, products, updated_at, the template/static versions,
+        the template it is rendered with and that template's page profile.
+        Any change produces a new digest, so stale entries are never served.
+        """
+        from .layout import get_profile  # layout imports TEMPLATE_NAME from here
+
+        fields = {
+            field.attname: field.value_to_string(invoice)
+            for field in invoice._meta.concrete_fields
+        }
+        payload = {
+            "fields": fields,
+            "products": invoice.products,
+            "updated_at": invoice.updated_at.isoformat() if invoice.updated_at else None,
+            "preview": preview,
+            "assets": asset_version(),
+            "template": template_name,
+            "layout": list(get_profile(template_name)),
+        }
+        raw = json.dumps(payload, sort_keys=True, default=str).encode()
+        digest = hashlib.sha256(raw).hexdigest()
+        return f"{invoice.pk}/{digest}"
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, data):
+        self.backend.set(key, data)
+
+    def invalidate(self, invoice_pk):
+        """Drop every cached PDF of an invoice"""
+        if invoice_pk is not None:
+            self.backend.delete_prefix(f"{invoice_pk}/")
+
+    def clear(self):
+        self.backend.clear()
+
+
+_asset_version = None
+_asset_version_at = 0.0
+
+# Under DEBUG files change often, but walking every static file on each PDF
+# request is slow; the fingerprint is recomputed at most this often
+DEBUG_ASSET_VERSION_TTL = 2  # seconds
+
+
+def asset_version():
+    """
+    Fingerprint of the invoice template and static files (path, size, mtime).
+    Computed once per process, or every DEBUG_ASSET_VERSION_TTL seconds when
+    DEBUG is on.
+    """
+    global _asset_version, _asset_version_at
+    if _asset_version is not None:
+        if not settings.DEBUG or time.monotonic() - _asset_version_at < DEBUG_ASSET_VERSION_TTL:
+            return _asset_version
+
+    digest = hashlib.sha256()
+    digest.update(getattr(settings, "INVOICE_PDF_CACHE", {}).get("VERSION", "1").encode())
+
+    paths = []
+    template = get_template(TEMPLATE_NAME)
+    origin = getattr(template, "origin", None)
+    if origin is not None and origin.name:
+        paths.append(Path(origin.name))
+    for static_dir in getattr(settings, "STATICFILES_DIRS", []):
+        paths.extend(sorted(p for p in Path(static_dir).rglob("*") if p.is_file()))
+
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    _asset_version = digest.hexdigest()
+    _asset_version_at = time.monotonic()
+    return _asset_version
+
+
+_cache = None
+
+
+def get_pdf_cache():
+    """Return the process-wide PDF cache configured by settings.INVOICE_PDF_CACHE"""
+    global _cache
+    if _cache is None:
+        config = dict(getattr(settings, "INVOICE_PDF_CACHE", {}))
+        backend_path = config.pop("BACKEND", "invoices.pdf_cache.MemoryPDFBackend")
+        options = {key.lower(): value for key, value in config.items() if key != "VERSION"}
+        _cache = PDFCache(import_string(backend_path)(**options))
+    return _cache
+
+
+def _reset_cache(*, setting, **kwargs):
+    global _cache, _asset_version
+    if setting in ("INVOICE_PDF_CACHE", "STATICFILES_DIRS", "DEBUG"):
+        _cache = None
+        _asset_version = None
+
+
+setting_changed.connect(_reset_cache)
@@ -0,0 +1,163 @@
+"""
+What WeasyPrint needs besides the HTML, loaded once instead of per PDF.
+
+Before, every render fetched the logo and the stylesheets over HTTP, from
+our own server and from the CDNs, and parsed the CSS and fonts again.
+- url_fetcher() reads static files straight from STATIC_ROOT (or the
+  finders in development). Remote files (CDN stylesheets, web fonts) are
+  kept in memory after their first fetch.
+- get_resources() holds one FontConfiguration, the parsed STYLESHEETS and
+  WeasyPrint's image cache, reused by every render in the thread.
+  FontConfiguration wraps a Pango font map, so it is not shared between
+  threads. Under DEBUG the set is also rebuilt when a static stylesheet
+  changes on disk, checked at most every DEBUG_STATIC_CHECK_TTL seconds.
+"""
+import logging
+import mimetypes
+import os
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.templatetags.static import static
+from django.utils._os import safe_join
+from weasyprint import CSS, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+
+logger = logging.getLogger(__name__)
+
+# In cascade order. WeasyPrint applies them as user stylesheets; they all
+# moved out of the template together, so their order among themselves holds.
+# Absolute URLs are fetched; other entries are static files
+STYLESHEETS = (
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'https://fonts.googleapis.com/css2?family=Roboto:wght@400;500&display=swap',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'css/invoice-document.css',
+)
+
+REMOTE_TIMEOUT = 10  # seconds
+INCOMPLETE_RETRY = 300  # seconds before a set with a missing stylesheet is rebuilt
+DEBUG_STATIC_CHECK_TTL = 2  # seconds between mtime checks of the static stylesheets under DEBUG
+
+_remote = {}
+_remote_lock = threading.Lock()
+_local = threading.local()
+
+
+def _is_remote(url):
+    return url.startswith(('http://', 'https://'))
+
+
+def stylesheet_urls():
+    """STYLESHEETS as the browser loads them, for the HTML preview"""
+    return [url if _is_remote(url) else static(url) for url in STYLESHEETS]
+
+
+def find_static(name):
+    """The file of a static name, or None"""
+    if settings.STATIC_ROOT:
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if os.path.isfile(path):
+            return path
+    # Development, no collectstatic; never hashed names
+    return finders.find(name)
+
+
+def static_path(url):
+    """The file behind a URL under STATIC_URL, or None"""
+    prefix = urlsplit(settings.STATIC_URL)
+    parts = urlsplit(url)
+    if prefix.netloc and parts.netloc != prefix.netloc:
+        return None
+    if not parts.path.startswith(prefix.path):
+        return None
+    return find_static(unquote(parts.path[len(prefix.path):]))
+
+
+def _fetch_remote(url):
+    result = default_url_fetcher(url, timeout=REMOTE_TIMEOUT)
+    if 'file_obj' in result:
+        with result.pop('file_obj') as f:
+            result['string'] = f.read()
+    return result
+
+
+def url_fetcher(url):
+    """A WeasyPrint url_fetcher that never requests our own static files over HTTP"""
+    path = static_path(url) if _is_remote(url) else None
+    if path is not None:
+        return {
+            'file_obj': open(path, 'rb'),
+            'mime_type': mimetypes.guess_type(path)[0],
+            'redirected_url': url,
+            'path': path,
+        }
+
+    if not _is_remote(url):
+        return default_url_fetcher(url)  # data: and file: URLs
+
+    with _remote_lock:
+        result = _remote.get(url)
+    if result is None:
+        # Failures are not kept, so the next render tries again
+        result = _fetch_remote(url)
+        with _remote_lock:
+            _remote[url] = result
+    return dict(result)
+
+
+class Resources:
+    def __init__(self):
+        self.font_config = FontConfiguration()
+        self.image_cache = {}
+        self.stylesheets = []
+        self.complete = True
+        self.created = self.checked = time.monotonic()
+        # Static files only change in place during development
+        self.versions = self._static_versions() if settings.DEBUG else None
+
+        for url in STYLESHEETS:
+            try:
+                if _is_remote(url):
+                    sheet = CSS(url=url, url_fetcher=url_fetcher, font_config=self.font_config)
+                else:
+                    sheet = CSS(filename=find_static(url), url_fetcher=url_fetcher, font_config=self.font_config)
+            except Exception:
+                # Render without it, as WeasyPrint does with a broken <link>
+                logger.warning("Could not load stylesheet %s", url, exc_info=True)
+                self.complete = False
+                continue
+            self.stylesheets.append(sheet)
+
+    @staticmethod
+    def _static_versions():
+        versions = []
+        for url in STYLESHEETS:
+            path = None if _is_remote(url) else find_static(url)
+            versions.append(os.stat(path).st_mtime_ns if path else None)
+        return versions
+
+    def is_stale(self):
+        """A stylesheet failed to load a while ago, or (DEBUG) the static ones changed on disk"""
+        now = time.monotonic()
+        if not self.complete and now - self.created >= INCOMPLETE_RETRY:
+            return True
+        if not settings.DEBUG or now - self.checked < DEBUG_STATIC_CHECK_TTL:
+            return False
+        self.checked = now
+        return self._static_versions() != self.versions
+
+
+def get_resources():
+    """This thread's Resources, rebuilt when stale"""
+    resources = getattr(_local, 'resources', None)
+    if resources is None or resources.is_stale():
+        resources = _local.resources = Resources()
+    return resources
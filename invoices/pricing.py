@@ -0,0 +1,305 @@
+"""
+Declarative pricing rules shared by the server and the browser.
+
+PRICING_SPEC describes how a line's amounts and an invoice's totals are
+derived from the entered values. Invoice.calculate_totals() evaluates it here
+with Decimal; static/js/pricing.js evaluates the same spec (served through
+the json_script filter) with exact integer arithmetic for the live totals of
+inv_crt/inv_edit. The saved totals stay authoritative; the parity tests in
+invoices/tests.py run both engines over the same cases.
+
+Expressions are nested lists ``[op, arg, ...]``. A string argument is the
+name of an input or an earlier step, or a numeric literal. Every step is
+rounded to `decimal_places` with `rounding` before the next one uses it.
+
+PricingEngine evaluates the spec two ways. price_line()/price_totals()
+interpret it one line at a time, as the reference. price_rows()/
+totals_from_rows() run it as Python functions generated from the spec once,
+over compact tuples and in a fixed Decimal context. Invoice.calculate_totals()
+and calculate_totals_many() use the generated ones; the tests check both
+give the same results.
+"""
+import re
+from decimal import ROUND_HALF_UP, Context, Decimal, InvalidOperation, localcontext
+
+PRICING_SPEC = {
+    'decimal_places': 2,
+    'rounding': 'half_up',
+    'base_currency': 'MXN',
+    # Inputs: price, quantity, discount_percent, discount_amount, taxable, tax_rate
+    'line': [
+        {'name': 'subtotal', 'expr': ['mul', 'price', 'quantity']},
+        {'name': 'discount', 'expr': [
+            'if', ['gt', 'discount_percent', '0'],
+            ['percent', 'subtotal', 'discount_percent'],
+            'discount_amount',
+        ]},
+        {'name': 'total', 'expr': ['sub', 'subtotal', 'discount']},
+        {'name': 'tax', 'expr': ['if', 'taxable', ['percent', 'total', 'tax_rate'], '0']},
+    ],
+    # Inputs: the line steps (through sum), exchange_rate, foreign_currency
+    'totals': [
+        {'name': 'subtotal', 'expr': ['sum', 'subtotal']},
+        {'name': 'discount', 'expr': ['sum', 'discount']},
+        {'name': 'tax', 'expr': ['sum', 'tax']},
+        {'name': 'total', 'expr': ['add', ['sub', 'subtotal', 'discount'], 'tax']},
+        {'name': 'total_base', 'expr': ['if', 'foreign_currency', ['mul', 'total', 'exchange_rate'], 'total']},
+    ],
+}
+
+# Model fields the line and totals steps are stored in
+LINE_FIELDS = {
+    'subtotal': 'line_subtotal',
+    'discount': 'line_discount',
+    'tax': 'line_tax',
+    'total': 'line_total',
+}
+TOTAL_FIELDS = {
+    'subtotal': 'subtotal',
+    'discount': 'total_discount',
+    'tax': 'total_tax',
+    'total': 'total',
+}
+
+ROUNDING = {'half_up': ROUND_HALF_UP}
+
+# Line inputs in the order of the compact records price_rows() takes
+LINE_INPUTS = ('price', 'quantity', 'discount_percent', 'discount_amount', 'taxable')
+
+_number_re = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def as_decimal(value, default=0):
+    """
+    Decimal(str(value)), or Decimal(str(default)) if that fails, like
+    Invoice._safe_decimal. Decimals and ints skip the string round trip.
+    """
+    if value.__class__ is Decimal:
+        return value
+    if value.__class__ is int:
+        return Decimal(value)
+    if value is None:
+        return Decimal(str(default))
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        return Decimal(str(default))
+
+
+def line_record(line):
+    """The compact LINE_INPUTS tuple of an InvoiceLine"""
+    return (
+        as_decimal(line.price),
+        as_decimal(line.quantity, 1),
+        as_decimal(line.discount_percent),
+        as_decimal(line.discount_amount),
+        line.taxable,
+    )
+
+
+def validate_line(price, quantity, discount_percent, discount_amount):
+    """
+    Raise ValueError for entered values that would give a line negative
+    amounts, which the invoice_totals_non_negative constraint rejects
+    """
+    if price < 0 or quantity < 0:
+        raise ValueError("Price and quantity must not be negative")
+    if not 0 <= discount_percent <= 100:
+        raise ValueError("Discount percent must be between 0 and 100")
+    if discount_amount < 0:
+        raise ValueError("Discount must not be negative")
+    # Compared as priced: both are rounded before the discount is subtracted
+    subtotal = as_decimal(price * quantity).quantize(engine.quantum, rounding=engine.rounding)
+    discount = as_decimal(discount_amount).quantize(engine.quantum, rounding=engine.rounding)
+    if discount_percent == 0 and discount > subtotal:
+        raise ValueError("Discount must not exceed the line subtotal")
+
+
+def _compile(expr):
+    """Turn a spec expression into a function of the evaluation scope"""
+    if isinstance(expr, str):
+        if _number_re.match(expr):
+            value = Decimal(expr)
+            return lambda scope: value
+        return lambda scope: scope[expr]
+
+    op, *args = expr
+    if op == 'sum':
+        name = args[0]
+        return lambda scope: sum((line[name] for line in scope['lines']), Decimal('0'))
+
+    a, *rest = [_compile(arg) for arg in args]
+    if op == 'add':
+        return lambda scope: a(scope) + rest[0](scope)
+    if op == 'sub':
+        return lambda scope: a(scope) - rest[0](scope)
+    if op == 'mul':
+        return lambda scope: a(scope) * rest[0](scope)
+    if op == 'percent':
+        return lambda scope: a(scope) * rest[0](scope) / 100
+    if op == 'gt':
+        return lambda scope: a(scope) > rest[0](scope)
+    if op == 'if':
+        return lambda scope: rest[0](scope) if a(scope) else rest[1](scope)
+    raise ValueError(f"Unknown pricing operation: {op}")
+
+
+_OPERATORS = {'add': '({} + {})', 'sub': '({} - {})', 'mul': '({} * {})', 'percent': '({} * {} / 100)', 'gt': '({} > {})'}
+
+
+def _source(expr, constants):
+    """Turn a spec expression into Python source; numeric literals become named constants"""
+    if isinstance(expr, str):
+        if _number_re.match(expr):
+            name = f"_c{len(constants)}"
+            constants[name] = Decimal(expr)
+            return name
+        if not expr.isidentifier():
+            raise ValueError(f"Invalid pricing name: {expr}")
+        return expr
+
+    op, *args = expr
+    if op == 'sum':
+        return f"_sum_{args[0]}"
+    if op == 'if':
+        condition, then, otherwise = [_source(arg, constants) for arg in args]
+        return f"({then} if {condition} else {otherwise})"
+    if op in _OPERATORS:
+        return _OPERATORS[op].format(*[_source(arg, constants) for arg in args])
+    raise ValueError(f"Unknown pricing operation: {op}")
+
+
+class PricingEngine:
+    """PRICING_SPEC compiled once, evaluated with Decimal"""
+
+    def __init__(self, spec=PRICING_SPEC):
+        self.spec = spec
+        self.quantum = Decimal(1).scaleb(-spec['decimal_places'])
+        self.rounding = ROUNDING[spec['rounding']]
+        self.line_steps = [(step['name'], _compile(step['expr'])) for step in spec['line']]
+        self.total_steps = [(step['name'], _compile(step['expr'])) for step in spec['totals']]
+        self.line_names = [name for name, _ in self.line_steps]
+        # Intermediate results keep 28 digits whatever the thread's context is;
+        # each step is then quantized with the spec's rounding
+        self.context = Context(prec=28)
+        self._price_rows, self._totals_from_rows = self._generate()
+
+    def _generate(self):
+        constants = {}
+        rounded = ".quantize(_quantum, _rounding)"
+        line_code = [
+            "def price_rows(rows, tax_rate):",
+            "    priced = []",
+            "    append = priced.append",
+            "    with _localcontext(_context):",
+            f"        for {', '.join(LINE_INPUTS)} in rows:",
+        ]
+        line_code += [
+            f"            {step['name']} = {_source(step['expr'], constants)}{rounded}" for step in self.spec['line']
+        ]
+        line_code.append(f"            append(({', '.join(self.line_names)},))")
+        line_code.append("    return priced")
+
+        totals_code = [
+            "def totals_from_rows(priced, exchange_rate, foreign_currency):",
+            f"    columns = list(zip(*priced)) or [()] * {len(self.line_names)}",
+            "    with _localcontext(_context):",
+        ]
+        totals_code += [
+            f"        _sum_{name} = sum(columns[{index}], _zero)" for index, name in enumerate(self.line_names)
+        ]
+        totals_code += [
+            f"        {step['name']} = {_source(step['expr'], constants)}{rounded}" for step in self.spec['totals']
+        ]
+        totals_code.append(
+            "    return {" + ', '.join(f"{name!r}: {name}" for name, _ in self.total_steps) + "}"
+        )
+
+        namespace = {
+            '_localcontext': localcontext, '_context': self.context, '_zero': Decimal('0'),
+            '_quantum': self.quantum, '_rounding': self.rounding, **constants,
+        }
+        exec('\n'.join(line_code) + '\n\n' + '\n'.join(totals_code), namespace)
+        return namespace['price_rows'], namespace['totals_from_rows']
+
+    def price_rows(self, rows, tax_rate):
+        """
+        Fast path of price_line for many lines: rows are LINE_INPUTS tuples of
+        Decimals, the result one tuple of the line steps (line_names) per row
+        """
+        return self._price_rows(rows, tax_rate)
+
+    def totals_from_rows(self, priced, exchange_rate, currency):
+        """Fast path of price_totals for tuples from price_rows"""
+        return self._totals_from_rows(priced, exchange_rate, currency != self.spec['base_currency'])
+
+    def _run(self, steps, scope):
+        for name, func in steps:
+            scope[name] = func(scope).quantize(self.quantum, rounding=self.rounding)
+        return scope
+
+    def price_line(self, price, quantity, discount_percent, discount_amount, taxable, tax_rate):
+        """Return the line steps (subtotal, discount, total, tax) as a dict"""
+        scope = self._run(self.line_steps, {
+            'price': price,
+            'quantity': quantity,
+            'discount_percent': discount_percent,
+            'discount_amount': discount_amount,
+            'taxable': taxable,
+            'tax_rate': tax_rate,
+        })
+        return {name: scope[name] for name, _ in self.line_steps}
+
+    def price_totals(self, lines, exchange_rate, currency):
+        """Return the totals steps for priced lines (dicts from price_line)"""
+        scope = self._run(self.total_steps, {
+            'lines': lines,
+            'exchange_rate': exchange_rate,
+            'foreign_currency': currency != self.spec['base_currency'],
+        })
+        return {name: scope[name] for name, _ in self.total_steps}
+
+    def to_base(self, total, exchange_rate, currency):
+        """Convert an invoice total to the base currency (the total_base step)"""
+        scope = {
+            'total': total,
+            'exchange_rate': exchange_rate,
+            'foreign_currency': currency != self.spec['base_currency'],
+        }
+        func = dict(self.total_steps)['total_base']
+        return func(scope).quantize(self.quantum, rounding=self.rounding)
+
+
+engine = PricingEngine()
+
+# Positions of the stored amounts (InvoiceLine.set_amounts order) in a priced row
+_STORED = [engine.line_names.index(step) for step in ('subtotal', 'discount', 'tax', 'total')]
+
+
+def calculate_totals_many(invoices):
+    """
+    Invoice.calculate_totals() for many invoices at once. The lines of all
+    invoices sharing a tax rate are priced in a single price_rows() call.
+    """
+    invoices = list(invoices)
+    groups = {}
+    for invoice in invoices:
+        groups.setdefault(as_decimal(invoice.tax_rate), []).append(invoice)
+
+    for tax_rate, group in groups.items():
+        lines = [line for invoice in group for line in invoice.get_lines()]
+        priced = engine.price_rows([line_record(line) for line in lines], tax_rate)
+        for line, row in zip(lines, priced):
+            line.set_amounts(*[row[index] for index in _STORED])
+
+        # The totals are the sum of the rounded line amounts (see invoices.line_edits)
+        offset = 0
+        for invoice in group:
+            count = len(invoice.get_lines())
+            totals = engine.totals_from_rows(
+                priced[offset:offset + count], as_decimal(invoice.exchange_rate), invoice.currency
+            )
+            offset += count
+            for step, field in TOTAL_FIELDS.items():
+                setattr(invoice, field, totals[step])
+    return invoices
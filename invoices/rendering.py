@@ -0,0 +1,119 @@
+import io
+
+from django.template.loader import render_to_string
+from weasyprint import HTML
+
+from .display import line_views
+from .instrumentation import span
+from .layout import get_profile, paginate
+from .pdf_cache import TEMPLATE_NAME, get_pdf_cache
+from .pdf_resources import get_resources, stylesheet_urls, url_fetcher
+
+
+class InvoiceRenderer:
+    """Helper class to handle invoice rendering logic"""
+
+    # Subclasses for other templates set this; its page profile (invoices.layout) goes with it
+    template_name = TEMPLATE_NAME
+
+    def __init__(self, invoice):
+        self.invoice = invoice
+
+    def get_pages_data(self, products=None):
+        """Split the products into pages by their estimated row heights"""
+        if products is None:
+            products = self.invoice.get_lines()
+        pages = paginate(products, get_profile(self.template_name), comments=self.invoice.comments)
+        return {
+            'pages': pages,
+            'total_pages': len(pages),
+        }
+
+    def get_context(self, preview=True):
+        """Get template context for invoice rendering"""
+        # Lines are formatted once here; the template only prints the strings
+        pages_data = self.get_pages_data(line_views(self.invoice.get_lines()))
+        return {
+            'invoice': self.invoice,
+            'preview': preview,
+            'pages': pages_data['pages'],
+            'total_pages': pages_data['total_pages'],
+            'stylesheets': stylesheet_urls(),
+        }
+
+    def render_pdf(self, request, preview=False):
+        """Return the invoice PDF as bytes, served from the PDF cache when possible"""
+        return self.cached_pdf(request.build_absolute_uri(), preview=preview)
+
+    def cached_pdf(self, base_url, preview=False):
+        """Like render_pdf, for callers outside a request (workers, e-mail outbox)"""
+        with span('pdf'):
+            cache = get_pdf_cache()
+            key = cache.make_key(self.invoice, preview=preview, template_name=self.template_name)
+            pdf_bytes = cache.get(key)
+            if pdf_bytes is None:
+                pdf_bytes = self.write_pdf(base_url, preview=preview)
+                cache.set(key, pdf_bytes)
+            return pdf_bytes
+
+    def write_pdf(self, base_url, preview=False):
+        """Generate PDF from invoice template and return as bytes"""
+        html_string = render_to_string(self.template_name, self.get_context(preview=preview))
+        resources = get_resources()
+        pdf_io = io.BytesIO()
+        with span('weasyprint'):
+            HTML(string=html_string, base_url=base_url, url_fetcher=url_fetcher).write_pdf(
+                pdf_io,
+                stylesheets=resources.stylesheets,
+                font_config=resources.font_config,
+                cache=resources.image_cache,
+            )
+        return pdf_io.getvalue()
+
+
+class StatementRenderer:
+    """
+    One PDF holding many invoices (a month-end statement). Each invoice keeps
+    its own pages and page numbers, as in its single PDF.
+
+    Invoices are laid out `chunk_size` at a time, one WeasyPrint pass per
+    chunk with the shared stylesheets and fonts, and the pages of all chunks
+    are written as one document. progress(done, total) is called after each
+    chunk.
+    """
+
+    def __init__(self, invoices, chunk_size=25):
+        self.invoices = list(invoices)
+        self.chunk_size = chunk_size
+
+    def get_html(self, invoices):
+        # Without preview the template has no <link>s, only the pages
+        renderers = [InvoiceRenderer(invoice) for invoice in invoices]
+        return ''.join(
+            render_to_string(renderer.template_name, renderer.get_context(preview=False)) for renderer in renderers
+        )
+
+    def write_pdf(self, base_url, progress=None):
+        if not self.invoices:
+            raise ValueError("A statement needs at least one invoice")
+        resources = get_resources()
+        total = len(self.invoices)
+        documents = []
+        with span('pdf'):
+            for start in range(0, total, self.chunk_size):
+                chunk = self.invoices[start:start + self.chunk_size]
+                html_string = self.get_html(chunk)
+                with span('weasyprint'):
+                    documents.append(HTML(string=html_string, base_url=base_url, url_fetcher=url_fetcher).render(
+                        stylesheets=resources.stylesheets,
+                        font_config=resources.font_config,
+                        cache=resources.image_cache,
+                    ))
+                if progress is not None:
+                    progress(start + len(chunk), total)
+
+            pages = [page for document in documents for page in document.pages]
+            pdf_io = io.BytesIO()
+            with span('weasyprint'):
+                documents[0].copy(pages).write_pdf(pdf_io)
+        return pdf_io.getvalue()
@@ -0,0 +1,191 @@
+"""
+Sales rollups.
+
+Every invoice contributes to one SalesRollup row per period (day, month) and
+dimension (all, seller, client, payment method) in its currency. Saves and
+deletes apply the difference between the invoice's previous and new
+contribution with F() increments, so reports read a handful of pre-summed
+rows instead of every invoice. Writes that bypass Invoice.save() must call
+record_many() for the new invoices (bulk_create) or rebuild_rollups()
+(queryset.update) afterwards.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+
+from .models import Invoice, SalesRollup
+from .pricing import engine
+
+AMOUNT_FIELDS = ['subtotal', 'total_discount', 'total_tax', 'total']
+
+# Invoice fields a contribution depends on
+SNAPSHOT_FIELDS = [
+    'date', 'currency', 'exchange_rate', 'sell_name', 'clt_name', 'payment_method', *AMOUNT_FIELDS,
+]
+
+DIMENSIONS = {
+    'all': lambda snapshot: '',
+    'seller': lambda snapshot: snapshot['sell_name'][:64],
+    'client': lambda snapshot: snapshot['clt_name'][:64],
+    'payment_method': lambda snapshot: snapshot['payment_method'],
+}
+
+PERIODS = {
+    'day': lambda day: day,
+    'month': lambda day: day.replace(day=1),
+}
+
+
+def snapshot(invoice):
+    """The values of an invoice that its rollup contribution depends on"""
+    return {field: getattr(invoice, field) for field in SNAPSHOT_FIELDS}
+
+
+def stored_snapshot(pk, using=None):
+    """The snapshot of an invoice as currently stored, or None"""
+    return Invoice.objects.using(using).filter(pk=pk).values(*SNAPSHOT_FIELDS).first()
+
+
+def _contribution(snapshot, sign):
+    """{rollup key: amounts} that one invoice adds (sign=1) or removes (sign=-1)"""
+    amounts = {field: Decimal(snapshot[field]) * sign for field in AMOUNT_FIELDS}
+    amounts['total_base'] = engine.to_base(
+        Decimal(snapshot['total']), Decimal(snapshot['exchange_rate']), snapshot['currency']
+    ) * sign
+    amounts['invoice_count'] = sign
+
+    contribution = {}
+    for period, period_start in PERIODS.items():
+        for dimension, key in DIMENSIONS.items():
+            rollup_key = (period, period_start(snapshot['date']), dimension, key(snapshot), snapshot['currency'])
+            contribution[rollup_key] = amounts
+    return contribution
+
+
+def record_change(before, after, using=None):
+    """
+    Move an invoice's contribution from `before` to `after` (snapshots; None
+    for a new or deleted invoice). Rows whose amounts don't change are skipped.
+    """
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    for snap, sign in ((before, -1), (after, 1)):
+        if snap is None:
+            continue
+        for rollup_key, amounts in _contribution(snap, sign).items():
+            for field, value in amounts.items():
+                deltas[rollup_key][field] += value
+
+    # An invoice adds the same amounts to each of its rows, so the rows are
+    # grouped by delta and each group is written together
+    groups = defaultdict(list)
+    for rollup_key, delta in deltas.items():
+        if any(delta.values()):
+            groups[tuple(sorted((field, value) for field, value in delta.items() if value))].append(rollup_key)
+
+    with transaction.atomic(using=using, savepoint=False):
+        for delta, rollup_keys in groups.items():
+            _apply_many(rollup_keys, dict(delta), using)
+
+
+def _key_filter(rollup_key):
+    period, period_start, dimension, key, currency = rollup_key
+    return Q(period=period, period_start=period_start, dimension=dimension, key=key, currency=currency)
+
+
+def _apply(rollup_key, delta, using):
+    rows = SalesRollup.objects.using(using).filter(_key_filter(rollup_key))
+    increments = {field: F(field) + value for field, value in delta.items() if value}
+    if not rows.update(**increments):
+        _create(rollup_key, delta, increments, using)
+
+
+def _apply_many(rollup_keys, delta, using):
+    """
+    Add the same delta to several rollup rows: one SELECT and one UPDATE for
+    the rows that exist, a create for each one that does not
+    """
+    condition = Q()
+    for rollup_key in rollup_keys:
+        condition |= _key_filter(rollup_key)
+    existing = {
+        tuple(row[1:]): row[0]
+        for row in SalesRollup.objects.using(using).filter(condition).values_list(
+            'pk', 'period', 'period_start', 'dimension', 'key', 'currency',
+        )
+    }
+    increments = {field: F(field) + value for field, value in delta.items() if value}
+    if existing:
+        SalesRollup.objects.using(using).filter(pk__in=existing.values()).update(**increments)
+    for rollup_key in rollup_keys:
+        if rollup_key not in existing:
+            _create(rollup_key, delta, increments, using)
+
+
+def _create(rollup_key, delta, increments, using):
+    period, period_start, dimension, key, currency = rollup_key
+    try:
+        with transaction.atomic(using=using):
+            SalesRollup.objects.using(using).create(
+                period=period, period_start=period_start, dimension=dimension, key=key,
+                currency=currency, **delta,
+            )
+    except IntegrityError:
+        # Created concurrently since it was looked up
+        SalesRollup.objects.using(using).filter(_key_filter(rollup_key)).update(**increments)
+
+
+def aggregate(snapshots):
+    """Sum the contributions of many invoice snapshots into {rollup key: amounts}"""
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    for snap in snapshots:
+        for rollup_key, amounts in _contribution(snap, 1).items():
+            for field, value in amounts.items():
+                totals[rollup_key][field] += value
+    return totals
+
+
+def record_many(snapshots, using=None):
+    """Add many new invoices at once, with one write per affected rollup row"""
+    with transaction.atomic(using=using, savepoint=False):
+        for rollup_key, delta in aggregate(snapshots).items():
+            _apply(rollup_key, delta, using)
+
+
+def rebuild_rollups(using=None, chunk_size=2000):
+    """Recompute every rollup from the invoices table"""
+    with transaction.atomic(using=using):
+        SalesRollup.objects.using(using).all().delete()
+        snapshots = Invoice.objects.using(using).values(*SNAPSHOT_FIELDS).iterator(chunk_size=chunk_size)
+        SalesRollup.objects.using(using).bulk_create([
+            SalesRollup(
+                period=period, period_start=period_start, dimension=dimension, key=key,
+                currency=currency, **amounts,
+            )
+            for (period, period_start, dimension, key, currency), amounts in aggregate(snapshots).items()
+        ], batch_size=chunk_size)
+
+
+def sales_report(period='month', dimension='all', start=None, end=None, currency=None, using=None):
+    """
+    Rollup rows for a period/dimension between start and end (inclusive),
+    newest first. Reads only SalesRollup, never the invoices.
+    """
+    rows = SalesRollup.objects.using(using).filter(period=period, dimension=dimension, invoice_count__gt=0)
+    if start:
+        rows = rows.filter(period_start__gte=PERIODS[period](start))
+    if end:
+        rows = rows.filter(period_start__lte=end)
+    if currency:
+        rows = rows.filter(currency=currency)
+    return rows.order_by('-period_start', 'key', 'currency')
+
+
+def summarize(rows):
+    """Totals in the base currency of rollup rows, grouped by key"""
+    return list(
+        rows.order_by().values('key').annotate(
+            invoice_count=Sum('invoice_count'), total_base=Sum('total_base'),
+        ).order_by('-total_base')
+    )
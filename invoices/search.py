@@ -0,0 +1,270 @@
+"""
+Indexed invoice search.
+
+Each invoice is flattened into one search document (folio, title, client,
+seller, e-mails and product names) kept in sync by the signals in
+invoices.signals. The document lives in an FTS5 virtual table on SQLite and
+in a pg_trgm-indexed table on PostgreSQL; other backends fall back to
+icontains lookups. search() returns the matching invoices ranked by relevance.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Invoice
+
+FTS_TABLE = 'invoices_invoice_fts'
+TRGM_TABLE = 'invoices_invoice_search'
+
+COLUMNS = ['folio', 'title', 'clt_name', 'sell_name', 'emails', 'products']
+
+# Result cap for ranked searches; beyond this nobody pages through relevance
+MAX_RESULTS = 500
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+
+
+def document_for(invoice, product_names=None):
+    """Return the searchable text of an invoice, one value per COLUMNS entry"""
+    if product_names is None:
+        product_names = [line.name for line in invoice.get_lines()]
+    return [
+        invoice.folio or '',
+        invoice.title or '',
+        invoice.clt_name or '',
+        invoice.sell_name or '',
+        f"{invoice.clt_email or ''} {invoice.sell_email or ''}",
+        ' '.join(product_names),
+    ]
+
+
+class SQLiteSearchBackend:
+    """FTS5 table whose rowid is the invoice id"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create(self):
+        columns = ', '.join(COLUMNS)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{columns}, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def drop(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+    def index(self, invoice, product_names=None):
+        placeholders = ', '.join(['%s'] * (len(COLUMNS) + 1))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [invoice.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(COLUMNS)}) VALUES ({placeholders})",
+                [invoice.pk, *document_for(invoice, product_names)],
+            )
+
+    def remove(self, pk):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+
+    def _match_expression(self, text, column=None):
+        # Every word must match, as a prefix, so partial input still finds results
+        terms = ['"%s"*' % word.replace('"', '""') for word in _word_re.findall(text)]
+        if column:
+            terms = [f"{column} : {term}" for term in terms]
+        return ' AND '.join(terms)
+
+    def filter(self, queryset, text, column=None):
+        expression = self._match_expression(text, column)
+        if not expression:
+            return queryset
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression])
+        )
+
+    def search_ids(self, text, column=None, limit=MAX_RESULTS):
+        expression = self._match_expression(text, column)
+        if not expression:
+            return []
+        # bm25 weights follow COLUMNS: folio and title count the most
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 3.0, 3.0, 1.0, 1.0) LIMIT %s",
+                [expression, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """One text document per invoice with a trigram GIN index"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TRGM_TABLE} ("
+                f"invoice_id bigint PRIMARY KEY REFERENCES invoices_invoice (id) ON DELETE CASCADE, "
+                f"document text NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRGM_TABLE}_trgm ON {TRGM_TABLE} "
+                f"USING gin (document gin_trgm_ops)"
+            )
+            for column in ['title', 'clt_name', 'sell_name']:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS invoices_invoice_{column}_trgm ON invoices_invoice "
+                    f"USING gin ({column} gin_trgm_ops)"
+                )
+
+    def drop(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TRGM_TABLE}")
+            for column in ['title', 'clt_name', 'sell_name']:
+                cursor.execute(f"DROP INDEX IF EXISTS invoices_invoice_{column}_trgm")
+
+    def index(self, invoice, product_names=None):
+        document = ' '.join(document_for(invoice, product_names))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {TRGM_TABLE} (invoice_id, document) VALUES (%s, %s) "
+                f"ON CONFLICT (invoice_id) DO UPDATE SET document = EXCLUDED.document",
+                [invoice.pk, document],
+            )
+
+    def remove(self, pk):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TRGM_TABLE} WHERE invoice_id = %s", [pk])
+
+    def _conditions(self, text):
+        words = _word_re.findall(text)
+        conditions = ' AND '.join(['document ILIKE %s'] * len(words))
+        return conditions, [f"%{word}%" for word in words]
+
+    def filter(self, queryset, text, column=None):
+        if column:
+            # Column filters use ILIKE on the column itself, backed by the
+            # per-column trigram indexes created above
+            return icontains_filter(queryset, text, column)
+        conditions, params = self._conditions(text)
+        if not params:
+            return queryset
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT invoice_id FROM {TRGM_TABLE} WHERE {conditions}", params)
+        )
+
+    def search_ids(self, text, column=None, limit=MAX_RESULTS):
+        conditions, params = self._conditions(text)
+        if not params:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT invoice_id FROM {TRGM_TABLE} WHERE {conditions} "
+                f"ORDER BY similarity(document, %s) DESC LIMIT %s",
+                [*params, text, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+FIELD_MAP = {
+    'folio': ['folio'],
+    'title': ['title'],
+    'clt_name': ['clt_name'],
+    'sell_name': ['sell_name'],
+    'emails': ['clt_email', 'sell_email'],
+    'products': ['lines__name'],
+}
+
+
+def icontains_filter(queryset, text, column=None):
+    """Every word must appear in one of the column's fields (all columns if None)"""
+    fields = FIELD_MAP[column] if column else [field for fields in FIELD_MAP.values() for field in fields]
+    for word in _word_re.findall(text):
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f"{field}__icontains": word})
+        queryset = queryset.filter(pk__in=Invoice.objects.filter(condition).values('pk'))
+    return queryset
+
+
+class FallbackSearchBackend:
+    """Unindexed icontains search for backends without a text index"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create(self):
+        pass
+
+    def drop(self):
+        pass
+
+    def index(self, invoice, product_names=None):
+        pass
+
+    def remove(self, pk):
+        pass
+
+    def filter(self, queryset, text, column=None):
+        return icontains_filter(queryset, text, column)
+
+    def search_ids(self, text, column=None, limit=MAX_RESULTS):
+        queryset = self.filter(Invoice.objects.using(self.connection.alias), text, column)
+        return list(queryset.order_by('-date', '-id').values_list('pk', flat=True)[:limit])
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(using=None):
+    using = using or router.db_for_write(Invoice)
+    connection = connections[using]
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)(connection)
+
+
+def index_invoice(invoice):
+    get_backend(invoice._state.db).index(invoice)
+
+
+def remove_invoice(pk, using=None):
+    get_backend(using).remove(pk)
+
+
+def rebuild_index(using=None, chunk_size=500):
+    """(Re)index every invoice; used by the migration and after bulk writes"""
+    backend = get_backend(using)
+    invoices = Invoice.objects.using(backend.connection.alias).prefetch_related('lines')
+    for invoice in invoices.iterator(chunk_size=chunk_size):
+        backend.index(invoice)
+
+
+def ranked(queryset, ids):
+    """Restrict a queryset to ids and order it like the id list"""
+    if not ids:
+        return queryset.none()
+    order = Case(*[When(pk=pk, then=Value(rank)) for rank, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(order)
+
+
+def search(queryset, text, column=None, limit=MAX_RESULTS):
+    """Filter a queryset of invoices to those matching text, best match first"""
+    ids = get_backend(queryset.db).search_ids(text, column=column, limit=limit)
+    return ranked(queryset, ids)
+
+
+def filter_matches(queryset, text, column=None):
+    """
+    Restrict a queryset to invoices matching text without ranking them, so
+    it can keep its own ordering (used by the inv_list column filters)
+    """
+    return get_backend(queryset.db).filter(queryset, text, column=column)
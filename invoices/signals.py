@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Invoice
+from .reporting import record_change, snapshot, stored_snapshot
+from .search import index_invoice, remove_invoice
+
+
+@receiver(post_save, sender=Invoice)
+def reindex_invoice(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Invoice.save() writes the lines after post_save, inside the same
+    # transaction, so index once everything is committed
+    transaction.on_commit(lambda: index_invoice(instance), using=instance._state.db)
+
+
+@receiver(post_delete, sender=Invoice)
+def unindex_invoice(sender, instance, using, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: remove_invoice(pk, using), using=using)
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_rollup_snapshot(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    instance._rollup_snapshot = stored_snapshot(instance.pk, using) if instance.pk else None
+
+
+@receiver(post_save, sender=Invoice)
+def update_rollups(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    # Runs inside Invoice.save()'s transaction, so rollups commit with the invoice
+    record_change(getattr(instance, '_rollup_snapshot', None), snapshot(instance), using)
+    instance._rollup_snapshot = None
+
+
+@receiver(post_delete, sender=Invoice)
+def remove_from_rollups(sender, instance, using, **kwargs):
+    record_change(snapshot(instance), None, using)
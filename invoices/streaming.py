@@ -0,0 +1,52 @@
+import zipfile
+
+
+class _StreamSink:
+    """
+    Write-only file object for ZipFile. It has tell() but no seek(), so
+    ZipFile writes data descriptors instead of seeking back to patch headers,
+    and the archive can be sent in pieces as it is built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files, compression=zipfile.ZIP_STORED):
+    """
+    Yield a ZIP archive chunk by chunk from an iterable of (name, data).
+    data is bytes, or an iterable of bytes for members too large to build in
+    memory. PDFs are already compressed, so members are stored by default.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        for name, data in files:
+            if isinstance(data, bytes):
+                archive.writestr(name, data)
+            else:
+                with archive.open(name, "w", force_zip64=True) as member:
+                    for chunk in data:
+                        member.write(chunk)
+                        # Deflate buffers internally; only send what it flushed
+                        flushed = sink.pop()
+                        if flushed:
+                            yield flushed
+            yield sink.pop()
+    yield sink.pop()
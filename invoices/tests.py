@@ -1,3 +1,1090 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import logging
+import random
+import shutil
+import subprocess
+import tempfile
+import uuid
+import zipfile
+from datetime import date, timedelta
+from pathlib import Path
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import skipUnless
+from unittest.mock import patch
+
+from .assets import StaticFilesMiddleware
+from .display import LineView, line_views
+from .benchmarks import suite
+from .filters import filter_invoices, filter_month
+from .folios import FolioAllocator, _allocator, reserve_folio_strings
+from .imports import import_invoices, read_csv, read_jsonl
+from .instrumentation import InstrumentationMiddleware, registry, span
+from .layout import get_profile, paginate, row_height, text_lines
+from .line_edits import LineEditError, VersionConflict, apply_line_ops
+from .jobs import enqueue_render, render_many
+from .models import FolioSequence, Invoice, InvoiceLine, OutboundEmail, SalesRollup
+from .outbox import dispatch_outbox, enqueue_email
+from .pricing import PRICING_SPEC, as_decimal, calculate_totals_many, engine, line_record
+from .reporting import rebuild_rollups, sales_report
+from .pagination import approximate_count, paginate_by_cursor
+from .search import filter_matches, search
+from .pdf_cache import TEMPLATE_NAME, FileSystemPDFBackend, MemoryPDFBackend, asset_version, get_pdf_cache
+from .streaming import stream_zip
+from .exports import export_rows, stream_csv, stream_xlsx
+
+try:
+    from . import pdf_resources
+    from .rendering import InvoiceRenderer, StatementRenderer
+except OSError:  # WeasyPrint cannot load Pango
+    pdf_resources = None
+
+
+# The instrumentation middleware logs one JSON line per request; keep them
+# out of the test output whichever runner loads this module
+logging.getLogger('invoices.instrumentation').setLevel(logging.WARNING)
+
+
+def make_invoice(**kwargs):
+    data = {
+        'title': 'Instalación de red',
+        'date': date(2025, 8, 15),
+        'clt_name': 'Cliente',
+        'clt_email': 'cliente@example.com',
+        'clt_phone': '6640000000',
+        'sell_name': 'Vendedor',
+        'sell_email': 'vendedor@example.com',
+        'sell_phone': '6641111111',
+    }
+    data.update(kwargs)
+    return Invoice(**data)
+
+
+class InvoiceLineTests(TestCase):
+    def test_products_are_saved_as_lines_with_totals(self):
+        invoice = make_invoice(tax_rate=16)
+        invoice.add_product({'name': 'Cable', 'price': '100', 'quantity': 2, 'discount_percent': 10})
+        invoice.add_product({'name': 'Mano de obra', 'price': 50, 'quantity': 1, 'taxable': False})
+        invoice.save()
+
+        invoice = Invoice.objects.prefetch_related('lines').get(pk=invoice.pk)
+        lines = invoice.get_lines()
+        self.assertEqual([line.name for line in lines], ['Cable', 'Mano de obra'])
+        self.assertEqual(lines[0].line_total, Decimal('180.00'))
+        self.assertEqual(invoice.subtotal, Decimal('250.00'))
+        self.assertEqual(invoice.total_discount, Decimal('20.00'))
+        self.assertEqual(invoice.total_tax, Decimal('28.80'))
+        self.assertEqual(invoice.total, Decimal('258.80'))
+
+    def test_remove_product_deletes_row_and_renumbers(self):
+        invoice = make_invoice()
+        for name in ['A', 'B', 'C']:
+            invoice.add_product({'name': name, 'price': 1, 'quantity': 1})
+        invoice.save()
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.remove_product(0)
+        invoice.save()
+
+        lines = list(InvoiceLine.objects.filter(invoice=invoice))
+        self.assertEqual([(line.name, line.position) for line in lines], [('B', 0), ('C', 1)])
+
+    def test_clear_products_replaces_lines(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'A', 'price': 1, 'quantity': 1})
+        invoice.save()
+
+        invoice.clear_products()
+        invoice.add_product({'name': 'B', 'price': 2, 'quantity': 1})
+        invoice.save()
+
+        self.assertEqual(list(invoice.lines.values_list('name', flat=True)), ['B'])
+
+
+@skipUnless(pdf_resources, "WeasyPrint cannot load its system libraries")
+class InvoiceFormTests(TestCase):
+    def post_data(self, products, **kwargs):
+        data = {
+            'title': 'Instalación de red',
+            'date': '2025-08-15',
+            'clt_name': 'Cliente',
+            'clt_email': 'cliente@example.com',
+            'clt_phone': '6640000000',
+            'sell_name': 'Vendedor',
+            'sell_email': 'vendedor@example.com',
+            'sell_phone': '6641111111',
+            'currency': 'MXN',
+            'payment_method': 'cash',
+            'tax_rate': '16',
+            'exchange_rate': '18',
+            'warranty_months': '0',
+            'products_json': json.dumps(products),
+        }
+        data.update(kwargs)
+        return data
+
+    def test_amounts_that_would_break_the_totals_are_form_errors(self):
+        cases = [
+            {'name': 'Cable', 'price': 10, 'quantity': 1, 'discount_amount': 20},
+            {'name': 'Cable', 'price': -10, 'quantity': 1},
+            {'name': 'Cable', 'price': 10, 'quantity': 1, 'discount_percent': 150},
+        ]
+        for product in cases:
+            with self.subTest(product=product):
+                response = self.client.post(reverse('inv_crt'), self.post_data([product]))
+
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('products_json', response.context['form'].errors)
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_edit_keeps_the_submitted_form_on_errors(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+
+        product = {'name': 'Cable', 'price': 10, 'quantity': 1, 'discount_amount': 20}
+        response = self.client.post(reverse('inv_edit', args=[invoice.pk]), self.post_data([product]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('products_json', response.context['form'].errors)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total, Decimal('11.60'))
+
+    def test_edit_with_a_stale_version_is_rejected(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+        loaded = invoice.version
+        apply_line_ops(invoice, [{'op': 'update', 'id': invoice.get_lines()[0].pk, 'quantity': 2}])
+
+        product = {'name': 'Cable', 'price': 10, 'quantity': 5}
+        response = self.client.post(
+            reverse('inv_edit', args=[invoice.pk]), self.post_data([product], version=loaded),
+        )
+
+        self.assertRedirects(response, reverse('inv_edit', args=[invoice.pk]), fetch_redirect_response=False)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.lines.get().quantity, 2)
+
+        response = self.client.post(
+            reverse('inv_edit', args=[invoice.pk]), self.post_data([product], version=invoice.version),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(invoice.lines.get().quantity, 5)
+
+    def test_line_api_answers_invalid_amounts_with_400(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+
+        response = self.client.patch(
+            reverse('inv_edit_lines', args=[invoice.pk]),
+            json.dumps({'ops': [{'op': 'update', 'id': invoice.get_lines()[0].pk, 'discount_percent': 150}]}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+    def test_legacy_actions_answer_with_the_delta(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+
+        response = self.client.post(
+            reverse('inv_edit', args=[invoice.pk]),
+            json.dumps({'action': 'add_product', 'name': 'Switch', 'price': 5, 'quantity': 1}),
+            content_type='application/json',
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertNotIn('products', data)
+        self.assertEqual([line['name'] for line in data['lines']], ['Switch'])
+        self.assertEqual(data['totals']['total'], 17.4)
+        self.assertEqual(data['version'], invoice.version + 1)
+
+    def test_discount_up_to_the_subtotal_is_valid(self):
+        product = {'name': 'Cable', 'price': 10, 'quantity': 2, 'discount_amount': 20}
+        response = self.client.post(reverse('inv_crt'), self.post_data([product]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Invoice.objects.get().total, Decimal('0.00'))
+
+
+class LineViewTests(TestCase):
+    def test_line_views_print_stored_decimal_amounts(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Switch', 'price': '1234.5', 'quantity': 3, 'discount_percent': '12.5'})
+        invoice.add_product({'name': 'Cable', 'price': '0.1', 'quantity': 3, 'discount_amount': '0.05'})
+        invoice.add_product({'name': 'Conector', 'price': '2', 'quantity': 1})
+        invoice.calculate_totals()
+
+        views = line_views(invoice.get_lines())
+        self.assertEqual(
+            [(view.price, view.discount, view.total) for view in views],
+            [('1,234.50', '12.50%', '3,240.56'), ('0.10', '0.05', '0.25'), ('2.00', '-', '2.00')],
+        )
+
+
+class LineEditTests(TestCase):
+    def setUp(self):
+        self.invoice = make_invoice()
+        for name in ['A', 'B', 'C']:
+            self.invoice.add_product({'name': name, 'price': '10.05', 'quantity': 3, 'discount_percent': 15})
+        self.invoice.save()
+        self.ids = [line.pk for line in self.invoice.get_lines()]
+
+    def assertTotalsMatchRecalculation(self):
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        stored = (invoice.subtotal, invoice.total_discount, invoice.total_tax, invoice.total)
+        invoice.calculate_totals()
+        self.assertEqual(stored, (invoice.subtotal, invoice.total_discount, invoice.total_tax, invoice.total))
+
+    def test_batch_applies_deltas_and_returns_changed_lines_only(self):
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        result = apply_line_ops(invoice, [
+            {'op': 'add', 'name': 'D', 'price': '7.33', 'quantity': 7, 'ref': 'new-1'},
+            {'op': 'update', 'id': self.ids[1], 'quantity': 5, 'discount_percent': 0},
+            {'op': 'remove', 'id': self.ids[0]},
+            {'op': 'move', 'id': self.ids[2], 'before': self.ids[1]},
+        ], version=invoice.version)
+
+        self.assertEqual(result['version'], self.invoice.version + 1)
+        self.assertEqual(result['removed'], [self.ids[0]])
+        self.assertEqual(sorted(line['name'] for line in result['lines']), ['B', 'C', 'D'])
+        self.assertEqual([line['ref'] for line in result['lines'] if line['name'] == 'D'], ['new-1'])
+        self.assertEqual(list(invoice.lines.values_list('name', flat=True)), ['C', 'B', 'D'])
+        self.assertTotalsMatchRecalculation()
+
+    def test_stale_version_is_rejected_without_writing(self):
+        stale = Invoice.objects.get(pk=self.invoice.pk)
+        apply_line_ops(Invoice.objects.get(pk=self.invoice.pk), [{'op': 'remove', 'id': self.ids[0]}])
+
+        with self.assertRaises(VersionConflict):
+            apply_line_ops(stale, [{'op': 'remove', 'id': self.ids[1]}])
+        self.assertEqual(self.invoice.lines.count(), 2)
+        self.assertTotalsMatchRecalculation()
+
+    def test_amounts_that_would_break_the_totals_are_rejected(self):
+        version = Invoice.objects.get(pk=self.invoice.pk).version
+        operations = [
+            {'op': 'update', 'id': self.ids[0], 'discount_percent': 150},
+            {'op': 'update', 'id': self.ids[0], 'discount_percent': 0, 'discount_amount': '30.16'},
+            {'op': 'add', 'name': 'D', 'price': '-1', 'quantity': 1},
+        ]
+        for operation in operations:
+            with self.subTest(operation=operation):
+                with self.assertRaises(LineEditError):
+                    apply_line_ops(Invoice.objects.get(pk=self.invoice.pk), [operation])
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).version, version)
+        self.assertTotalsMatchRecalculation()
+
+    def test_edit_cost_does_not_grow_with_the_invoice(self):
+        for number in range(300):
+            self.invoice.add_product({'name': f'Extra {number}', 'price': 1, 'quantity': 1})
+        self.invoice.save()
+
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        # Savepoint pair, fetch the line, update it, update the invoice, then
+        # find and update the rollup rows (one per period and dimension) together
+        with self.assertNumQueries(7):
+            apply_line_ops(invoice, [{'op': 'update', 'id': self.ids[0], 'price': '12.50'}])
+        self.assertTotalsMatchRecalculation()
+
+
+PRICING_JS = """
+const pricing = require(process.argv[1]);
+const input = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const results = input.cases.map(c => pricing.calculate(input.spec, c.lines, c.invoice));
+process.stdout.write(JSON.stringify(results));
+"""
+
+
+@skipUnless(shutil.which('node'), "node is needed to run static/js/pricing.js")
+class PricingParityTests(TestCase):
+    """The browser engine must price invoices exactly like calculate_totals"""
+
+    def cases(self):
+        rng = random.Random(15)
+        cases = [
+            # Half-cent ties, fixed discounts, untaxed lines, foreign currency
+            {'invoice': {'tax_rate': '16', 'currency': 'MXN', 'exchange_rate': '18'}, 'lines': [
+                {'price': '0.05', 'quantity': 1, 'discount_percent': '50'},
+                {'price': '10.05', 'quantity': 3, 'discount_percent': '15'},
+                {'price': '99.99', 'quantity': 2, 'discount_amount': '0.01', 'taxable': False},
+            ]},
+            {'invoice': {'tax_rate': '8.25', 'currency': 'USD', 'exchange_rate': '17.35'}, 'lines': [
+                {'price': '1234.56', 'quantity': 7, 'discount_percent': '12.5'},
+            ]},
+            {'invoice': {'tax_rate': '0', 'currency': 'MXN', 'exchange_rate': '18'}, 'lines': []},
+        ]
+        for _ in range(200):
+            cases.append({
+                'invoice': {
+                    'tax_rate': str(rng.choice([0, 8, 16, Decimal('10.5')])),
+                    'currency': rng.choice(['MXN', 'USD']),
+                    'exchange_rate': str(Decimal(rng.randint(1500, 2100)) / 100),
+                },
+                'lines': [{
+                    'price': str(Decimal(rng.randint(1, 10 ** 7)) / 100),
+                    'quantity': rng.randint(1, 50),
+                    'discount_percent': str(rng.choice([0, 0, 5, Decimal('12.5'), Decimal('33.33')])),
+                    'discount_amount': str(Decimal(rng.randint(0, 500)) / 100),
+                    'taxable': rng.random() > 0.2,
+                } for _ in range(rng.randint(1, 8))],
+            })
+        return cases
+
+    def python_results(self, case):
+        invoice = make_invoice(**case['invoice'])
+        for line in case['lines']:
+            invoice.add_product(line)
+        priced = [invoice.calculate_line(line) for line in invoice.get_lines()]
+        totals = engine.price_totals(priced, Decimal(case['invoice']['exchange_rate']), invoice.currency)
+        invoice.calculate_totals()
+        self.assertEqual(invoice.total, totals['total'])
+        as_strings = lambda amounts: {name: str(value) for name, value in amounts.items()}
+        return {'lines': [as_strings(line) for line in priced], 'totals': as_strings(totals)}
+
+    def test_js_engine_matches_python(self):
+        cases = self.cases()
+        script = Path(settings.BASE_DIR) / 'static' / 'js' / 'pricing.js'
+        output = subprocess.run(
+            ['node', '-e', PRICING_JS, str(script)],
+            input=json.dumps({'spec': PRICING_SPEC, 'cases': cases}),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        for case, js_result in zip(cases, json.loads(output)):
+            self.assertEqual(js_result, self.python_results(case), case)
+
+
+class FastPricingTests(TestCase):
+    """The generated fast path must match the spec interpreter it replaced"""
+
+    def invoice(self, case):
+        invoice = make_invoice(**case['invoice'])
+        for line in case['lines']:
+            invoice.add_product(line)
+        return invoice
+
+    def interpreted(self, invoice):
+        tax_rate = as_decimal(invoice.tax_rate)
+        priced = [engine.price_line(*line_record(line), tax_rate) for line in invoice.get_lines()]
+        totals = engine.price_totals(priced, as_decimal(invoice.exchange_rate), invoice.currency)
+        return priced, totals
+
+    def test_calculate_totals_matches_the_interpreter(self):
+        cases = PricingParityTests().cases()
+        # Values _safe_decimal has to repair
+        cases.append({'invoice': {'tax_rate': None, 'currency': 'USD', 'exchange_rate': 'n/a'}, 'lines': [
+            {'price': 19.99, 'quantity': '2', 'discount_percent': None, 'discount_amount': 'x'},
+        ]})
+        for case in cases:
+            invoice = self.invoice(case)
+            priced, totals = self.interpreted(invoice)
+            invoice.calculate_totals()
+            self.assertEqual(
+                [[line.line_subtotal, line.line_discount, line.line_tax, line.line_total] for line in invoice.get_lines()],
+                [[amounts['subtotal'], amounts['discount'], amounts['tax'], amounts['total']] for amounts in priced],
+            )
+            self.assertEqual(
+                [invoice.subtotal, invoice.total_discount, invoice.total_tax, invoice.total],
+                [totals['subtotal'], totals['discount'], totals['tax'], totals['total']],
+            )
+
+    def test_batch_gives_the_same_totals_as_one_by_one(self):
+        cases = PricingParityTests().cases()[:60]
+        batch = calculate_totals_many([self.invoice(case) for case in cases])
+        for case, invoice in zip(cases, batch):
+            single = self.invoice(case)
+            single.calculate_totals()
+            self.assertEqual((invoice.total, invoice.total_tax), (single.total, single.total_tax))
+
+
+class SalesRollupTests(TestCase):
+    def rollups(self):
+        rows = SalesRollup.objects.filter(invoice_count__gt=0).values_list(
+            'period', 'period_start', 'dimension', 'key', 'currency', 'invoice_count', 'total', 'total_base',
+        )
+        return sorted(rows)
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        first = make_invoice(currency='USD', exchange_rate=17)
+        first.add_product({'name': 'Cámara', 'price': 100, 'quantity': 2})
+        first.save()
+        second = make_invoice(sell_name='Luis', date=date(2025, 9, 2))
+        second.add_product({'name': 'Cable', 'price': '9.99', 'quantity': 3})
+        second.save()
+
+        # Move the first invoice to another seller and month, edit lines, delete the second
+        first.sell_name = 'Carmen'
+        first.date = date(2025, 7, 31)
+        first.save()
+        apply_line_ops(first, [{'op': 'add', 'name': 'Router', 'price': '50', 'quantity': 1}])
+        second.delete()
+
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+        (row,) = sales_report('month', 'seller')
+        self.assertEqual((row.key, row.period_start, row.invoice_count), ('Carmen', date(2025, 7, 1), 1))
+        self.assertEqual(row.total_base, (row.total * 17).quantize(Decimal('0.01')))
+
+
+class InvoiceTotalsTests(TestCase):
+    def test_inconsistent_totals_are_rejected_by_the_database(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Invoice.objects.filter(pk=invoice.pk).update(total=Decimal('999.00'))
+
+    def test_repair_command_fixes_stale_totals(self):
+        invoice = make_invoice()
+        invoice.add_product({'name': 'Cable', 'price': 10, 'quantity': 1})
+        invoice.save()
+        Invoice.objects.filter(pk=invoice.pk).update(
+            subtotal=0, total_discount=0, total_tax=0, total=0
+        )
+
+        call_command('repair_invoice_totals', stdout=io.StringIO())
+
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total, Decimal('11.60'))
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        # Repeated dates exercise the id tie-breaker
+        for day in [1, 1, 2, 3, 3, 3, 4]:
+            make_invoice(date=date(2025, 8, day)).save()
+        self.expected = list(Invoice.objects.order_by('-date', '-id').values_list('pk', flat=True))
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            page = paginate_by_cursor(Invoice.objects.all(), 'date', descending=True, cursor=cursor, per_page=3)
+            seen.extend(invoice.pk for invoice in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_cursor_returns_the_prior_page(self):
+        first = paginate_by_cursor(Invoice.objects.all(), 'date', descending=True, per_page=3)
+        second = paginate_by_cursor(Invoice.objects.all(), 'date', descending=True, cursor=first.next_cursor, per_page=3)
+        back = paginate_by_cursor(Invoice.objects.all(), 'date', descending=True, cursor=second.previous_cursor, per_page=3)
+
+        self.assertFalse(first.has_previous())
+        self.assertEqual([i.pk for i in back], [i.pk for i in first])
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_approximate_count_stops_at_limit(self):
+        self.assertEqual(approximate_count(Invoice.objects.all(), limit=5), (5, False))
+        self.assertEqual(approximate_count(Invoice.objects.all(), limit=50), (7, True))
+
+
+class SearchIndexTests(TestCase):
+    def create(self, **kwargs):
+        products = kwargs.pop('products', [])
+        invoice = make_invoice(**kwargs)
+        for name in products:
+            invoice.add_product({'name': name, 'price': 1, 'quantity': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.save()
+        return invoice
+
+    def test_search_covers_fields_and_product_names(self):
+        router = self.create(title='Red oficina', products=['Router Cisco'])
+        camera = self.create(title='Cámaras', clt_name='Juan Pérez', products=['Cámara IP'])
+
+        self.assertEqual(list(search(Invoice.objects.all(), 'cisco')), [router])
+        self.assertEqual(list(search(Invoice.objects.all(), 'perez')), [camera])
+        self.assertEqual(list(search(Invoice.objects.all(), router.folio)), [router])
+
+    def test_column_filter_matches_only_that_column(self):
+        self.create(clt_name='Ana', sell_name='Luis')
+        luis = self.create(clt_name='Luis', sell_name='Ana')
+
+        self.assertEqual(list(filter_matches(Invoice.objects.all(), 'luis', 'clt_name')), [luis])
+
+    def test_list_column_filters_match_substrings(self):
+        cabrera = self.create(title='Enlace inalámbrico', clt_name='Cabrera Connect', sell_name='Rodrigo')
+        self.create(clt_name='Ana')
+
+        for params in ({'client': 'abrera'}, {'title': 'lámbri'}, {'seller': 'drig'}):
+            with self.subTest(params=params):
+                invoices, _, _, _ = filter_invoices(params)
+                self.assertEqual(list(invoices), [cabrera])
+
+    def test_id_filter_accepts_digit_like_text(self):
+        invoice = self.create()
+
+        invoices, _, _, _ = filter_invoices({'id': str(invoice.pk)})
+        self.assertEqual(list(invoices), [invoice])
+        # "²" is a digit to str.isdigit() but not a number to int()
+        invoices, _, _, _ = filter_invoices({'id': '²'})
+        self.assertEqual(list(invoices), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        invoice = self.create(title='Antena')
+        invoice.title = 'Switch'
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.save()
+        self.assertFalse(search(Invoice.objects.all(), 'antena').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.delete()
+        self.assertFalse(search(Invoice.objects.all(), 'switch').exists())
+
+
+class PageLayoutTests(TestCase):
+    def rows(self, count, name='Cable UTP'):
+        return [LineView(name, 1, '1.00', '-', '1.00') for _ in range(count)]
+
+    def test_one_line_rows_paginate_as_before(self):
+        pages = paginate(self.rows(40), get_profile())
+        self.assertEqual([len(page) for page in pages], [11, 19, 10])
+        self.assertEqual(paginate([], get_profile()), [[]])
+
+    def test_long_names_and_comments_take_more_room(self):
+        profile = get_profile()
+        name = 'Cámara IP domo 4MP con visión nocturna, micrófono integrado y soporte de pared ' * 2
+        self.assertGreater(text_lines(name, profile.name_column_width, profile.font_size), 2)
+        self.assertEqual(text_lines('x' * 500, 10, profile.font_size), 85)  # 500 x 0.5em in ~2.95em
+
+        pages = paginate(self.rows(20, name), profile)
+        for number, page in enumerate(pages):
+            space = profile.page_height - profile.page_overhead - (profile.first_page_overhead if number == 0 else 0)
+            self.assertLessEqual(sum(row_height(row.name, profile) for row in page), space)
+        self.assertLess(len(pages[0]), 11)
+        self.assertLess(len(paginate(self.rows(11), profile, comments='Instalar antes del viernes ' * 10)[0]), 11)
+
+    @override_settings(INVOICE_PAGE_PROFILES={TEMPLATE_NAME: {'page_height': 400}})
+    def test_profiles_can_be_overridden_per_template(self):
+        self.assertEqual(len(paginate(self.rows(40), get_profile())[0]), 26)
+
+
+class PDFCacheBackendTests(TestCase):
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryPDFBackend(max_size=10)
+        backend.set('1/a', b'aaaa')
+        backend.set('2/b', b'bbbb')
+        backend.get('1/a')
+        backend.set('3/c', b'cccc')
+
+        self.assertEqual(backend.get('1/a'), b'aaaa')
+        self.assertIsNone(backend.get('2/b'))
+        self.assertEqual(backend.get('3/c'), b'cccc')
+
+    def test_filesystem_backend_round_trip_and_prefix_delete(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = FileSystemPDFBackend(location, max_size=1024)
+            backend.set('1/a', b'%PDF-1')
+            backend.set('2/b', b'%PDF-2')
+            backend.delete_prefix('1/')
+
+            self.assertIsNone(backend.get('1/a'))
+            self.assertEqual(backend.get('2/b'), b'%PDF-2')
+
+    def test_filesystem_backend_only_rescans_when_over_its_size(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = FileSystemPDFBackend(location, max_size=20)
+            with patch.object(backend, '_evict', wraps=backend._evict) as evict:
+                for name in 'abc':
+                    backend.set(f'1/{name}', b'%PDF-' + name.encode())
+                # The first write learns the size; the next ones add to it
+                self.assertEqual(evict.call_count, 1)
+
+                backend.get('1/a')
+                backend.set('2/d', b'%PDF-d')
+                self.assertEqual(evict.call_count, 2)
+
+            self.assertIsNone(backend.get('1/b'))
+            self.assertEqual(backend.get('1/a'), b'%PDF-a')
+            self.assertEqual(backend.get('2/d'), b'%PDF-d')
+
+
+@override_settings(INVOICE_PDF_CACHE={'BACKEND': 'invoices.pdf_cache.MemoryPDFBackend'})
+class PDFCacheTests(TestCase):
+    def test_key_changes_when_invoice_changes(self):
+        invoice = make_invoice()
+        invoice.save()
+        cache = get_pdf_cache()
+        key = cache.make_key(invoice)
+
+        invoice.title = 'Otro título'
+        invoice.save()
+
+        self.assertNotEqual(cache.make_key(invoice), key)
+
+    def test_save_and_delete_invalidate_cached_pdfs(self):
+        invoice = make_invoice()
+        invoice.save()
+        cache = get_pdf_cache()
+        key = cache.make_key(invoice)
+        cache.set(key, b'%PDF')
+
+        invoice.save()
+        self.assertIsNone(cache.get(key))
+
+        cache.set(key, b'%PDF')
+        invoice.delete()
+        self.assertIsNone(cache.get(key))
+
+    def test_key_depends_on_the_template_and_its_profile(self):
+        invoice = make_invoice()
+        invoice.save()
+        cache = get_pdf_cache()
+        key = cache.make_key(invoice)
+
+        self.assertEqual(cache.make_key(invoice, template_name=TEMPLATE_NAME), key)
+        self.assertNotEqual(cache.make_key(invoice, template_name='invoices/inv_compact.html'), key)
+        with self.settings(INVOICE_PAGE_PROFILES={'invoices/inv_compact.html': {'name_column_width': 90}}):
+            self.assertEqual(cache.make_key(invoice), key)
+            compact = cache.make_key(invoice, template_name='invoices/inv_compact.html')
+        self.assertNotEqual(cache.make_key(invoice, template_name='invoices/inv_compact.html'), compact)
+
+    @override_settings(DEBUG=True)
+    def test_asset_version_is_not_recomputed_on_every_request_under_debug(self):
+        version = asset_version()
+        with patch('invoices.pdf_cache.get_template', side_effect=AssertionError("recomputed")):
+            self.assertEqual(asset_version(), version)
+
+
+# The stylesheets without the CDN ones, so the tests never go to the network
+LOCAL_STYLESHEETS = ('css/invoice-document.css',)
+
+
+@skipUnless(pdf_resources, "WeasyPrint cannot load its system libraries")
+@patch('invoices.pdf_resources.STYLESHEETS', LOCAL_STYLESHEETS)
+class PDFResourcesTests(TestCase):
+    def test_static_urls_are_read_from_disk(self):
+        result = pdf_resources.url_fetcher('http://testserver/static/img/cc.png')
+        with result['file_obj'] as f:
+            self.assertEqual(f.read(), (Path(settings.BASE_DIR) / 'static' / 'img' / 'cc.png').read_bytes())
+        self.assertEqual(result['mime_type'], 'image/png')
+        self.assertIsNone(pdf_resources.static_path('http://testserver/static/../config/settings.py'))
+
+    def test_resources_are_parsed_once_per_thread(self):
+        resources = pdf_resources.get_resources()
+        self.assertIs(pdf_resources.get_resources(), resources)
+        self.assertTrue(resources.stylesheets)
+
+    @override_settings(DEBUG=False)
+    def test_static_stylesheets_are_only_checked_under_debug(self):
+        resources = pdf_resources.Resources()
+        with patch('invoices.pdf_resources.find_static') as find_static:
+            self.assertFalse(resources.is_stale())
+        find_static.assert_not_called()
+
+        with override_settings(DEBUG=True):
+            resources = pdf_resources.Resources()
+            resources.versions = [0]  # as if the file changed on disk
+            self.assertFalse(resources.is_stale())  # within the TTL
+            resources.checked -= pdf_resources.DEBUG_STATIC_CHECK_TTL
+            self.assertTrue(resources.is_stale())
+
+    def test_only_the_preview_links_the_stylesheets(self):
+        invoice = make_invoice()
+        invoice.pk = 1
+        renderer = InvoiceRenderer(invoice)
+
+        preview = render_to_string(TEMPLATE_NAME, renderer.get_context(preview=True))
+        pdf = render_to_string(TEMPLATE_NAME, renderer.get_context(preview=False))
+        self.assertIn('href="/static/css/invoice-document.css"', preview)
+        self.assertNotIn('<link', pdf)
+
+
+@skipUnless(pdf_resources, "WeasyPrint cannot load its system libraries")
+@patch('invoices.pdf_resources.STYLESHEETS', LOCAL_STYLESHEETS)
+class StatementTests(TestCase):
+    def setUp(self):
+        for day, products in ((3, 1), (1, 25), (20, 2)):
+            invoice = make_invoice(date=date(2025, 8, day))
+            for n in range(products):
+                invoice.add_product({'name': f'Producto {n}', 'price': '10', 'quantity': 1})
+            invoice.save()
+        make_invoice(date=date(2025, 9, 1)).save()
+
+    def test_statement_lays_out_chunks_and_reports_progress(self):
+        progress = []
+        renderer = StatementRenderer(filter_month(Invoice.objects.order_by('date'), '2025-08'), chunk_size=2)
+        pdf_bytes = renderer.write_pdf('http://testserver/', progress=lambda done, total: progress.append((done, total)))
+
+        self.assertTrue(pdf_bytes.startswith(b'%PDF'))
+        self.assertEqual(progress, [(2, 3), (3, 3)])
+        self.assertEqual([invoice.date.day for invoice in renderer.invoices], [1, 3, 20])
+
+    def test_view_rejects_an_invalid_month(self):
+        response = self.client.get(reverse('inv_statement'), {'month': '2025-13'})
+        self.assertRedirects(response, reverse('inv_list'), fetch_redirect_response=False)
+
+        response = self.client.get(reverse('inv_statement'), {'month': '2025-09'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+@override_settings(INVOICE_PDF_CACHE={'BACKEND': 'invoices.pdf_cache.MemoryPDFBackend'})
+class PDFRenderJobTests(TestCase):
+    def test_cached_pdf_completes_job_without_rendering(self):
+        invoice = make_invoice()
+        invoice.save()
+        cache = get_pdf_cache()
+        cache.set(cache.make_key(invoice), b'%PDF')
+
+        job = enqueue_render(invoice, 'http://testserver/')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertIsNotNone(job.finished_at)
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError("SMTP server unavailable")
+
+
+@override_settings(EMAIL_OUTBOX_AUTO_DISPATCH=False, EMAIL_OUTBOX_RETRY_DELAY=30)
+class OutboxTests(TestCase):
+    def test_dispatch_sends_batch_over_one_connection(self):
+        for i in range(3):
+            enqueue_email(f"Asunto {i}", "Cuerpo", "noreply@example.com", ["a@example.com"])
+
+        sent, failed = dispatch_outbox()
+
+        self.assertEqual((sent, failed), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutboundEmail.objects.exclude(status='sent').exists())
+
+    @override_settings(EMAIL_BACKEND='invoices.tests.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_delivery_is_retried_with_backoff(self):
+        email = enqueue_email("Asunto", "Cuerpo", "noreply@example.com", ["a@example.com"])
+
+        self.assertEqual(dispatch_outbox(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt_at, email.created_at)
+
+        # Not due yet, so nothing is picked up
+        self.assertEqual(dispatch_outbox(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=email.created_at)
+        dispatch_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+
+    def test_dispatchers_only_send_the_messages_they_claimed(self):
+        theirs = enqueue_email("Otro worker", "Cuerpo", "noreply@example.com", ["a@example.com"])
+        ours = enqueue_email("Asunto", "Cuerpo", "noreply@example.com", ["a@example.com"])
+        # Another dispatcher claimed this one between our select and our update
+        OutboundEmail.objects.filter(pk=theirs.pk).update(
+            status='sending', claim_token=uuid.uuid4(), claimed_at=timezone.now(),
+        )
+
+        self.assertEqual(dispatch_outbox(), (1, 0))
+        self.assertEqual([m.subject for m in mail.outbox], ["Asunto"])
+        self.assertEqual(OutboundEmail.objects.get(pk=theirs.pk).status, 'sending')
+        self.assertEqual(OutboundEmail.objects.get(pk=ours.pk).status, 'sent')
+
+    @override_settings(EMAIL_OUTBOX_SENDING_TIMEOUT=60)
+    def test_stale_claims_are_released(self):
+        email = enqueue_email("Asunto", "Cuerpo", "noreply@example.com", ["a@example.com"])
+        OutboundEmail.objects.update(
+            status='sending', claim_token=uuid.uuid4(), claimed_at=timezone.now() - timedelta(minutes=5),
+        )
+
+        self.assertEqual(dispatch_outbox(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 2))
+
+    def test_message_fails_when_its_invoice_was_deleted(self):
+        invoice = make_invoice()
+        invoice.save()
+        email = enqueue_email("Factura", "Cuerpo", "noreply@example.com", ["a@example.com"], invoice=invoice)
+        invoice.delete()
+
+        self.assertEqual(dispatch_outbox(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+        self.assertEqual(mail.outbox, [])
+
+
+class StreamZipTests(TestCase):
+    def test_streamed_chunks_form_a_valid_archive(self):
+        files = [(f"invoice_COT-{i:04d}.pdf", b"%PDF-" + bytes([i]) * 100) for i in range(5)]
+
+        chunks = list(stream_zip(iter(files)))
+
+        self.assertGreater(len(chunks), len(files))
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), [name for name, _ in files])
+            self.assertEqual(archive.read(files[3][0]), files[3][1])
+
+    @override_settings(INVOICE_PDF_CACHE={'BACKEND': 'invoices.pdf_cache.MemoryPDFBackend'})
+    def test_render_many_serves_cached_pdfs_in_order(self):
+        invoices = [make_invoice(title=f"Nota {i}") for i in range(3)]
+        cache = get_pdf_cache()
+        for invoice in invoices:
+            invoice.save()
+            cache.set(cache.make_key(invoice), invoice.folio.encode())
+
+        results = list(render_many(invoices, 'http://testserver/', window=2))
+
+        self.assertEqual([pdf for _, pdf in results], [i.folio.encode() for i in invoices])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            invoice = make_invoice(title=f"Nota {i}", date=date(2025, 8, 10 + i))
+            invoice.add_product({'name': f'Cable "{i}"', 'price': '10.50', 'quantity': 2})
+            invoice.add_product({'name': 'Router, 5G', 'price': 100, 'quantity': 1})
+            invoice.save()
+        self.invoices = Invoice.objects.order_by('-date', '-id')
+
+    def test_line_rows_follow_the_invoice_order_with_one_query_per_chunk(self):
+        with self.assertNumQueries(1 + 2):
+            rows = list(export_rows(self.invoices, 'lines', chunk_size=2))
+
+        header, *rows = rows
+        self.assertEqual(header[:2], ['invoice_folio', 'invoice_date'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([row[1] for row in rows[::2]], [date(2025, 8, 12), date(2025, 8, 11), date(2025, 8, 10)])
+        self.assertEqual(rows[0][header.index('name')], 'Cable "2"')
+
+    def test_csv_quotes_values(self):
+        text = ''.join(stream_csv(export_rows(self.invoices, 'lines'), rows_per_chunk=2))
+
+        self.assertTrue(text.startswith('\ufeffinvoice_folio,'))
+        self.assertIn('"Cable ""0""",10.50,2', text)
+        self.assertIn('"Router, 5G"', text)
+
+    def test_xlsx_splits_long_exports_across_sheets(self):
+        data = b''.join(stream_xlsx(export_rows(self.invoices, 'lines'), sheet_rows=4, rows_per_chunk=2))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIn('<sheet name="Sheet2"', archive.read('xl/workbook.xml').decode())
+            first = archive.read('xl/worksheets/sheet1.xml').decode()
+            second = archive.read('xl/worksheets/sheet2.xml').decode()
+        self.assertEqual(first.count('<row>'), 4)
+        self.assertEqual(second.count('<row>'), 4)  # header + the remaining 3 lines
+        self.assertIn('<t xml:space="preserve">Cable "2"</t>', first)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_results_carry_query_counts_and_regressions_are_reported(self):
+        cases = suite.pricing_cases((1, 50), batch_sizes=(3,))
+        results = [suite.measure(case._replace(repeat=2)) for case in cases if case.name != 'calculate_totals (interpreted)']
+
+        self.assertEqual([(r['case'], r['size'], r['queries']) for r in results],
+                         [('calculate_totals', 1, 0), ('calculate_totals', 50, 0), ('calculate_totals_many', 3, 0)])
+        previous = [{**results[0], 'best_ms': results[0]['best_ms'] / 2}, {**results[1], 'best_ms': 1e6}]
+        self.assertEqual([r['size'] for r, _ in suite.compare(previous, results)], [1])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_middleware_reports_queries_templates_and_spans(self):
+        def view(request):
+            list(Invoice.objects.all())
+            with span('pdf'):
+                body = engines['django'].from_string('{{ folio }}').render({'folio': 'COT-0001'})
+            return HttpResponse(body)
+
+        with self.assertLogs('invoices.instrumentation', 'INFO') as logs:
+            response = InstrumentationMiddleware(view)(RequestFactory().get('/invoices/list/'))
+
+        timings = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings, ['db', 'template', 'pdf', 'total'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['db_queries'], sorted(record['spans'])), ('/invoices/list/', 1, ['pdf', 'template']))
+
+        metrics = registry.render()
+        self.assertIn('invoices_request_seconds_count{view="unresolved"} 1', metrics)
+        self.assertIn('invoices_span_seconds_bucket{span="pdf",le="+Inf"} 1', metrics)
+
+    @skipUnless(pdf_resources, "WeasyPrint cannot load its system libraries")
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_a_token_are_for_staff_only(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        user = User.objects.create_user('ops', password='secret')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @skipUnless(pdf_resources, "WeasyPrint cannot load its system libraries")
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_with_a_token_require_it(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer s3cret'}).status_code, 200)
+
+
+class StaticPipelineTests(TestCase):
+    def setUp(self):
+        self.source = Path(tempfile.mkdtemp())
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        (self.source / 'css').mkdir()
+        (self.source / 'css' / 'site.css').write_text('.invoice { color: #333; }\n' * 200)
+        shutil.copytree(Path(settings.BASE_DIR) / 'static' / 'img', self.source / 'img')
+
+        overrides = override_settings(
+            STATICFILES_DIRS=[self.source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATIC_ROOT=self.root,
+            STORAGES={**settings.STORAGES, 'staticfiles': {'BACKEND': 'invoices.assets.CompressedManifestStaticFilesStorage'}},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_collectstatic_hashes_compresses_and_optimizes(self):
+        manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+        hashed = self.root / manifest['css/site.css']
+        self.assertNotEqual(manifest['css/site.css'], 'css/site.css')
+        self.assertEqual(gzip.decompress(Path(f'{hashed}.gz').read_bytes()), hashed.read_bytes())
+        self.assertTrue(Path(f'{hashed}.br').exists())
+
+        logo = self.root / manifest['img/cc.png']
+        self.assertLess(logo.stat().st_size, (self.source / 'img' / 'cc.png').stat().st_size)
+        self.assertFalse(Path(f'{logo}.gz').exists())
+
+    def test_middleware_serves_hashed_files_as_immutable(self):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+        name = json.loads((self.root / 'staticfiles.json').read_text())['paths']['css/site.css']
+
+        response = middleware(RequestFactory().get(f'/static/{name}', HTTP_ACCEPT_ENCODING='gzip, br;q=0'))
+        self.assertEqual((response['Content-Encoding'], response['Content-Type']), ('gzip', 'text/css'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        again = middleware(RequestFactory().get(f'/static/{name}', HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(again.status_code, 304)
+        plain = middleware(RequestFactory().get('/static/css/site.css'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain['Cache-Control'], f'public, max-age={settings.STATIC_MAX_AGE}')
+        self.assertEqual(middleware(RequestFactory().get('/static/css/missing.css')).status_code, 404)
+
+
+class ImportTests(TestCase):
+    HEADER = "ref,title,date,clt_name,clt_email,clt_phone,sell_name,sell_email,sell_phone,currency,product_name,product_price,product_quantity\n"
+
+    def row(self, ref, date='2025-08-15', email='c@example.com', name='Cámara', price='100.00', quantity='2'):
+        return f"{ref},Cotización {ref},{date},Cliente {ref},{email},664,Vendedor,v@example.com,664,MXN,{name},{price},{quantity}\n"
+
+    def test_csv_rows_are_grouped_validated_and_bulk_created(self):
+        text = (
+            self.HEADER
+            + self.row('A') + self.row('A', name='Cable', price='9.99', quantity='3')
+            + self.row('B', date='15/08/2025')
+            + self.row('C', email='no-es-correo')
+            + self.row('D', name='Router', price='50')
+        )
+
+        result = import_invoices(read_csv(io.StringIO(text)), chunk_size=1)
+
+        self.assertEqual(result.created, 2)
+        self.assertEqual([(error.row, error.ref) for error in result.errors], [(4, 'B'), (5, 'C')])
+        self.assertIn('date', result.errors[0].message)
+
+        first = Invoice.objects.prefetch_related('lines').get(title='Cotización A')
+        self.assertEqual([line.name for line in first.get_lines()], ['Cámara', 'Cable'])
+        self.assertEqual(first.total, Decimal('266.77'))
+        self.assertEqual(first.version, 1)
+        self.assertEqual(list(search(Invoice.objects.all(), 'Router').values_list('title', flat=True)), ['Cotización D'])
+
+        (rollup,) = sales_report('day')
+        self.assertEqual((rollup.invoice_count, rollup.total), (2, first.total + Decimal('116.00')))
+
+    def test_jsonl_reports_bad_lines_and_dry_run_writes_nothing(self):
+        record = {
+            'title': 'Nota', 'date': '2025-08-15', 'clt_name': 'Cliente', 'clt_email': 'c@example.com',
+            'clt_phone': '664', 'sell_name': 'Vendedor', 'sell_email': 'v@example.com', 'sell_phone': '664',
+            'products': [{'name': 'Cable', 'price': '10', 'quantity': 1}],
+        }
+        lines = [json.dumps(record), '{"title": ', json.dumps({**record, 'products': ['Cable']}), '']
+
+        result = import_invoices(read_jsonl(lines), dry_run=True)
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual([error.row for error in result.errors], [2, 3])
+        self.assertFalse(Invoice.objects.exists())
+
+
+class FolioAllocationTests(TestCase):
+    def test_invoices_get_unique_folios_past_9999(self):
+        _allocator.reset()
+        FolioSequence.objects.update_or_create(series='COT', defaults={'prefix': 'COT', 'next_value': 9999})
+
+        first = make_invoice()
+        first.save()
+        second = make_invoice()
+        second.save()
+
+        self.assertEqual(first.folio, 'COT-9999')
+        self.assertEqual(second.folio, 'COT-10000')
+
+    def test_reserved_ranges_do_not_overlap(self):
+        first = reserve_folio_strings('REM', 3)
+        second = reserve_folio_strings('REM', 3)
+
+        self.assertEqual(first, ['REM-0001', 'REM-0002', 'REM-0003'])
+        self.assertEqual(second, ['REM-0004', 'REM-0005', 'REM-0006'])
+
+
+class FolioBlockTests(TransactionTestCase):
+    """Blocks are only cached outside transactions, which TestCase always opens"""
+
+    @override_settings(INVOICE_FOLIO_BLOCK_SIZE=5)
+    def test_allocator_reserves_blocks(self):
+        allocator = FolioAllocator()
+        folios = [allocator.allocate('TST') for _ in range(7)]
+
+        self.assertEqual(folios[0], 'TST-0001')
+        self.assertEqual(folios[6], 'TST-0007')
+        self.assertEqual(FolioSequence.objects.get(series='TST').next_value, 11)
+
+    @override_settings(INVOICE_FOLIO_BLOCK_SIZE=5)
+    def test_rolled_back_reservation_is_not_reused(self):
+        allocator = FolioAllocator()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertEqual(allocator.allocate('TST'), 'TST-0001')
+                raise RuntimeError
+
+        # Another process gets the numbers the rollback gave back
+        self.assertEqual(reserve_folio_strings('TST', 3), ['TST-0001', 'TST-0002', 'TST-0003'])
+        self.assertEqual(allocator.allocate('TST'), 'TST-0004')
@@ -3,10 +3,19 @@ from . import views
 
 urlpatterns = [
     path('list/', views.inv_list, name="inv_list"),
+    path('export/', views.inv_export, name="inv_export"),
+    path('export/pdf/', views.inv_export_pdf, name="inv_export_pdf"),
+    path('export/statement/', views.inv_statement, name="inv_statement"),
+    path('import/', views.inv_import, name="inv_import"),
     path('create/', views.inv_crt, name="inv_crt"),
     path('edit/<int:pk>/', views.inv_edit, name="inv_edit"),
+    path('edit/<int:pk>/lines/', views.inv_edit_lines, name="inv_edit_lines"),
     path('delete/<int:pk>/', views.inv_delete, name="inv_delete"),
     path('template/', views.invoice_template, name="inv_template"),
     path('pdf/<int:pk>/', views.invoice_pdf, name="inv_pdf"),
+    path('pdf/jobs/<uuid:job_id>/', views.invoice_pdf_job, name="inv_pdf_job"),
+    path('pdf/jobs/<uuid:job_id>/download/', views.invoice_pdf_job_download, name="inv_pdf_job_download"),
+    path('reports/', views.inv_reports, name="inv_reports"),
+    path('reports/sales.json', views.inv_reports_json, name="inv_reports_json"),
     path('send-email/<int:pk>/', views.invoice_email, name="inv_email"),
 ]
\ No newline at end of file
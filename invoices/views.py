@@ -1,94 +1,101 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
-from .models import Invoice
+from .models import Invoice, PDFRenderJob, SalesRollup
 from .forms import InvoiceForm  # You'll need to update your form as well
 from django.urls import reverse 
+import csv
+import io
 import json
+from datetime import date
 from decimal import Decimal
-from django.template.loader import render_to_string
-from django.http import HttpResponse
-from weasyprint import HTML, CSS
-import tempfile
-from django.core.mail import EmailMessage
-import io
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
 from django.contrib import messages
+from django.utils import timezone
 from django.core.paginator import Paginator
-from django.db.models import Q
+from .rendering import InvoiceRenderer, StatementRenderer
+from .jobs import enqueue_render, render_many
+from .outbox import enqueue_email
+from .pdf_cache import get_pdf_cache
+from .streaming import stream_zip
+from .exports import MODES, XLSX_CONTENT_TYPE, export_rows, stream_csv, stream_xlsx
+from .imports import READERS, import_invoices
+from .pagination import InvalidCursor, approximate_count, paginate_by_cursor
+from .filters import SORT_FIELDS, filter_invoices, filter_month
+from .pricing import PRICING_SPEC
+from .reporting import sales_report, summarize
+from .line_edits import LineEditError, VersionConflict, apply_line_ops
 
-class InvoiceRenderer:
-    """Helper class to handle invoice rendering logic"""
-    
-    def __init__(self, invoice):
-        self.invoice = invoice
-
-    def get_pages_data(self):
-        """Calculate pagination for invoice products"""
-        products = self.invoice.products or []
-        pages = []
-
-        # First page with 11 products
-        first_page_count = 11
-        pages.append(products[:first_page_count])
-
-        # Rest of the pages with 19 products
-        remaining = products[first_page_count:]
-        subsequent_page_count = 19
-        for i in range(0, len(remaining), subsequent_page_count):
-            pages.append(remaining[i:i + subsequent_page_count])
-
-        return {
-            'pages': pages,
-            'total_pages': len(pages) or 1
-        }
-
-    def get_context(self, preview=True):
-        """Get template context for invoice rendering"""
-        pages_data = self.get_pages_data()
-        return {
-            'invoice': self.invoice,
-            'preview': preview,
-            'pages': pages_data['pages'],
-            'total_pages': pages_data['total_pages'],
-        }
-
-    def render_pdf(self, request, preview=False):
-        """Generate PDF from invoice template and return as bytes"""
-        html_string = render_to_string(
-            "invoices/inv_template.html",
-            self.get_context(preview=preview)
-        )
-        pdf_io = io.BytesIO()
-        HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(pdf_io)
-        return pdf_io.getvalue()
-    
 
 def invoice_template(request):
     invoice_id = request.GET.get('id')
     if not invoice_id:
         return redirect('inv_list')
 
-    invoice = get_object_or_404(Invoice, id=invoice_id)
+    invoice = get_object_or_404(Invoice.objects.prefetch_related('lines'), id=invoice_id)
     renderer = InvoiceRenderer(invoice)
     
     return render(request, 'invoices/inv_template.html', renderer.get_context(preview=True))
 
 
 def invoice_pdf(request, pk):
-    """Download PDF invoice"""
-    invoice = get_object_or_404(Invoice, pk=pk)
+    """
+    Download PDF invoice.
+    With ?mode=async the PDF is rendered by the worker pool instead and the
+    response is 202 with a job id to poll at inv_pdf_job.
+    """
+    invoice = get_object_or_404(Invoice.objects.prefetch_related('lines'), pk=pk)
+
+    if request.GET.get('mode') == 'async':
+        job = enqueue_render(invoice, request.build_absolute_uri())
+        return JsonResponse(_job_status(job), status=202)
+
     renderer = InvoiceRenderer(invoice)
     pdf_bytes = renderer.render_pdf(request, preview=False)
+    return _pdf_response(invoice, pdf_bytes)
 
+
+def _pdf_response(invoice, pdf_bytes):
     response = HttpResponse(pdf_bytes, content_type="application/pdf")
     response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.folio}.pdf"'
     return response
 
 
+def _job_status(job):
+    data = {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'status_url': reverse('inv_pdf_job', args=[job.pk]),
+    }
+    if job.status == 'done':
+        data['download_url'] = reverse('inv_pdf_job_download', args=[job.pk])
+    if job.status == 'failed':
+        data['error'] = job.error
+    return data
+
+
+def invoice_pdf_job(request, job_id):
+    """Status of a background PDF render"""
+    job = get_object_or_404(PDFRenderJob, pk=job_id)
+    return JsonResponse(_job_status(job))
+
+
+def invoice_pdf_job_download(request, job_id):
+    """Download the result of a background PDF render"""
+    job = get_object_or_404(PDFRenderJob.objects.select_related('invoice'), pk=job_id)
+    if job.status != 'done':
+        return JsonResponse(_job_status(job), status=202 if job.status != 'failed' else 500)
+
+    pdf_bytes = get_pdf_cache().get(job.cache_key)
+    if pdf_bytes is None:
+        # Evicted from the cache since the job finished; render it again inline
+        pdf_bytes = InvoiceRenderer(job.invoice).render_pdf(request, preview=job.preview)
+    return _pdf_response(job.invoice, pdf_bytes)
+
+
 def invoice_email(request, pk):
-    """Send PDF invoice to client and seller via email"""
+    """Queue the PDF invoice for delivery to client and seller"""
     invoice = get_object_or_404(Invoice, pk=pk)
-    renderer = InvoiceRenderer(invoice)
-    pdf_bytes = renderer.render_pdf(request, preview=False)
 
     subject = f"Factura {invoice.folio} - Cabrera Connect"
     body = (
@@ -108,19 +115,18 @@ def invoice_email(request, pk):
         messages.error(request, "No hay correos configurados para enviar esta factura.")
         return redirect("inv_template")  # redirige a preview
 
-    email = EmailMessage(
-        subject=subject,
-        body=body,
-        from_email="noreply@cabreraconnect.com",
-        to=recipients,
-    )
-    email.attach(f"invoice_{invoice.folio}.pdf", pdf_bytes, "application/pdf")
-
     try:
-        email.send()
+        # The PDF is attached (from the PDF cache) when the outbox delivers it
+        enqueue_email(
+            subject=subject,
+            body=body,
+            from_email="noreply@cabreraconnect.com",
+            to=recipients,
+            invoice=invoice,
+        )
         messages.success(
             request,
-            f"Factura enviada correctamente a: {', '.join(recipients)}"
+            f"Factura en cola para envío a: {', '.join(recipients)}"
         )
     except Exception as e:
         messages.error(request, f"Error al enviar el correo: {e}")
@@ -129,57 +135,11 @@ def invoice_email(request, pk):
     return redirect(f"/invoices/template?id={invoice.id}")
 
 def inv_list(request):
-    # --- Filtros ---
-    search_id = request.GET.get("id", "").strip()
-    search_title = request.GET.get("title", "").strip()
-    search_date = request.GET.get("date", "").strip()
-    search_client = request.GET.get("client", "").strip()
-    search_seller = request.GET.get("seller", "").strip()
-
-    # --- Ordenamiento ---
-    sort = request.GET.get("sort", "date")  # default: date
-    direction = request.GET.get("direction", "desc")
-
-    # Map de campos permitidos
-    sort_fields = {
-        "id": "id",
-        "title": "title",
-        "date": "date",
-        "amount": "total",
-        "client": "clt_name",
-        "seller": "sell_name",
-    }
+    invoices, search_params, sort, direction = filter_invoices(request.GET)
 
-    sort_field = sort_fields.get(sort, "date")
-    if direction == "desc":
-        sort_field = "-" + sort_field
-
-    invoices = Invoice.objects.all().order_by(sort_field)
-
-    # --- Filtros aplicados ---
-    if search_id:
-        invoices = invoices.filter(id__icontains=search_id)
-    if search_title:
-        invoices = invoices.filter(title__icontains=search_title)
-    if search_date:
-        invoices = invoices.filter(date=search_date)
-    if search_client:
-        invoices = invoices.filter(clt_name__icontains=search_client)
-    if search_seller:
-        invoices = invoices.filter(sell_name__icontains=search_seller)
-
-    # --- Fix invalid totals ---
-    for invoice in invoices:
-        if invoice.total is None or isinstance(invoice.total, str):
-            try:
-                invoice.calculate_totals()
-                invoice.save()
-            except:
-                invoice.subtotal = Decimal("0.00")
-                invoice.total_discount = Decimal("0.00")
-                invoice.total_tax = Decimal("0.00")
-                invoice.total = Decimal("0.00")
-                invoice.save()
+    # Only the current page is fetched; totals are guaranteed by the
+    # invoice_totals_consistent constraint (see repair_invoice_totals)
+    invoices = invoices.defer("comments")
 
     # --- Paginación ---
     per_page = request.GET.get("per_page", 15)
@@ -188,28 +148,155 @@ def inv_list(request):
     except ValueError:
         per_page = 15
 
-    paginator = Paginator(invoices, per_page)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-
     context = {
-        "invoices": page_obj,
-        "page_obj": page_obj,
         "per_page": per_page,
         "per_page_options": [15, 25, 50, 100],
-        "search_params": {
-            "id": search_id,
-            "title": search_title,
-            "date": search_date,
-            "client": search_client,
-            "seller": search_seller,
-        },
+        "search_params": search_params,
         "sort": sort,
         "direction": direction,
     }
+
+    # Opt-in keyset pagination: no COUNT(*) and no OFFSET, deep pages cost the same
+    if request.GET.get("pagination") == "cursor" and sort != "relevance":
+        try:
+            page_obj = paginate_by_cursor(
+                invoices,
+                SORT_FIELDS.get(sort, "date"),
+                descending=direction == "desc",
+                cursor=request.GET.get("cursor"),
+                per_page=per_page,
+            )
+        except InvalidCursor:
+            page_obj = paginate_by_cursor(
+                invoices, SORT_FIELDS.get(sort, "date"), descending=direction == "desc", per_page=per_page
+            )
+
+        params = request.GET.copy()
+        if page_obj.has_next():
+            params["cursor"] = page_obj.next_cursor
+            context["next_url"] = "?" + params.urlencode()
+        if page_obj.has_previous():
+            params["cursor"] = page_obj.previous_cursor
+            context["previous_url"] = "?" + params.urlencode()
+        if request.GET.get("count") == "approx":
+            context["approx_count"], context["count_exact"] = approximate_count(invoices)
+
+        context.update({"invoices": page_obj, "page_obj": page_obj, "cursor_mode": True})
+        return render(request, "invoices/inv_list.html", context)
+
+    paginator = Paginator(invoices, per_page)
+    page_number = request.GET.get("page")
+    page_obj = paginator.get_page(page_number)
+
+    context.update({"invoices": page_obj, "page_obj": page_obj})
     return render(request, "invoices/inv_list.html", context)
 
 
+def inv_export_pdf(request):
+    """
+    Download the PDFs of every invoice matching the inv_list filters as a ZIP.
+    Cache misses are rendered in the worker pool and the archive is streamed
+    as each PDF completes, so memory stays flat however many invoices match.
+    """
+    invoices, _, _, _ = filter_invoices(request.GET)
+    invoices = invoices.prefetch_related('lines')
+    pdfs = render_many(invoices.iterator(chunk_size=200), request.build_absolute_uri("/"))
+    files = ((f"invoice_{invoice.folio}.pdf", pdf_bytes) for invoice, pdf_bytes in pdfs)
+
+    response = StreamingHttpResponse(stream_zip(files), content_type="application/zip")
+    response['Content-Disposition'] = 'attachment; filename="invoices.zip"'
+    return response
+
+
+def inv_statement(request):
+    """
+    One PDF with every invoice matching the inv_list filters, oldest first;
+    ?month=YYYY-MM narrows it to a month. Above
+    INVOICE_STATEMENT_MAX_INVOICES use the render_statement command.
+    """
+    invoices, _, _, _ = filter_invoices(request.GET)
+    month = request.GET.get('month', '').strip()
+    if month:
+        try:
+            invoices = filter_month(invoices, month)
+        except ValueError:
+            messages.error(request, "Mes inválido, usa el formato AAAA-MM.")
+            return redirect('inv_list')
+
+    limit = settings.INVOICE_STATEMENT_MAX_INVOICES
+    selected = list(invoices.order_by('date', 'id').prefetch_related('lines')[:limit + 1])
+    if not selected:
+        messages.error(request, "No hay facturas para el estado de cuenta.")
+        return redirect('inv_list')
+    if len(selected) > limit:
+        messages.error(request, f"El estado de cuenta admite hasta {limit} facturas; usa el comando render_statement.")
+        return redirect('inv_list')
+
+    pdf_bytes = StatementRenderer(selected).write_pdf(request.build_absolute_uri('/'))
+    response = HttpResponse(pdf_bytes, content_type="application/pdf")
+    response['Content-Disposition'] = (
+        f'attachment; filename="statement_{month or timezone.localdate().isoformat()}.pdf"'
+    )
+    return response
+
+
+def inv_export(request):
+    """
+    Download the invoices matching the inv_list filters as a spreadsheet:
+    ?format=csv (default) or xlsx, ?rows=invoices (default) or lines for one
+    row per product line. Rows are streamed as they are read.
+    """
+    invoices, _, _, _ = filter_invoices(request.GET)
+    mode = request.GET.get('rows', 'invoices')
+    if mode not in MODES:
+        mode = 'invoices'
+    rows = export_rows(invoices, mode)
+
+    if request.GET.get('format') == 'xlsx':
+        response = StreamingHttpResponse(stream_xlsx(rows), content_type=XLSX_CONTENT_TYPE)
+        extension = 'xlsx'
+    else:
+        response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+        extension = 'csv'
+    response['Content-Disposition'] = (
+        f'attachment; filename="{mode}_{timezone.localdate().isoformat()}.{extension}"'
+    )
+    return response
+
+
+def inv_import(request):
+    """
+    Upload a CSV or JSONL file of invoices (see invoices.imports).
+    Valid rows are imported; the others are listed with their errors.
+    For very large files use the import_invoices command instead.
+    """
+    context = {'formats': sorted(READERS)}
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if not upload:
+            messages.error(request, "Selecciona un archivo para importar.")
+            return render(request, 'invoices/inv_import.html', context)
+
+        file_format = request.POST.get('format')
+        if file_format not in READERS:
+            file_format = 'jsonl' if upload.name.endswith(('.jsonl', '.json')) else 'csv'
+        source = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            result = import_invoices(READERS[file_format](source), dry_run='dry_run' in request.POST)
+        except (UnicodeDecodeError, csv.Error) as e:
+            messages.error(request, f"No se pudo leer el archivo: {e}")
+            return render(request, 'invoices/inv_import.html', context)
+
+        if result.created:
+            action = "validaron" if 'dry_run' in request.POST else "importaron"
+            messages.success(request, f"Se {action} {result.created} de {result.rows} facturas.")
+        if result.errors:
+            messages.error(request, f"{len(result.errors)} filas con errores.")
+        context.update({'result': result, 'errors': result.errors[:500]})
+
+    return render(request, 'invoices/inv_import.html', context)
+
+
 def inv_crt(request):
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' and request.method == 'POST':
         # Handle AJAX request for adding products
@@ -233,11 +320,12 @@ def inv_crt(request):
         else:
             # Debug: print form errors
             print("Form errors:", form.errors)
-    
-    form = InvoiceForm()
+    else:
+        form = InvoiceForm()
     return render(request, 'invoices/inv_crt.html', {
         'form': form,
-        'default_tax_rate': Invoice._meta.get_field('tax_rate').default
+        'default_tax_rate': Invoice._meta.get_field('tax_rate').default,
+        'pricing_spec': PRICING_SPEC,
     })
 
 
@@ -250,23 +338,24 @@ def inv_edit(request, pk):
             data = json.loads(request.body)
             action = data.get('action')
             
+            # Both actions go through apply_line_ops and answer with its delta
+            # (the affected line and the new totals), like inv_edit_lines
             if action == 'add_product':
-                product_data = {
+                result = apply_line_ops(invoice, [{
+                    'op': 'add',
                     'name': data.get('name', ''),
-                    'price': Decimal(data.get('price', 0)),
-                    'quantity': int(data.get('quantity', 1)),
-                    'discount_percent': Decimal(data.get('discount_percent', 0)),
-                }
-                invoice.add_product(product_data)
-                invoice.save()
-                return JsonResponse({'success': True, 'products': invoice.products})
+                    'price': data.get('price', 0),
+                    'quantity': data.get('quantity', 1),
+                    'discount_percent': data.get('discount_percent', 0),
+                }], version=data.get('version'))
+                return JsonResponse({'success': True, **result})
             
             elif action == 'remove_product':
                 index = int(data.get('index', -1))
-                if 0 <= index < len(invoice.products):
-                    invoice.products.pop(index)
-                    invoice.save()
-                    return JsonResponse({'success': True, 'products': invoice.products})
+                line_ids = invoice.lines.values_list('pk', flat=True)[index:index + 1] if index >= 0 else []
+                if line_ids:
+                    result = apply_line_ops(invoice, [{'op': 'remove', 'id': line_ids[0]}], version=data.get('version'))
+                    return JsonResponse({'success': True, **result})
                 return JsonResponse({'success': False, 'error': 'Invalid index'})
                 
         except Exception as e:
@@ -276,20 +365,123 @@ def inv_edit(request, pk):
         form = InvoiceForm(request.POST, instance=invoice)
         if form.is_valid():
             # Use the form's save method which handles products via products_json
-            updated_invoice = form.save()
+            try:
+                updated_invoice = form.save()
+            except VersionConflict:
+                messages.error(
+                    request,
+                    "La factura fue modificada por otro usuario mientras la editabas. "
+                    "Revisa los datos actuales y vuelve a guardar tus cambios.",
+                )
+                return redirect('inv_edit', pk=invoice.pk)
             # Redirect to the invoice template with download parameter
             return redirect(f'{reverse("inv_template")}?id={updated_invoice.id}&download=true')
         else:
             # Form is invalid, but we want to preserve the data
             print("Form errors:", form.errors)
             # Continue to render the form with errors
+    else:
+        form = InvoiceForm(instance=invoice)
     
     # For GET requests or invalid POST, show the form with current data
-    form = InvoiceForm(instance=invoice)
     return render(request, 'invoices/inv_edit.html', {
         'form': form,
         'invoice': invoice,
-        'default_tax_rate': Invoice._meta.get_field('tax_rate').default
+        'default_tax_rate': Invoice._meta.get_field('tax_rate').default,
+        'pricing_spec': PRICING_SPEC,
+    })
+
+
+def inv_edit_lines(request, pk):
+    """
+    Incremental line edits: PATCH (or POST) {"version": n, "ops": [...]}.
+    Responds with the changed lines and the new totals only; see
+    invoices.line_edits for the operations. A stale version answers 409 with
+    the current version so the client can reload.
+    """
+    if request.method not in ('PATCH', 'POST'):
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    invoice = get_object_or_404(Invoice, pk=pk)
+    try:
+        data = json.loads(request.body)
+        result = apply_line_ops(invoice, data.get('ops'), version=data.get('version'))
+    except VersionConflict:
+        invoice.refresh_from_db()
+        return JsonResponse({
+            'success': False,
+            'error': 'La factura fue modificada por otro usuario',
+            'version': invoice.version,
+        }, status=409)
+    except (LineEditError, ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({'success': True, **result})
+
+
+def _report_params(request):
+    """period, dimension, start, end and currency from the query string"""
+    period = request.GET.get("period", "month")
+    if period not in ("day", "month"):
+        period = "month"
+    dimension = request.GET.get("dimension", "all")
+    if dimension not in dict(SalesRollup.DIMENSIONS):
+        dimension = "all"
+    dates = {}
+    for name in ("start", "end"):
+        try:
+            dates[name] = date.fromisoformat(request.GET[name]) if request.GET.get(name) else None
+        except ValueError:
+            dates[name] = None
+    return {
+        "period": period,
+        "dimension": dimension,
+        "currency": request.GET.get("currency") or None,
+        **dates,
+    }
+
+
+def inv_reports(request):
+    """Sales dashboard; reads the SalesRollup tables only"""
+    today = timezone.localdate()
+    month_start = today.replace(day=1)
+    months = sales_report("month", "all", start=date(today.year - 1, today.month, 1))
+
+    breakdowns = {
+        label: summarize(sales_report("month", dimension, start=month_start, end=month_start))[:10]
+        for dimension, label in SalesRollup.DIMENSIONS if dimension != "all"
+    }
+    return render(request, "invoices/inv_reports.html", {
+        "months": months,
+        "breakdowns": breakdowns,
+        "month_start": month_start,
+    })
+
+
+def inv_reports_json(request):
+    """
+    Rollup rows as JSON: ?period=day|month&dimension=all|seller|client|payment_method
+    &start=YYYY-MM-DD&end=YYYY-MM-DD&currency=MXN|USD
+    """
+    params = _report_params(request)
+    rows = sales_report(**params)[:1000]
+    return JsonResponse({
+        "period": params["period"],
+        "dimension": params["dimension"],
+        "rows": [
+            {
+                "period_start": row.period_start.isoformat(),
+                "key": row.key,
+                "currency": row.currency,
+                "invoice_count": row.invoice_count,
+                "subtotal": str(row.subtotal),
+                "total_discount": str(row.total_discount),
+                "total_tax": str(row.total_tax),
+                "total": str(row.total),
+                "total_base": str(row.total_base),
+            }
+            for row in rows
+        ],
     })
 
 
@@ -1,6 +1,6 @@
 from django.shortcuts import render
 from pages.forms import ContactForm
-from django.core.mail import send_mail
+from invoices.outbox import enqueue_email
 
 # Create your views here.
 
@@ -26,7 +26,7 @@ def contact_form_view(request):
             )
 
             try:
-                send_mail(
+                enqueue_email(
                     "Email from Portfolio",
                     message_body,
                     email,  # From email
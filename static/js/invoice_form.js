@@ -0,0 +1,67 @@
+/*
+ * Live totals for the invoice create/edit forms.
+ *
+ * Prices the product rows with InvoicePricing (static/js/pricing.js) and the
+ * spec the page embeds as #pricing-spec, so no server round trip is needed
+ * while typing. The totals saved by the server remain authoritative.
+ */
+(function () {
+    'use strict';
+
+    function field(name) {
+        const input = document.getElementById('id_' + name);
+        return input ? input.value : undefined;
+    }
+
+    function readRows() {
+        return Array.from(document.querySelectorAll('.product-row')).map(row => ({
+            row: row,
+            line: {
+                price: row.querySelector('.price-input').value,
+                quantity: parseInt(row.querySelector('.quantity-input').value, 10) || 0,
+                discount_percent: row.querySelector('.discount-input').value,
+            },
+        }));
+    }
+
+    function setText(id, value) {
+        const element = document.getElementById(id);
+        if (element) {
+            element.textContent = value;
+        }
+    }
+
+    window.updateInvoiceTotals = function () {
+        const specElement = document.getElementById('pricing-spec');
+        if (!specElement) {
+            return;
+        }
+        const spec = JSON.parse(specElement.textContent);
+        const rows = readRows();
+        const invoice = {
+            tax_rate: field('tax_rate'),
+            currency: field('currency'),
+            exchange_rate: field('exchange_rate'),
+        };
+        const result = InvoicePricing.calculate(spec, rows.map(item => item.line), invoice);
+
+        rows.forEach((item, index) => {
+            item.row.querySelector('.row-total').textContent = '$' + result.lines[index].total;
+        });
+        setText('subtotal', '$' + result.totals.subtotal);
+        setText('totalDiscount', '$' + result.totals.discount);
+        setText('totalTax', '$' + result.totals.tax);
+        setText('grandTotal', '$' + result.totals.total);
+        setText('totalBase', '$' + result.totals.total_base + ' ' + spec.base_currency);
+    };
+
+    document.addEventListener('DOMContentLoaded', function () {
+        ['tax_rate', 'currency', 'exchange_rate'].forEach(name => {
+            const input = document.getElementById('id_' + name);
+            if (input) {
+                input.addEventListener('input', window.updateInvoiceTotals);
+                input.addEventListener('change', window.updateInvoiceTotals);
+            }
+        });
+    });
+})();
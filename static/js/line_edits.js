@@ -0,0 +1,199 @@
+/*
+ * Saves product row edits on the invoice edit page as they happen.
+ *
+ * Changed rows are sent as add/update/remove operations to the incremental
+ * line API (inv_edit_lines, see invoices/line_edits.py) instead of waiting
+ * for the whole form. Each response carries the new Invoice.version, which is
+ * copied to the form's hidden version field so the final submit passes the
+ * server's compare-and-set check. A 409 means someone else changed the
+ * invoice; the page reloads with their data.
+ */
+(function () {
+    'use strict';
+
+    const DELAY = 400; // ms of quiet before a batch is sent
+
+    function LineSync(form) {
+        this.form = form;
+        this.url = form.dataset.linesUrl;
+        this.versionInput = document.getElementById('id_version');
+        this.pending = new Map(); // row -> operation, at most one per row
+        this.removed = [];
+        this.inFlight = null;
+        this.timer = null;
+        this.nextRef = 1;
+        this.setVersion(parseInt(form.dataset.version, 10));
+    }
+
+    LineSync.prototype.setVersion = function (version) {
+        this.version = version;
+        this.form.dataset.version = version;
+        if (this.versionInput) {
+            this.versionInput.value = version;
+        }
+    };
+
+    LineSync.prototype.values = function (row) {
+        return {
+            name: row.querySelector('input[name="product_name"]').value.trim(),
+            quantity: row.querySelector('.quantity-input').value,
+            discount_percent: row.querySelector('.discount-input').value || '0',
+            price: row.querySelector('.price-input').value,
+        };
+    };
+
+    LineSync.prototype.rowChanged = function (row) {
+        const values = this.values(row);
+        if (!values.name || !values.quantity || !values.price) {
+            return; // Incomplete rows are sent once they are filled in
+        }
+        if (row.dataset.lineId) {
+            this.pending.set(row, Object.assign({op: 'update', id: parseInt(row.dataset.lineId, 10)}, values));
+        } else if (!row.dataset.ref) {
+            row.dataset.ref = 'new-' + this.nextRef++;
+            this.pending.set(row, Object.assign({op: 'add', ref: row.dataset.ref}, values));
+        } else if (this.pending.has(row)) {
+            // Still unsent: send the latest values with the add
+            this.pending.set(row, Object.assign({op: 'add', ref: row.dataset.ref}, values));
+        } else {
+            // Sent but not answered yet; updated once its id comes back
+            row.dataset.dirty = '1';
+            return;
+        }
+        this.schedule();
+    };
+
+    LineSync.prototype.rowRemoved = function (row) {
+        this.pending.delete(row);
+        if (row.dataset.lineId) {
+            this.removed.push({op: 'remove', id: parseInt(row.dataset.lineId, 10)});
+            this.schedule();
+        }
+        // A row whose add is in flight is removed once its id comes back
+    };
+
+    LineSync.prototype.schedule = function () {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.send(), DELAY);
+    };
+
+    LineSync.prototype.busy = function () {
+        return this.inFlight !== null || this.pending.size > 0 || this.removed.length > 0;
+    };
+
+    LineSync.prototype.send = function () {
+        clearTimeout(this.timer);
+        if (this.inFlight) {
+            return this.inFlight.then(() => this.send());
+        }
+        const rows = Array.from(this.pending.keys());
+        const ops = [...this.removed, ...rows.map(row => this.pending.get(row))];
+        if (!ops.length) {
+            return Promise.resolve();
+        }
+        this.pending.clear();
+        this.removed = [];
+
+        const csrf = this.form.querySelector('input[name="csrfmiddlewaretoken"]').value;
+        this.inFlight = fetch(this.url, {
+            method: 'PATCH',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrf},
+            body: JSON.stringify({version: this.version, ops: ops}),
+        })
+            .then(response => response.json().then(data => ({status: response.status, data: data})))
+            .then(({status, data}) => {
+                this.inFlight = null;
+                if (status === 409) {
+                    alert(data.error);
+                    window.location.reload();
+                    return;
+                }
+                if (!data.success) {
+                    this.failed(rows);
+                    alert(data.error);
+                    return;
+                }
+                rows.forEach(row => { row.style.border = ''; });
+                this.applied(data);
+            })
+            .catch(() => {
+                this.inFlight = null;
+                this.failed(rows);
+                alert('No se pudieron guardar los productos. Revisa tu conexión.');
+            });
+        return this.inFlight;
+    };
+
+    LineSync.prototype.failed = function (rows) {
+        // Nothing was written; rows are sent again on their next change
+        rows.forEach(row => {
+            row.style.border = '2px solid red';
+            if (!row.dataset.lineId) {
+                delete row.dataset.ref;
+                delete row.dataset.dirty;
+            }
+        });
+    };
+
+    LineSync.prototype.applied = function (data) {
+        this.setVersion(data.version);
+        const byRef = {};
+        data.lines.forEach(line => {
+            if (line.ref) {
+                byRef[line.ref] = line;
+            }
+        });
+        let followUp = false;
+        this.form.querySelectorAll('.product-row[data-ref]').forEach(row => {
+            const line = byRef[row.dataset.ref];
+            if (!line) {
+                return;
+            }
+            row.dataset.lineId = line.id;
+            delete row.dataset.ref;
+            if (row.dataset.dirty) {
+                delete row.dataset.dirty;
+                this.rowChanged(row);
+                followUp = true;
+            }
+        });
+        // Rows deleted while their add was in flight
+        Object.values(byRef).forEach(line => {
+            if (!this.form.querySelector('.product-row[data-line-id="' + line.id + '"]')) {
+                this.removed.push({op: 'remove', id: line.id});
+                followUp = true;
+            }
+        });
+        if (followUp) {
+            this.schedule();
+        }
+    };
+
+    document.addEventListener('DOMContentLoaded', function () {
+        const form = document.getElementById('invoiceForm');
+        if (!form || !form.dataset.linesUrl) {
+            return;
+        }
+        const sync = window.lineSync = new LineSync(form);
+
+        form.addEventListener('change', function (e) {
+            const row = e.target.closest('.product-row');
+            if (row) {
+                sync.rowChanged(row);
+            }
+        });
+
+        // Let the last batch land first so the form carries the latest version
+        form.addEventListener('submit', function (e) {
+            if (sync.busy()) {
+                e.preventDefault();
+                e.stopImmediatePropagation();
+                sync.send().then(() => {
+                    if (!sync.busy()) {
+                        form.requestSubmit();
+                    }
+                });
+            }
+        });
+    });
+})();
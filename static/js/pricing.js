@@ -0,0 +1,165 @@
+/*
+ * Invoice pricing engine for the browser.
+ *
+ * Evaluates the same PRICING_SPEC as invoices/pricing.py (rendered into the
+ * page with json_script). Numbers are exact decimals (BigInt + scale), so the
+ * live totals match what the server will save, cent for cent.
+ */
+(function (root, factory) {
+    if (typeof module === 'object' && module.exports) {
+        module.exports = factory();
+    } else {
+        root.InvoicePricing = factory();
+    }
+})(this, function () {
+    'use strict';
+
+    const NUMBER = /^([+-]?)(\d*)(?:\.(\d*))?(?:[eE]([+-]?\d+))?$/;
+
+    function pow10(n) {
+        return 10n ** BigInt(n);
+    }
+
+    // Exact decimal: value = n / 10^s
+    function dec(n, s) {
+        return { n: n, s: s };
+    }
+
+    // Parse user input like Invoice._safe_decimal: invalid or empty -> fallback
+    function parse(value, fallback) {
+        if (typeof value === 'object' && value !== null && 'n' in value) {
+            return value;
+        }
+        const match = NUMBER.exec(String(value === undefined || value === null ? '' : value).trim());
+        if (!match || (match[2] === '' && !match[3])) {
+            return fallback === undefined ? dec(0n, 0) : parse(fallback);
+        }
+        const fraction = match[3] || '';
+        let n = BigInt((match[2] || '0') + fraction);
+        let s = fraction.length - parseInt(match[4] || '0', 10);
+        if (s < 0) {
+            n *= pow10(-s);
+            s = 0;
+        }
+        return dec(match[1] === '-' ? -n : n, s);
+    }
+
+    function align(a, b) {
+        const s = Math.max(a.s, b.s);
+        return [a.n * pow10(s - a.s), b.n * pow10(s - b.s), s];
+    }
+
+    function add(a, b) {
+        const [x, y, s] = align(a, b);
+        return dec(x + y, s);
+    }
+
+    function sub(a, b) {
+        const [x, y, s] = align(a, b);
+        return dec(x - y, s);
+    }
+
+    function mul(a, b) {
+        return dec(a.n * b.n, a.s + b.s);
+    }
+
+    function gt(a, b) {
+        const [x, y] = align(a, b);
+        return x > y;
+    }
+
+    function isTrue(value) {
+        return typeof value === 'object' ? value.n !== 0n : Boolean(value);
+    }
+
+    // ROUND_HALF_UP: ties go away from zero, like Python's decimal module
+    function round(a, places) {
+        if (a.s <= places) {
+            return dec(a.n * pow10(places - a.s), places);
+        }
+        const divisor = pow10(a.s - places);
+        let q = a.n / divisor;
+        const r = a.n % divisor;
+        if (2n * (r < 0n ? -r : r) >= divisor) {
+            q += a.n < 0n ? -1n : 1n;
+        }
+        return dec(q, places);
+    }
+
+    function format(a, places) {
+        const value = round(a, places);
+        const negative = value.n < 0n;
+        const digits = (negative ? -value.n : value.n).toString().padStart(places + 1, '0');
+        const whole = digits.slice(0, digits.length - places);
+        const fraction = places ? '.' + digits.slice(digits.length - places) : '';
+        return (negative ? '-' : '') + whole + fraction;
+    }
+
+    function evaluate(expr, scope) {
+        if (typeof expr === 'string') {
+            return expr in scope ? scope[expr] : parse(expr);
+        }
+        const op = expr[0];
+        const args = expr.slice(1);
+        if (op === 'sum') {
+            return scope.lines.reduce((total, line) => add(total, line[args[0]]), dec(0n, 0));
+        }
+        if (op === 'if') {
+            return isTrue(evaluate(args[0], scope)) ? evaluate(args[1], scope) : evaluate(args[2], scope);
+        }
+        const a = evaluate(args[0], scope);
+        const b = evaluate(args[1], scope);
+        switch (op) {
+            case 'add': return add(a, b);
+            case 'sub': return sub(a, b);
+            case 'mul': return mul(a, b);
+            case 'percent': return dec(mul(a, b).n, a.s + b.s + 2);
+            case 'gt': return gt(a, b);
+        }
+        throw new Error('Unknown pricing operation: ' + op);
+    }
+
+    function run(spec, steps, scope) {
+        steps.forEach(step => {
+            scope[step.name] = round(evaluate(step.expr, scope), spec.decimal_places);
+        });
+        const result = {};
+        steps.forEach(step => { result[step.name] = scope[step.name]; });
+        return result;
+    }
+
+    function priceLine(spec, line, taxRate) {
+        return run(spec, spec.line, {
+            price: parse(line.price),
+            quantity: parse(line.quantity, 1),
+            discount_percent: parse(line.discount_percent),
+            discount_amount: parse(line.discount_amount),
+            taxable: line.taxable === undefined ? true : Boolean(line.taxable),
+            tax_rate: parse(taxRate),
+        });
+    }
+
+    function priceTotals(spec, pricedLines, invoice) {
+        return run(spec, spec.totals, {
+            lines: pricedLines,
+            exchange_rate: parse(invoice.exchange_rate),
+            foreign_currency: (invoice.currency || spec.base_currency) !== spec.base_currency,
+        });
+    }
+
+    // Price a whole invoice; amounts come back as fixed-point strings
+    function calculate(spec, lines, invoice) {
+        const priced = lines.map(line => priceLine(spec, line, invoice.tax_rate));
+        const totals = priceTotals(spec, priced, invoice);
+        const asStrings = amounts => {
+            const result = {};
+            Object.keys(amounts).forEach(name => {
+                result[name] = format(amounts[name], spec.decimal_places);
+            });
+            return result;
+        };
+        return { lines: priced.map(asStrings), totals: asStrings(totals) };
+    }
+
+    return { parse: parse, format: format, priceLine: priceLine, priceTotals: priceTotals, calculate: calculate };
+});